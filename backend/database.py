@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -20,6 +20,17 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+def lock_for_write(db):
+    """
+    SQLite: abre la transacción con BEGIN IMMEDIATE (lock de escritura desde el
+    inicio). Para escritores en segundo plano que leen y después escriben: con un
+    BEGIN diferido, SQLite devuelve 'database is locked' sin esperar si otro
+    proceso escribe en el medio. Llamar antes de la primera escritura (pysqlite
+    no abre transacción para los SELECT previos).
+    """
+    if db.get_bind().dialect.name == "sqlite":
+        db.execute(text("BEGIN IMMEDIATE"))
+
 def get_db():
     db = SessionLocal()
     try:
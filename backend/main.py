@@ -1,8 +1,11 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Security, Query
+from fastapi import FastAPI, Depends, HTTPException, status, Security, Query, Request, Response
 from fastapi.security import APIKeyHeader
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session, joinedload
-from typing import List, Optional
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from sqlalchemy import func, insert, text, tuple_, update
+from typing import List, Optional, Union
 from dotenv import load_dotenv
 import os
 from pydantic import BaseModel
@@ -12,12 +15,22 @@ load_dotenv()
 
 import models, schemas, database, services.payment, services.shipping, services.email, services.integration
 import services.integration
-import uuid
-import unicodedata
+import services.search
+import services.suggest
+import services.catalog
+import services.product_sync
+import services.webhook_queue
+import services.outbox
+import services.inventory
+import services.payment_status
+import hashlib
+import hmac
+import base64
 from routers import admin, auth, labels, size_guides
 
 # Crear tablas en la base de datos al inicio
 models.Base.metadata.create_all(bind=database.engine)
+services.search.ensure_search_index(database.engine)
 
 app = FastAPI(title="Tienda Muy Criollo API", version="0.1.0")
 app.include_router(auth.router)
@@ -25,9 +38,25 @@ app.include_router(admin.router)
 app.include_router(labels.router)
 app.include_router(size_guides.router)
 
+# effective_price of rows written before the column existed (same rule as models.Product)
+EFFECTIVE_PRICE_BACKFILL = """
+    UPDATE products SET effective_price = CASE
+        WHEN price_override IS NOT NULL THEN price_override
+        ELSE price * (1 - COALESCE(discount_percentage, 0) / 100.0)
+    END
+    WHERE effective_price IS NULL
+"""
+
+# Keyset sort indexes on COALESCE(key) (models.NAME_SORT_KEY / PRICE_SORT_KEY)
+SORT_INDEX_MIGRATIONS = [
+    "DROP INDEX IF EXISTS ix_products_name_id",
+    "CREATE INDEX IF NOT EXISTS ix_products_sort_name_id ON products (COALESCE(name, ''), id)",
+    "CREATE INDEX IF NOT EXISTS ix_products_sort_price_id ON products (COALESCE(effective_price, 0), id)",
+]
+
 @app.on_event("startup")
 def startup_event():
-    # Automatic Migration for SQLite
+    # Automatic Migration (SQLite; Postgres only for columns added by recent releases)
     import sqlite3
     try:
         # Assuming database.sqlite is the file or getting from env
@@ -76,6 +105,25 @@ def startup_event():
                      print("⚠️ Migrating DB: Adding 'size_guide_id' to products...")
                      cursor.execute("ALTER TABLE products ADD COLUMN size_guide_id INTEGER REFERENCES size_guides(id)")
                      conn.commit()
+                
+                # 4.1 Products Migration (effective_price + backfill)
+                cursor.execute("PRAGMA table_info(products)")
+                columns_products = [info[1] for info in cursor.fetchall()]
+                if "effective_price" not in columns_products:
+                     print("⚠️ Migrating DB: Adding 'effective_price' to products...")
+                     cursor.execute("ALTER TABLE products ADD COLUMN effective_price REAL")
+                cursor.execute(EFFECTIVE_PRICE_BACKFILL)
+                cursor.execute("CREATE INDEX IF NOT EXISTS ix_products_effective_price_id ON products (effective_price, id)")
+                if "payload_hash" not in columns_products:
+                     print("⚠️ Migrating DB: Adding 'payload_hash' to products...")
+                     cursor.execute("ALTER TABLE products ADD COLUMN payload_hash VARCHAR")
+                conn.commit()
+
+                # Keyset pagination indexes (create_all skips indexes on existing tables);
+                # after 4.1: ix_products_sort_price_id needs effective_price
+                for statement in SORT_INDEX_MIGRATIONS:
+                    cursor.execute(statement)
+                conn.commit()
 
                 # 4.5 Product Variants Migration (attributes)
                 cursor.execute("PRAGMA table_info(product_variants)")
@@ -119,9 +167,35 @@ def startup_event():
                 print(f"❌ Migration error: {e}")
             finally:
                 conn.close()
+        elif database.engine.dialect.name == "postgresql":
+            # Postgres (docker-compose): columns/indexes added since create_all built the tables
+            with database.engine.begin() as conn:
+                conn.execute(text("ALTER TABLE products ADD COLUMN IF NOT EXISTS effective_price DOUBLE PRECISION"))
+                conn.execute(text("ALTER TABLE products ADD COLUMN IF NOT EXISTS payload_hash VARCHAR"))
+                conn.execute(text(EFFECTIVE_PRICE_BACKFILL))
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_products_effective_price_id ON products (effective_price, id)"))
+                for statement in SORT_INDEX_MIGRATIONS:
+                    conn.execute(text(statement))
+                # Reservations outlive deleted products/variants (no FKs, like order_items.variant_id)
+                conn.execute(text("ALTER TABLE stock_reservations DROP CONSTRAINT IF EXISTS stock_reservations_product_id_fkey"))
+                conn.execute(text("ALTER TABLE stock_reservations DROP CONSTRAINT IF EXISTS stock_reservations_variant_id_fkey"))
+            print("✅ Migrations successful.")
     except Exception as e:
         print(f"Startup migration check failed: {e}")
 
+    # Background workers for async product webhooks (mode=async)
+    services.webhook_queue.webhook_queue.start(int(os.getenv("WEBHOOK_WORKERS", "1")))
+    # Delivery of sale events to the management platform
+    services.outbox.dispatcher.start()
+    # Release of expired stock reservations (abandoned checkouts)
+    services.inventory.sweeper.start()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    services.webhook_queue.webhook_queue.stop()
+    services.outbox.dispatcher.stop()
+    services.inventory.sweeper.stop()
+
 # Configuración de CORS
 origins = [
     "http://localhost:3000",
@@ -165,119 +239,58 @@ def sync_products(payload: schemas.ProductSyncRequest, db: Session = Depends(get
     """
     Endpoint para recibir productos desde la Plataforma de Gestión.
     Actualiza (upsert) productos basados en SKU o External ID.
+    Se commitea por tandas: si un ítem falla, el resto se aplica igual y
+    'errors' lista cada SKU rechazado con su motivo.
     """
-    results = {"created": 0, "updated": 0, "errors": 0}
-    
-    for item in payload.products:
+    # Set-based upsert, committed in chunks (see services/product_sync.py)
+    results, synced_ids, failures = services.product_sync.sync_products(db, payload.products)
+    services.catalog.notify_change(db, synced_ids)
+    return {"message": "Sincronización completada", "details": results, "errors": failures}
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse que no escucha 'http.disconnect' en paralelo: el generador
+    lee el cuerpo del request mientras responde y ambos consumirían receive().
+    Un cliente desconectado se detecta igual al leer el cuerpo (ClientDisconnect).
+    """
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+@app.post("/integration/products/sync/stream")
+async def sync_products_stream(request: Request):
+    """
+    Variante streaming del sync para catálogos grandes: el cuerpo es NDJSON
+    (application/x-ndjson, un ProductCreate por línea) y se valida y aplica por
+    tandas a medida que llega. La respuesta también es NDJSON: una línea de
+    progreso por tanda y una final con los totales.
+    """
+    content_type = request.headers.get("content-type", "")
+    if not content_type.startswith("application/x-ndjson"):
+        raise HTTPException(status_code=415, detail="Expected application/x-ndjson")
+
+    async def progress():
+        db = database.SessionLocal()
+        totals = {"created": 0, "updated": 0, "errors": 0}
+        processed = 0
         try:
-            # Buscar producto existente por SKU (unico)
-            # Priorizamos SKU como llave de negocio
-            db_product = db.query(models.Product).filter(models.Product.sku == item.sku).first()
-            
-            if db_product:
-                # Update
-                db_product.name = item.name
-                db_product.description = item.description
-                db_product.price = item.price
-                db_product.stock = item.stock
-                db_product.image_url = item.image_url
-                if item.images:
-                    db_product.images = json.dumps(item.images)
-                db_product.category = item.category
-                db_product.is_active = item.is_active
-                if item.external_id:
-                    db_product.external_id = item.external_id
-                
-                # Update M2M Category (Additive)
-                if item.category:
-                    cat_name = item.category.strip()
-                    if cat_name:
-                        category = db.query(models.Category).filter(models.Category.name == cat_name).first()
-                        if not category:
-                            category = models.Category(name=cat_name)
-                            db.add(category)
-                            db.flush() # Ensure ID
-                        
-                        if category not in db_product.categories:
-                            db_product.categories.append(category)
-
-                results["updated"] += 1
-            else:
-                # Create
-                new_product = models.Product(
-                    id=str(uuid.uuid4()),
-                    external_id=item.external_id,
-                    sku=item.sku,
-                    name=item.name,
-                    description=item.description,
-                    price=item.price,
-                    stock=item.stock,
-                    image_url=item.image_url,
-                    images=json.dumps(item.images) if item.images else "[]",
-                    category=item.category,
-                    is_active=item.is_active
-                )
-                
-                # Handle M2M for new product
-                if item.category:
-                    cat_name = item.category.strip()
-                    if cat_name:
-                        category = db.query(models.Category).filter(models.Category.name == cat_name).first()
-                        if not category:
-                            category = models.Category(name=cat_name)
-                            db.add(category)
-                            db.flush()
-                        new_product.categories.append(category)
-                db.add(new_product)
-                db.flush()
-                db_product = new_product
-                results["created"] += 1
-            
-            # --- Sync Variants (if provided) ---
-            if item.variants:
-                current_variant_skus = [v.sku for v in item.variants]
-                
-                # Delete variants not in payload
-                db.query(models.ProductVariant).filter(
-                    models.ProductVariant.product_id == db_product.id,
-                    models.ProductVariant.sku.notin_(current_variant_skus)
-                ).delete(synchronize_session=False)
-                
-                total_stock = 0
-                for v in item.variants:
-                    db_variant = db.query(models.ProductVariant).filter(
-                        models.ProductVariant.sku == v.sku
-                    ).first()
-                    
-                    if db_variant:
-                        db_variant.stock = v.stock
-                        db_variant.size = v.size
-                        db_variant.color = v.color
-                        db_variant.attributes = json.dumps(v.attributes) if v.attributes else None
-                        db_variant.product_id = db_product.id
-                    else:
-                        db_variant = models.ProductVariant(
-                            product_id=db_product.id,
-                            sku=v.sku,
-                            stock=v.stock,
-                            size=v.size,
-                            color=v.color,
-                            attributes=json.dumps(v.attributes) if v.attributes else None
-                        )
-                        db.add(db_variant)
-                    
-                    total_stock += v.stock
-                
-                # Recalculate total product stock from variants
-                db_product.stock = total_stock
-                
-        except Exception as e:
-            print(f"Error syncing product {item.sku}: {e}")
-            results["errors"] += 1
-            continue
-            
-    db.commit()
-    return {"message": "Sincronización completada", "details": results}
+            async for batch, parse_errors in services.product_sync.ndjson_batches(request.stream()):
+                results, _, failures = await run_in_threadpool(services.product_sync.sync_products, db, batch)
+                processed += len(batch) + len(parse_errors)
+                for key in ("created", "updated"):
+                    totals[key] += results[key]
+                totals["errors"] += len(failures) + len(parse_errors)
+                yield json.dumps({
+                    "processed": processed, "created": results["created"], "updated": results["updated"],
+                    "errors": failures + parse_errors
+                }) + "\n"
+            yield json.dumps({"message": "Sincronización completada", "processed": processed, "details": totals}) + "\n"
+        finally:
+            if totals["created"] or totals["updated"]:
+                # Large pushes: rebuild the catalog snapshot once on the next read
+                services.catalog.notify_change(db)
+            db.close()
+
+    return DuplexStreamingResponse(progress(), media_type="application/x-ndjson")
 
 # Security for Store API (Management Platform)
 store_api_key_header = APIKeyHeader(name="x-store-api-key", auto_error=False)
@@ -293,229 +306,360 @@ async def verify_store_key(api_key: str = Security(store_api_key_header)):
         raise HTTPException(status_code=403, detail="Invalid Store API Key")
     return api_key
 
+WEBHOOK_MODES = ["sync", "async"]
+
 @app.post("/api/webhooks/products", status_code=status.HTTP_200_OK, dependencies=[Depends(verify_store_key)])
-def receive_store_product_update(payload: schemas.ProductUpdatePayload, db: Session = Depends(get_db)):
+def receive_store_product_update(payload: schemas.ProductUpdatePayload, mode: Optional[str] = None,
+                                 db: Session = Depends(get_db)):
     """
     Endpoint EXACTO para recibir actualizaciones desde la Plataforma de Gestión (Webhook).
     - URL: /api/webhooks/products
     - Recibe producto, variantes e imágenes.
     - Actualiza base de datos local (upsert).
+    - Si el payload es idéntico al último aplicado, no escribe nada.
+    - mode=async (o STORE_WEBHOOK_MODE=async): encola y responde 202 con 'job_id';
+      lo aplican los workers de services/webhook_queue.py.
     """
     print(f"📥 Store Webhook received for {payload.name} (SKU: {payload.sku})")
     
-    # 1. Upsert Product
-    db_product = db.query(models.Product).filter(models.Product.id == payload.id).first()
-    
-    images_json = json.dumps(payload.images) if payload.images else "[]"
-    
-    if db_product:
-        # Update
-        db_product.sku = payload.sku
-        db_product.name = payload.name
-        # db_product.price = payload.price # Comentado si queremos mantener precio manual? 
-        # User implies Management Platform is source of truth for BASE price.
-        db_product.price = payload.price 
-        
-        if payload.description:
-            db_product.description = payload.description
-        if payload.image_url:
-            db_product.image_url = payload.image_url
-        
-        db_product.images = images_json # Legacy JSON sync
-        
-        if payload.category:
-            db_product.category = payload.category
-            
-            # Update M2M Category (Additive)
-            cat_name = payload.category.strip()
-            if cat_name:
-                category = db.query(models.Category).filter(models.Category.name == cat_name).first()
-                if not category:
-                    category = models.Category(name=cat_name)
-                    db.add(category)
-                    db.flush()
-                
-                if category not in db_product.categories:
-                    db_product.categories.append(category)
-        
-        # Note: Stock will be recalculated from variants below
-    else:
-        # Create
-        db_product = models.Product(
-            id=payload.id,
-            sku=payload.sku,
-            name=payload.name,
-            description=payload.description,
-            price=payload.price,
-            stock=0, 
-            image_url=payload.image_url,
-            images=images_json,
-            category=payload.category,
-            is_active=True
+    mode = mode or os.getenv("STORE_WEBHOOK_MODE", "sync")
+    if mode not in WEBHOOK_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid mode. Options: {', '.join(WEBHOOK_MODES)}")
+    if mode == "async":
+        job = services.webhook_queue.enqueue(db, payload)
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED,
+            content={"message": "Product update queued", "id": payload.id, "job_id": job.id}
         )
-        
-        # Handle M2M
-        if payload.category:
-            cat_name = payload.category.strip()
-            if cat_name:
-                category = db.query(models.Category).filter(models.Category.name == cat_name).first()
-                if not category:
-                    category = models.Category(name=cat_name)
-                    db.add(category)
-                    db.flush()
-                db_product.categories.append(category)
-        db.add(db_product)
-        db.flush() 
-        
-    # 2. Sync Product Images Table (New Admin System)
-    # Strategy: Delete all existing images for this product and re-insert from payload list
-    # Payload 'images' is list of URLs. Index 0 is Main.
-    
-    # Delete existing
-    db.query(models.ProductImage).filter(models.ProductImage.product_id == db_product.id).delete()
-    
-    # Insert new
-    if payload.images:
-        for idx, img_url in enumerate(payload.images):
-            new_img = models.ProductImage(
-                product_id=db_product.id,
-                url=img_url,
-                display_order=idx,
-                color_variant=None # We don't have color info in simple image list. 
-                # If management platform sends variants with images, we'd need that info. 
-                # For now, simplistic list mapping.
-            )
-            db.add(new_img)
-            
-    # 3. Upsert Variants
-    # We will assume payload variants are the ACTIVE variants. 
-    # Should we delete variants not in payload? Ideally yes to handle deletions.
-    # User says: "Envía... variants: [ { ... } ]"
     
-    current_variant_skus = [v.sku for v in payload.variants]
-    
-    # Delete local variants that are NOT in payload (if any existed)
-    # Only if payload provides variants. If empty list, maybe don't delete everything? 
-    # Assume empty list means no variants (simple product).
-    
-    db.query(models.ProductVariant).filter(
-        models.ProductVariant.product_id == db_product.id,
-        models.ProductVariant.sku.notin_(current_variant_skus)
-    ).delete(synchronize_session=False)
-
-    total_stock = 0
-    for v in payload.variants:
-        db_variant = db.query(models.ProductVariant).filter(models.ProductVariant.sku == v.sku).first()
-        
-        if db_variant:
-            # Update
-            db_variant.stock = v.stock
-            db_variant.size = v.size
-            db_variant.color = v.color
-            db_variant.attributes = json.dumps(v.attributes) if v.attributes else None
-            # Ensure it is linked to this product (fix if sku moved?)
-            db_variant.product_id = db_product.id 
-        else:
-            # Create
-            db_variant = models.ProductVariant(
-                product_id=db_product.id,
-                sku=v.sku,
-                stock=v.stock,
-                size=v.size,
-                color=v.color,
-                attributes=json.dumps(v.attributes) if v.attributes else None
-            )
-            db.add(db_variant)
-        
-        total_stock += v.stock
-        
-    # Update total stock on parent product
-    if payload.variants:
-        db_product.stock = total_stock
+    # Upsert product, images and variants (only rows that differ); no-op if the payload hash is unchanged
+    if not services.product_sync.apply_product_payload(db, payload):
+        return {"message": "Product unchanged", "id": payload.id}
 
+    services.search.index_products(db, [payload.id])
     db.commit()
+    services.catalog.notify_change(db, [payload.id])
     return {"message": "Product synced successfully", "id": payload.id}
 
-def normalize_text(text: str) -> str:
-    if not text: return ""
-    return ''.join(c for c in unicodedata.normalize('NFD', text) if unicodedata.category(c) != 'Mn').lower()
+WEBHOOK_BATCH_MAX = 1000
+
+@app.post("/api/webhooks/products/batch", status_code=status.HTTP_200_OK, dependencies=[Depends(verify_store_key)])
+def receive_store_product_batch(payloads: List[schemas.ProductUpdatePayload], db: Session = Depends(get_db)):
+    """
+    Igual que /api/webhooks/products pero con una lista de productos.
+    Se aplican por tandas en pocas transacciones; un ítem con error no afecta
+    al resto. Retorna el resultado de cada ítem (updated / unchanged / error).
+    """
+    if len(payloads) > WEBHOOK_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {WEBHOOK_BATCH_MAX} products)")
+    print(f"📥 Store Webhook batch received ({len(payloads)} products)")
+
+    results, changed_ids = services.product_sync.apply_product_batch(db, payloads)
+    services.catalog.notify_change(db, changed_ids)
+    counts = {status_name: sum(1 for r in results if r["status"] == status_name)
+              for status_name in ("updated", "unchanged", "error")}
+    return {"message": "Batch processed", "details": counts, "results": results}
+
+@app.get("/api/webhooks/jobs/{job_id}", response_model=schemas.WebhookJob, dependencies=[Depends(verify_store_key)])
+def get_webhook_job(job_id: int, db: Session = Depends(get_db)):
+    """
+    Estado de un webhook encolado con mode=async.
+    """
+    job = db.query(models.WebhookJob).filter(models.WebhookJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [value.strip().removeprefix("W/") for value in header.split(",")]
+    return "*" in candidates or etag in candidates
+
+def _cached_response(request: Request, etag: str, build_payload):
+    """
+    304 si el cliente ya tiene la versión (If-None-Match), si no JSON con ETag.
+    build_payload solo se ejecuta cuando hace falta el cuerpo.
+    """
+    headers = {"ETag": etag, "Cache-Control": services.catalog.cache_control()}
+    if _etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return JSONResponse(build_payload(), headers=headers)
 
 @app.get("/products/categories", response_model=List[str])
-def get_categories(db: Session = Depends(get_db)):
+def get_categories(request: Request, db: Session = Depends(get_db)):
+    """
+    Obtiene lista de categorías únicas de productos activos (desde el snapshot).
+    """
+    snapshot = services.catalog.catalog_cache.get(db)
+    return _cached_response(request, snapshot.categories_etag, lambda: list(snapshot.categories))
+
+@app.get("/products/suggest", response_model=schemas.SuggestResponse)
+def suggest_products(q: str = "", limit: int = Query(5, ge=1, le=20), db: Session = Depends(get_db)):
     """
-    Obtiene lista de categorías únicas de productos activos.
+    Autocompletar: nombres de productos, categorías y etiquetas que empiezan con 'q'.
+    Se resuelve desde un índice en memoria, sin consultar la base.
     """
-    categories = db.query(models.Category.name).join(models.Product.categories).filter(
-        models.Product.is_active == True
-    ).distinct().all()
-    # categories is list of tuples
-    return sorted([c[0] for c in categories if c[0]])
+    suggestions = services.suggest.suggest_index.suggest(db, q, limit)
+    return {
+        "query": q,
+        "products": suggestions["product"],
+        "categories": suggestions["category"],
+        "labels": suggestions["label"]
+    }
+
+def _search_product_ids(db: Session, search: str) -> List[str]:
+    """
+    Ids de productos activos que coinciden con 'search' (exacto; si no hay
+    resultados, tolerante a errores de tipeo), sin paginar.
+    """
+    active = models.Product.is_active == True
+    matches = services.search.match_products(db, search)
+    if matches is None and services.search.SEARCH_BACKEND is None:
+        candidates = db.query(models.Product).filter(active).all()
+        return [p.id for p in services.search.scan_products(candidates, search)]
+
+    ids = []
+    if matches is not None:
+        ids = [row[0] for row in db.query(models.Product.id).filter(active).join(
+            matches, matches.c.product_id == models.Product.id
+        )]
+    if not ids:
+        fuzzy = services.search.fuzzy_match_products(db, search)
+        if fuzzy is not None:
+            ids = [row[0] for row in db.query(models.Product.id).filter(active).join(
+                fuzzy, fuzzy.c.product_id == models.Product.id
+            )]
+    return ids
 
-@app.get("/products", response_model=schemas.ProductListResponse)
+@app.get("/products/facets", response_model=schemas.ProductFacets)
+def get_product_facets(
+    request: Request,
+    categories: Optional[List[str]] = Query(None, alias="category"),
+    search: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Conteos para los filtros de la tienda (categorías, etiquetas, rangos de precio
+    y stock) en el contexto de los mismos parámetros que GET /products.
+    Solo la búsqueda va a SQL (ids); los conteos salen del snapshot en una pasada.
+    """
+    snapshot = services.catalog.catalog_cache.get(db)
+    etag = snapshot.list_etag(request.query_params.multi_items())
+    if _etag_matches(request, etag):
+        return _cached_response(request, etag, None)
+
+    product_ids = _search_product_ids(db, search) if search else None
+    if product_ids:
+        missing = [pid for pid in product_ids if pid not in snapshot.products]
+        if missing:
+            snapshot = services.catalog.catalog_cache.refresh(db, missing) or services.catalog.catalog_cache.get(db)
+
+    facets = services.catalog.facet_counts(snapshot, product_ids, categories, min_price, max_price)
+    return _cached_response(request, etag, lambda: facets)
+
+PRODUCT_SORTS = ["relevance", "name", "price_asc", "price_desc"]
+
+def encode_cursor(sort: str, key, product_id: str) -> str:
+    raw = json.dumps([sort, key, product_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        sort, key, product_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return sort, key, product_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _sort_column(sort: Optional[str], relevance_column=None):
+    """
+    Columna de orden (y si es descendente) para 'sort'. El desempate es siempre Product.id.
+    Nombre y precio van con COALESCE (models.NAME_SORT_KEY / PRICE_SORT_KEY): sin
+    claves NULL, el seek por cursor no corta la paginación en la primera fila NULL.
+    """
+    if sort == "relevance" and relevance_column is not None:
+        return relevance_column, True
+    if sort == "name":
+        return models.NAME_SORT_KEY, False
+    if sort == "price_asc":
+        return models.PRICE_SORT_KEY, False
+    if sort == "price_desc":
+        return models.PRICE_SORT_KEY, True
+    return None, False
+
+def _page_product_ids(id_query, skip: int, limit: int, sort: Optional[str] = None, relevance_column=None,
+                      cursor=None, include_total: bool = True):
+    """
+    Pagina un query sobre Product.id (ya filtrado). Retorna (ids, total, next_cursor).
+    - Modo offset (skip): el total sale de COUNT(*) OVER () en el mismo query.
+    - Modo keyset (cursor): WHERE (sort_key, id) > cursor, resuelto sobre el índice; total aparte.
+    next_cursor solo existe cuando hay columna de orden y quedan más filas.
+    """
+    sort_column, descending = _sort_column(sort, relevance_column)
+    page_query = id_query
+    if sort_column is not None:
+        # Tie-break follows the key direction so (key, id) is a single index range
+        page_query = page_query.add_columns(sort_column.label("sort_key")).order_by(
+            *((sort_column.desc(), models.Product.id.desc()) if descending else (sort_column, models.Product.id))
+        )
+
+    if cursor is not None:
+        if sort_column is None:
+            raise HTTPException(status_code=400, detail="Cursor pagination requires a sort")
+        _, key, last_id = cursor
+        # Row-value comparison on (sort_key, id); the redundant bound on the key
+        # alone lets SQLite seek the (expression) index instead of scanning it
+        if descending:
+            seek = (sort_column <= key, tuple_(sort_column, models.Product.id) < tuple_(key, last_id))
+        else:
+            seek = (sort_column >= key, tuple_(sort_column, models.Product.id) > tuple_(key, last_id))
+        page_query = page_query.filter(*seek)
+        rows = page_query.limit(limit + 1).all()
+        total = id_query.order_by(None).count() if include_total else None
+    else:
+        if include_total:
+            page_query = page_query.add_columns(func.count().over().label("total"))
+        rows = page_query.offset(skip).limit(limit + 1).all()
+        if not include_total:
+            total = None
+        elif rows:
+            total = rows[0].total
+        elif skip:
+            # Page past the end: the window gives no total, count separately
+            total = id_query.order_by(None).count()
+        else:
+            total = 0
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        if sort_column is not None:
+            next_cursor = encode_cursor(sort, rows[-1].sort_key, rows[-1].id)
+    return [row.id for row in rows], total, next_cursor
+
+PRODUCT_VIEWS = ["full", "card"]
+
+@app.get("/products", response_model=Union[schemas.ProductListResponse, schemas.ProductCardListResponse])
 def get_products(
+    request: Request,
     skip: int = 0, 
     limit: int = 20, 
     categories: Optional[List[str]] = Query(None, alias="category"), 
     search: Optional[str] = None,
     min_price: Optional[float] = None,
     max_price: Optional[float] = None,
+    sort: Optional[str] = None,
+    after: Optional[str] = None,
+    include_total: bool = True,
+    view: str = "full",
     db: Session = Depends(get_db)
 ):
-    query = db.query(models.Product).filter(models.Product.is_active == True).options(
-        joinedload(models.Product.categories),
-        joinedload(models.Product.labels)
-    )
-    
+    """
+    Lista productos activos paginados.
+    - sort=relevance: ordena por puntaje de búsqueda (nombre > categoría > descripción).
+      Es el orden por defecto cuando hay 'search'.
+    - sort=name: orden alfabético. sort=price_asc|price_desc: por precio final (effective_price).
+    - min_price / max_price filtran por precio final.
+    - after=<cursor>: paginación keyset con el 'next_cursor' de la página anterior
+      (requiere un sort; skip se ignora). include_total=false evita el conteo.
+    - view=card: items compactos (schemas.ProductSummary) para la grilla.
+    """
+    if sort is not None and sort not in PRODUCT_SORTS:
+        raise HTTPException(status_code=400, detail=f"Invalid sort. Options: {', '.join(PRODUCT_SORTS)}")
+    if view not in PRODUCT_VIEWS:
+        raise HTTPException(status_code=400, detail=f"Invalid view. Options: {', '.join(PRODUCT_VIEWS)}")
+    cursor = decode_cursor(after) if after else None
+    if cursor is not None:
+        if sort is None:
+            sort = cursor[0]
+        elif sort != cursor[0]:
+            raise HTTPException(status_code=400, detail="Cursor does not match sort")
+        skip = 0
+    if sort is None and search:
+        sort = "relevance"
+
+    # Conditional GET: same snapshot version + same params => 304 without touching the DB
+    snapshot = services.catalog.catalog_cache.get(db)
+    etag = snapshot.list_etag(request.query_params.multi_items())
+    if _etag_matches(request, etag):
+        return _cached_response(request, etag, None)
+
     # Database Filters (Fast)
+    filters = [models.Product.is_active == True]
     if categories:
-        query = query.join(models.Product.categories).filter(models.Category.name.in_(categories)).distinct()
+        filters.append(models.Product.categories.any(models.Category.name.in_(categories)))
     
     if min_price is not None:
-        query = query.filter(models.Product.price >= min_price)
+        filters.append(models.Product.effective_price >= min_price)
         
     if max_price is not None:
-        query = query.filter(models.Product.price <= max_price)
+        filters.append(models.Product.effective_price <= max_price)
 
-    # Search Logic
-    if search:
-        # Fetch candidates to filter in Python (needed for Smart/Fuzzy/Accent-insensitive in SQLite)
-        candidates = query.all()
-        normalized_query = normalize_text(search)
-        
-        results = []
-        for product in candidates:
-            # Normalize product fields
-            p_text = normalize_text(f"{product.name} {product.category or ''} {product.description or ''}")
-            
-            # 1. Direct containment (normalized)
-            if normalized_query in p_text:
-                results.append(product)
-                continue
-                
-            # 2. Fuzzy-ish (Token containment) - "cuchillo verijero" matches "cuchillo"
-            query_tokens = normalized_query.split()
-            if all(token in p_text for token in query_tokens):
-                results.append(product)
-                continue
-                
-        total = len(results)
-        # In-memory Pagination
-        products_page = results[skip : skip + limit]
+    # Search Logic (indexed: FTS5 on SQLite, tsvector on Postgres)
+    matches = services.search.match_products(db, search) if search else None
+    
+    next_cursor = None
+    if search and matches is None and services.search.SEARCH_BACKEND is None:
+        # No index available: filter candidates in Python
+        candidates = db.query(models.Product).filter(*filters).all()
+        results = services.search.scan_products(candidates, search)
+        if sort == "relevance":
+            if cursor is not None:
+                raise HTTPException(status_code=400, detail="Cursor pagination requires a sort")
+            total = len(results)
+            page_ids = [p.id for p in results[skip : skip + limit]]
+        else:
+            # Requested order (and cursor) from SQL over the matched ids
+            id_query = db.query(models.Product.id).filter(models.Product.id.in_([p.id for p in results]))
+            page_ids, total, next_cursor = _page_product_ids(id_query, skip, limit, sort, None, cursor, include_total)
     else:
-        # Standard DB Pagination
-        total = query.count()
-        products_page = query.offset(skip).limit(limit).all()
+        # Single query: filters + search + total (window) + LIMIT/OFFSET or keyset, ids only
+        id_query = db.query(models.Product.id).filter(*filters)
+        relevance = None
+        if matches is not None:
+            id_query = id_query.join(matches, matches.c.product_id == models.Product.id)
+            relevance = matches.c.rank
+        page_ids, total, next_cursor = _page_product_ids(
+            id_query, skip, limit, sort, relevance, cursor, include_total
+        )
+        
+        # Nothing matched exactly: retry typo-tolerant (trigram similarity)
+        if search and not page_ids and (not (skip or cursor) or id_query.first() is None):
+            fuzzy = services.search.fuzzy_match_products(db, search)
+            if fuzzy is not None:
+                fuzzy_query = db.query(models.Product.id).filter(*filters).join(
+                    fuzzy, fuzzy.c.product_id == models.Product.id
+                )
+                page_ids, total, next_cursor = _page_product_ids(
+                    fuzzy_query, skip, limit, sort, fuzzy.c.similarity, cursor, include_total
+                )
+    
+    # Items come pre-serialized from the catalog snapshot (no ORM loading)
+    missing = [pid for pid in page_ids if pid not in snapshot.products]
+    if missing:
+        # Written outside the API (scripts): pull them into the snapshot
+        snapshot = services.catalog.catalog_cache.refresh(db, missing) or services.catalog.catalog_cache.get(db)
+    source = snapshot.cards if view == "card" else snapshot.products
+    products_page = [source[pid] for pid in page_ids if pid in source]
     
     current_page = (skip // limit) + 1
     
-    return {"items": products_page, "total": total, "page": current_page, "limit": limit}
+    return _cached_response(
+        request, etag, lambda: {
+            "items": products_page, "total": total, "page": current_page, "limit": limit, "next_cursor": next_cursor
+        }
+    )
 
 @app.get("/products/{product_id}", response_model=schemas.Product)
-def get_product(product_id: str, db: Session = Depends(get_db)):
-    product = db.query(models.Product).filter(models.Product.id == product_id).first()
+def get_product(product_id: str, request: Request, db: Session = Depends(get_db)):
+    snapshot = services.catalog.catalog_cache.get(db)
+    product = snapshot.products.get(product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    return product
+    return _cached_response(request, snapshot.etags[product_id], lambda: product)
 
 @app.post("/customers", response_model=schemas.Customer, status_code=status.HTTP_201_CREATED)
 def create_customer(customer: schemas.CustomerCreate, db: Session = Depends(get_db)):
@@ -571,8 +715,30 @@ def calculate_shipping(payload: ShippingCalculationRequest):
         
     return {"cost": cost, "message": msg}
 
-@app.post("/orders", response_model=schemas.Order, status_code=status.HTTP_201_CREATED)
-def create_order(order: schemas.OrderCreate, db: Session = Depends(get_db)):
+def _place_order(order: schemas.OrderCreate, db: Session):
+    """
+    Parte sincrónica del checkout (valida, reserva stock y guarda la orden).
+    Retorna la orden serializada y los ítems para la preferencia de pago.
+    """
+    # 0. Load every referenced product and variant up front (two IN queries) and validate
+    products = {p.id: p for p in db.query(models.Product).filter(
+        models.Product.id.in_({item.product_id for item in order.items}))}
+    variant_ids = {item.variant_id for item in order.items if item.variant_id}
+    variants = {v.id: v for v in db.query(models.ProductVariant).filter(
+        models.ProductVariant.id.in_(variant_ids))} if variant_ids else {}
+
+    for item in order.items:
+        if item.quantity <= 0:
+            raise HTTPException(status_code=400, detail=f"Cantidad inválida para {item.product_id}")
+        db_product = products.get(item.product_id)
+        if not db_product:
+             raise HTTPException(status_code=400, detail=f"Product {item.product_id} not found")
+        if item.variant_id:
+            db_variant = variants.get(item.variant_id)
+            if not db_variant or db_variant.product_id != db_product.id:
+                raise HTTPException(status_code=400, detail=f"Variant {item.variant_id} not found for product {db_product.name}")
+    product_names = {product_id: product.name for product_id, product in products.items()}
+
     # 1. Handle Customer (Buyer)
     # Extract buyer info from the new 'buyer' schema
     buyer_email = order.buyer.email
@@ -620,90 +786,75 @@ def create_order(order: schemas.OrderCreate, db: Session = Depends(get_db)):
     db.add(new_order)
     db.flush() # Get Order ID
 
-    # 4. Create Order Items & VALIDATE STOCK
+    # 4. Reserve Stock & Create Order Items
+    # The order holds its units for RESERVATION_TTL_MINUTES (services/inventory.py);
+    # confirm_order turns the holds into stock decrements. On any shortfall the
+    # whole order (customer, order, items) rolls back.
+    wanted = {}  # (variant_id or None, product_id) -> total quantity in the cart
     for item in order.items:
-        # Fetch Product
-        db_product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
-        if not db_product:
-             raise HTTPException(status_code=400, detail=f"Product {item.product_id} not found")
+        key = (item.variant_id or None, item.product_id)
+        wanted[key] = wanted.get(key, 0) + item.quantity
 
-        # Variant Logic
-        if item.variant_id:
-            db_variant = db.query(models.ProductVariant).filter(models.ProductVariant.id == item.variant_id).first()
-            if not db_variant:
-                raise HTTPException(status_code=400, detail=f"Variant {item.variant_id} not found for product {db_product.name}")
-            
-            if db_variant.stock < item.quantity:
-                raise HTTPException(status_code=400, detail=f"Sin stock suficiente para {db_product.name} (Variante: {db_variant.color or ''} {db_variant.size or ''}). Disponible: {db_variant.stock}")
-            
-            # Decrement Variant Stock
-            db_variant.stock -= item.quantity
-            
-            # Also decrement logic for parent product? 
-            # If parent stock is sum of variants, we should update it too to keep consistency.
-            if db_product.stock >= item.quantity:
-                 db_product.stock -= item.quantity
-            else:
-                # If parent stock is improperly synced, we just ensure it doesn't go negative, or ignore.
-                db_product.stock = max(0, db_product.stock - item.quantity)
-
-        else:
-            # Main Product Logic (No variant)
-            if db_product.stock < item.quantity:
-                raise HTTPException(status_code=400, detail=f"Sin stock suficiente para {db_product.name}. Disponible: {db_product.stock}")
-            
-            # Decrement Product Stock
-            db_product.stock -= item.quantity
+    shortfalls = services.inventory.reserve(db, new_order.id, wanted)
+    if shortfalls:
+        variant_id, product_id, available = shortfalls[0]
+        db.rollback()
+        if variant_id:
+            db_variant = variants[variant_id]
+            raise HTTPException(status_code=400, detail=f"Sin stock suficiente para {product_names[product_id]} (Variante: {db_variant.color or ''} {db_variant.size or ''}). Disponible: {available}")
+        raise HTTPException(status_code=400, detail=f"Sin stock suficiente para {product_names[product_id]}. Disponible: {available}")
 
-        # Create Order Item
-        db_item = models.OrderItem(order_id=new_order.id, **item.dict())
-        db.add(db_item)
+    # Create Order Items (single executemany INSERT)
+    db.execute(insert(models.OrderItem), [{"order_id": new_order.id, **item.dict()} for item in order.items])
     
     db.commit()
+    services.catalog.notify_change(db, list(products)) # Available stock changed
     db.refresh(new_order)
     
-    # 5. Generate Payment Preference
+    # 5. Payment Preference items
+    preference_items = []
+    for item in order.items: # item is OrderItemCreate schema
+        preference_items.append({
+            "product_id": item.product_id,
+            "name": product_names.get(item.product_id, "Producto"),
+            "quantity": item.quantity,
+            "unit_price": item.unit_price
+        })
+
+    # Add Shipping Cost to Preference
+    if shipping_cost > 0:
+        preference_items.append({
+            "product_id": "SHIPPING",
+            "name": "Costo de Envío",
+            "quantity": 1,
+            "unit_price": shipping_cost
+        })
+
+    return schemas.Order.from_orm(new_order), preference_items
+
+
+@app.post("/orders", response_model=schemas.Order, status_code=status.HTTP_201_CREATED)
+async def create_order(order: schemas.OrderCreate, db: Session = Depends(get_db)):
+    """
+    La orden se guarda en el threadpool; la preferencia de MercadoPago se pide
+    con presupuesto de tiempo en el executor del gateway (services/payment.py),
+    así un MercadoPago lento no retiene workers de la API.
+    """
+    response_data, preference_items = await run_in_threadpool(_place_order, order, db)
+
     try:
         payment_service = services.payment.PaymentService()
-        
-        preference_items = []
-        for item in order.items: # item is OrderItemCreate schema
-            product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
-            preference_items.append({
-                "product_id": item.product_id,
-                "name": product.name if product else "Producto",
-                "quantity": item.quantity,
-                "unit_price": item.unit_price
-            })
-
-        # Add Shipping Cost to Preference
-        if shipping_cost > 0:
-            preference_items.append({
-                "product_id": "SHIPPING",
-                "name": "Costo de Envío",
-                "quantity": 1,
-                "unit_price": shipping_cost
-            })
-
-        payment_url = payment_service.create_preference(
-            order_id=new_order.id,
-            items=preference_items, 
-            payer_email=buyer_email
+        response_data.payment_url = await payment_service.create_preference_async(
+            order_id=response_data.id,
+            items=preference_items,
+            payer_email=order.buyer.email
         )
-
-        response_data = schemas.Order.from_orm(new_order)
-        response_data.payment_url = payment_url
-        return response_data
-        
     except Exception as e:
-        print(f"Error creating payment preference: {e}")
-        # Return order without payment url if fails
-        new_order.payment_url = payment_url
-        db.commit() # Save update with Payment URL
+        # Return order without payment url if fails (stock stays reserved until the TTL)
+        print(f"Error creating payment preference for order #{response_data.id}: {e}")
 
-        # Email notification moved to payment confirmation
-        
-        return new_order
+    # Email notification moved to payment confirmation
+    return response_data
 
 
 @app.post("/orders/track", response_model=schemas.Order)
@@ -740,8 +891,51 @@ def get_order(order_id: int, payment_id: Optional[str] = None, db: Session = Dep
     # Verify Payment ID match (if order has one)
     if order.payment_id and order.payment_id != payment_id:
          raise HTTPException(status_code=403, detail="Invalid Payment Token")
-         
-    return order
+
+    # Local state only (filled by MP notifications / confirm): no gateway round trip
+    response_data = schemas.Order.from_orm(order)
+    record = services.payment_status.cached(db, payment_id)
+    # Only a payment MercadoPago reported for this order (a pending order has no payment_id yet)
+    response_data.payment_status = record.status if record and record.order_id == order.id else None
+    return response_data
+
+
+def _mark_order_paid(db: Session, order: models.Order, payment_id: str) -> bool:
+    """
+    Pasa la orden a 'paid' una sola vez: el UPDATE condicional (status != 'paid')
+    decide quién la marca cuando confirm_order y la notificación de MP llegan
+    juntos. Solo ese llamador descuenta stock, encola la venta y manda los emails.
+    """
+    claimed = db.execute(
+        update(models.Order).where(models.Order.id == order.id, models.Order.status != "paid").values(status="paid")
+    ).rowcount
+    if not claimed:
+        db.rollback()
+        return False
+
+    # Paid status and sale event commit together (transactional outbox)
+    # Reserved units become permanent decrements in the same commit
+    stock_taken = services.inventory.convert_reservations(db, order)
+    services.outbox.enqueue_sale(db, order, payment_id)
+    db.commit()
+    services.outbox.dispatcher.wake()
+    if stock_taken:
+        services.catalog.notify_change(db, list({item.product_id for item in order.items}))
+
+    # Send Email Notification
+    try:
+        email_service = services.email.EmailService()
+
+        # 1. Email to Client (HTML Pro)
+        email_service.send_order_confirmation_client(order)
+
+        # 2. Email to Admin (Simple Alert)
+        email_service.send_order_notification_admin(order)
+    except Exception as e:
+        print(f"Error sending confirmation email: {e}")
+
+    # Management Platform (Webhook): delivered by services.outbox.dispatcher
+    return True
 
 
 @app.post("/orders/{order_id}/confirm")
@@ -750,58 +944,113 @@ def confirm_order(order_id: int, payment_id: str, db: Session = Depends(get_db))
     Verifica el pago en Mercado Pago y, si es exitoso:
     1. Actualiza el estado de la orden a 'paid'.
     2. Envía el email de notificación.
+    Un estado terminal ya conocido (notificación de MP o confirm previo) se
+    responde desde la caché local, sin consultar a MP.
     """
     order = db.query(models.Order).filter(models.Order.id == order_id).first()
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
 
-    # Save Payment ID regardless of status (for tracking/audit/access)
+    # 1. Verify Payment with MP (Security Check): the payment must be for this order
+    try:
+        status = services.payment_status.resolve(db, payment_id, order.id)
+    except (services.payment_status.PaymentOrderMismatch, services.payment.PaymentLookupError) as e:
+        print(f"Payment {payment_id} rejected for Order #{order_id}: {e}")
+        raise HTTPException(status_code=403, detail="Invalid Payment Token")
+    except services.payment.PaymentGatewayUnavailable as e:
+        print(f"Error fetching payment {payment_id}: {e}")
+        return {"message": "Payment not approved yet", "status": "unknown"}
+
+    # Save the verified Payment ID regardless of status (for tracking/audit/access)
     if not order.payment_id:
         order.payment_id = payment_id
         db.commit()
 
-    # 1. Verify Payment with MP (Security Check)
-    payment_service = services.payment.PaymentService()
-    status = payment_service.get_payment_status(payment_id)
-    
     if status == "approved":
-        if order.status != "paid":
-            order.status = "paid"
-            db.commit()
-            
-            # 2. Send Email Notification
-            try:
-                email_service = services.email.EmailService()
-                
-                # Reconstruct items list for email (from DB items)
-                # Need to join with Product table to get names/prices if needed, 
-                # but OrderItem has product_id and unit_price.
-                # For basic notification, we use what we have.
-                email_items = [] 
-                # Note: This list reconstruction is basic. ideally we fetch product names properly
-                # But our OrderItem is defined in models.py
-                
-                # 1. Email to Client (HTML Pro)
-                email_service.send_order_confirmation_client(order)
-
-                # 2. Email to Admin (Simple Alert)
-                email_service.send_order_notification_admin(order)
-            except Exception as e:
-                print(f"Error sending confirmation email: {e}")
-            
-            # 3. Notify Management Platform (Webhook)
-            try:
-                integration_service = services.integration.IntegrationService()
-                integration_service.notify_new_sale(order, payment_id)
-            except Exception as e:
-                print(f"Error calling integration webhook: {e}")
-        
+        _mark_order_paid(db, order, payment_id)
         return {"message": "Order confirmed and email sent", "status": "paid"}
     else:
         print(f"Payment verification failed for Order #{order_id}. Status: {status}")
         return {"message": "Payment not approved yet", "status": status}
 
 
+def _verify_mp_signature(request: Request, data_id: str) -> bool:
+    """
+    Firma de las notificaciones (header x-signature: ts=...,v1=...): HMAC-SHA256
+    con MP_WEBHOOK_SECRET sobre 'id:<data.id>;request-id:<x-request-id>;ts:<ts>;'.
+    Sin secreto configurado no se valida (el estado igual se lee de la API de MP).
+    """
+    secret = os.getenv("MP_WEBHOOK_SECRET")
+    if not secret:
+        return True
+    parts = dict(part.strip().split("=", 1) for part in request.headers.get("x-signature", "").split(",") if "=" in part)
+    if "ts" not in parts or "v1" not in parts:
+        return False
+    manifest = f"id:{data_id.lower()};request-id:{request.headers.get('x-request-id', '')};ts:{parts['ts']};"
+    expected = hmac.new(secret.encode(), manifest.encode(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, parts["v1"])
+
+
+def _apply_payment_notification(db: Session, payment_id: str) -> dict:
+    """
+    Lee el pago de MP (la notificación solo trae el id), guarda su estado y
+    actualiza la orden del external_reference. Idempotente: MP reenvía
+    notificaciones y una orden ya pagada no se vuelve a procesar.
+    """
+    try:
+        payment = services.payment.PaymentService().get_payment(payment_id)
+    except services.payment.PaymentLookupError as e:
+        # Unknown payment (or MP's test notification): retrying cannot fix it
+        print(f"⚠️ MercadoPago notification for payment {payment_id} ignored: {e}")
+        return {"message": "Ignored", "payment_id": payment_id}
+    status = payment.get("status") or "unknown"
+    reference = str(payment.get("external_reference") or "")
+    order = db.query(models.Order).filter(models.Order.id == int(reference)).first() if reference.isdigit() else None
+
+    services.payment_status.record(db, payment_id, status, order_id=order.id if order else None)
+    if not order:
+        print(f"⚠️ MercadoPago payment {payment_id} ({status}) has no matching order: {reference!r}")
+        return {"payment_id": payment_id, "status": status, "order_id": None}
+
+    if not order.payment_id:
+        order.payment_id = payment_id
+        db.commit()
+    if status == "approved":
+        _mark_order_paid(db, order, payment_id)
+    return {"payment_id": payment_id, "status": status, "order_id": order.id}
+
+
+@app.post("/webhooks/mercadopago")
+async def receive_mercadopago_notification(request: Request, db: Session = Depends(get_db)):
+    """
+    Notificaciones de pago de MercadoPago: Webhooks (?type=payment&data.id=..,
+    o {"type": "payment", "data": {"id": ..}} en el cuerpo) e IPN (?topic=payment&id=..).
+    Otros tópicos y pagos que MP no encuentra (4xx) se aceptan y se ignoran;
+    un 503 (gateway caído, timeout, circuito abierto) hace que MP reintente.
+    """
+    params = request.query_params
+    try:
+        body = await request.json()
+    except ValueError:
+        body = {}
+    if not isinstance(body, dict):
+        body = {}
+
+    topic = params.get("type") or params.get("topic") or body.get("type") or body.get("topic")
+    payment_id = params.get("data.id") or (body.get("data") or {}).get("id") or params.get("id")
+    if topic != "payment" or not payment_id:
+        return {"message": "Ignored", "topic": topic}
+    payment_id = str(payment_id)
+
+    if not _verify_mp_signature(request, payment_id):
+        raise HTTPException(status_code=401, detail="Invalid signature")
+
+    try:
+        return await run_in_threadpool(_apply_payment_notification, db, payment_id)
+    except services.payment.PaymentGatewayUnavailable as e:
+        print(f"❌ MercadoPago notification for payment {payment_id} not applied: {e}")
+        raise HTTPException(status_code=503, detail="Payment gateway unavailable")
+
 
 @app.delete("/admin/products/mocks", status_code=status.HTTP_200_OK, dependencies=[Depends(verify_admin_key)])
 def delete_mock_products(db: Session = Depends(get_db)):
@@ -822,7 +1071,9 @@ def delete_mock_products(db: Session = Depends(get_db)):
     # 2. Delete Products
     deleted_count = db.query(models.Product).filter(models.Product.id.in_(ids_to_remove)).delete(synchronize_session=False)
     
+    services.search.index_products(db, ids_to_remove)
     db.commit()
+    services.catalog.notify_change(db, ids_to_remove)
     
     return {"message": "Mock products deleted", "count": deleted_count, "ids": ids_to_remove}
 
@@ -837,7 +1088,9 @@ def delete_product(product_id: str, db: Session = Depends(get_db)):
     # 2. Delete Product
     deleted_count = db.query(models.Product).filter(models.Product.id == product_id).delete(synchronize_session=False)
     
+    services.search.index_products(db, [product_id])
     db.commit()
+    services.catalog.notify_change(db, [product_id])
     
     if deleted_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
@@ -852,7 +1105,9 @@ def delete_all_products(db: Session = Depends(get_db)):
     try:
         num_variants = db.query(models.ProductVariant).delete()
         num_products = db.query(models.Product).delete()
+        services.search.index_products(db)
         db.commit()
+        services.catalog.notify_change(db)
         return {"message": "All products deleted", "products_deleted": num_products, "variants_deleted": num_variants}
     except Exception as e:
         db.rollback()
@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, DateTime, Text
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Boolean, Float, ForeignKey, DateTime, Text, Index, case, func, event, inspect, literal_column, update
+from sqlalchemy.orm import relationship, selectinload, joinedload, Session
+from sqlalchemy.orm.util import identity_key
 from sqlalchemy.sql import func
 from database import Base
 import uuid
@@ -63,6 +64,16 @@ class Product(Base):
     price_override = Column(Float, nullable=True)
     discount_percentage = Column(Integer, default=0)
     
+    # Precio final que paga el cliente (override > descuento > precio base).
+    # Se recalcula solo en cada INSERT/UPDATE del ORM (ver eventos abajo);
+    # los UPDATE masivos deben usar effective_price_expr().
+    effective_price = Column(Float, nullable=True)
+    
+    # Hash del último ProductUpdatePayload aplicado por el webhook: si llega el
+    # mismo payload se ignora. Cualquier otra escritura sobre los datos que trae
+    # el webhook lo borra (ver eventos abajo), así el próximo webhook se aplica.
+    payload_hash = Column(String, nullable=True)
+    
     # Size Guide Reference
     size_guide_id = Column(Integer, ForeignKey('size_guides.id'), nullable=True)
     size_guide = relationship("SizeGuide", back_populates="products")
@@ -72,6 +83,57 @@ class Product(Base):
     categories = relationship("Category", secondary=product_categories, backref="products")
     labels = relationship("Label", secondary=product_labels, backref="products")
 
+    __table_args__ = (
+        # Price filters (min_price / max_price)
+        Index("ix_products_effective_price_id", "effective_price", "id"),
+    )
+
+# Keyset pagination sort keys (main._page_product_ids): ORDER BY key, id /
+# WHERE (key, id) > cursor. COALESCE keeps NULL names/prices in the walk (a NULL
+# key never satisfies the row-value comparison); literal defaults so the
+# expression indexes match the queries.
+NAME_SORT_KEY = func.coalesce(Product.name, literal_column("''"))
+PRICE_SORT_KEY = func.coalesce(Product.effective_price, literal_column("0"))
+Index("ix_products_sort_name_id", NAME_SORT_KEY, Product.id)
+Index("ix_products_sort_price_id", PRICE_SORT_KEY, Product.id)
+
+
+def compute_effective_price(price, price_override=None, discount_percentage=0):
+    if price_override is not None:
+        return price_override
+    if price is None:
+        return None
+    return price * (1 - (discount_percentage or 0) / 100)
+
+def effective_price_expr(price=Product.price, price_override=Product.price_override,
+                         discount_percentage=Product.discount_percentage):
+    """
+    Misma regla que compute_effective_price, como expresión SQL (para UPDATE masivos).
+    """
+    return case(
+        (price_override.isnot(None), price_override),
+        else_=price * (1 - func.coalesce(discount_percentage, 0) / 100.0)
+    )
+
+@event.listens_for(Product, "before_insert")
+@event.listens_for(Product, "before_update")
+def _sync_effective_price(mapper, connection, product):
+    product.effective_price = compute_effective_price(
+        product.price, product.price_override, product.discount_percentage
+    )
+
+# Product data that comes from the management platform webhook
+WEBHOOK_FIELDS = ("sku", "name", "price", "description", "image_url", "images", "category", "stock", "categories")
+
+@event.listens_for(Product, "before_update")
+def _expire_payload_hash(mapper, connection, product):
+    state = inspect(product)
+    if state.attrs.payload_hash.history.has_changes():
+        return
+    if any(state.attrs[field].history.has_changes() for field in WEBHOOK_FIELDS):
+        product.payload_hash = None
+
+
 class ProductImage(Base):
     __tablename__ = "product_images"
 
@@ -96,9 +158,28 @@ class ProductVariant(Base):
 
     product = relationship("Product", back_populates="variants")
 
-
-
-
+@event.listens_for(Session, "before_flush")
+def _expire_parent_payload_hash(session, flush_context, instances):
+    """
+    Cambios en imágenes o variantes también invalidan el hash del producto
+    (salvo que el mismo flush lo esté seteando: es el webhook aplicándolo).
+    """
+    product_ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (ProductImage, ProductVariant)) and (obj in session.new or obj in session.deleted
+                                                                or session.is_modified(obj)):
+            product_ids.add(obj.product_id or (obj.product.id if obj.product else None))
+            # Moved to another product: the previous owner changed too
+            product_ids.update(inspect(obj).attrs.product_id.history.deleted)
+    product_ids.discard(None)
+    for product_id in product_ids:
+        product = session.identity_map.get(identity_key(Product, product_id))
+        if product is None:
+            session.connection().execute(
+                update(Product.__table__).where(Product.__table__.c.id == product_id).values(payload_hash=None)
+            )
+        elif not inspect(product).attrs.payload_hash.history.has_changes():
+            product.payload_hash = None
 
 
 class Customer(Base):
@@ -143,3 +224,125 @@ class OrderItem(Base):
 
     order = relationship("Order", back_populates="items")
     product = relationship("Product")
+
+class WebhookJob(Base):
+    """
+    Cola durable de webhooks de productos aceptados en modo async
+    (ver services/webhook_queue.py).
+    """
+    __tablename__ = "webhook_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(String, index=True)
+    payload = Column(Text) # ProductUpdatePayload JSON
+    status = Column(String, default="pending") # pending, done, superseded, failed
+    result = Column(String, nullable=True) # updated / unchanged / error message
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    processed_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        # Workers poll WHERE status = 'pending' ORDER BY id
+        Index("ix_webhook_jobs_status_id", "status", "id"),
+    )
+
+
+class OutboxEvent(Base):
+    """
+    Outbox de eventos hacia la plataforma de gestión (ver services/outbox.py).
+    Se inserta en la misma transacción que el cambio de estado que lo origina.
+    """
+    __tablename__ = "outbox_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    event_type = Column(String) # sale.created
+    aggregate_id = Column(String, index=True) # Order ID
+    payload = Column(Text) # JSON
+    status = Column(String, default="pending") # pending, sent, dead
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=True)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    sent_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        # Dispatcher polls WHERE status = 'pending' AND next_attempt_at <= now
+        Index("ix_outbox_events_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+
+class StockReservation(Base):
+    """
+    Reserva de stock de una orden pendiente (ver services/inventory.py).
+    Activa mientras released_at es NULL y expires_at no pasó.
+    """
+    __tablename__ = "stock_reservations"
+
+    id = Column(Integer, primary_key=True, index=True)
+    order_id = Column(Integer, ForeignKey("orders.id"), index=True)
+    # No FKs (like OrderItem.variant_id): released rows are kept for
+    # RESERVATION_RETENTION_DAYS and must not block catalog deletes
+    product_id = Column(String)
+    variant_id = Column(Integer, nullable=True)
+    quantity = Column(Integer)
+    expires_at = Column(DateTime(timezone=True))
+    released_at = Column(DateTime(timezone=True), nullable=True) # Expired holds, set by the sweeper
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        # Sweeper: WHERE released_at IS NULL AND expires_at <= now
+        Index("ix_stock_reservations_expires_at", "expires_at"),
+        # Availability: SUM(quantity) of active holds per product / variant
+        Index("ix_stock_reservations_product_expires", "product_id", "expires_at"),
+        Index("ix_stock_reservations_variant_expires", "variant_id", "expires_at"),
+    )
+
+
+class PaymentStatus(Base):
+    """
+    Último estado conocido de un pago de MercadoPago (ver services/payment_status.py).
+    order_id viene del external_reference del pago (notificaciones de MP).
+    """
+    __tablename__ = "payment_statuses"
+
+    payment_id = Column(String, primary_key=True)
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=True, index=True)
+    status = Column(String)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class SyncCursor(Base):
+    """
+    Posición de un feed incremental de la plataforma de gestión
+    (cursor 'since' + ETag de la última respuesta).
+    """
+    __tablename__ = "sync_cursors"
+
+    name = Column(String, primary_key=True) # e.g. management_stock
+    cursor = Column(String, nullable=True)
+    etag = Column(String, nullable=True)
+    updated_at = Column(DateTime(timezone=True), nullable=True)
+
+
+# --- Loader options for endpoints that serialize schemas.Product ---
+# Collections use selectinload (one extra query per relationship, whatever the
+# page size); many-to-one uses joinedload. Without these every serialized
+# product fires its own lazy SELECTs (N+1).
+
+def product_list_options():
+    return (
+        selectinload(Product.variants),
+        selectinload(Product.product_images),
+        selectinload(Product.categories),
+        selectinload(Product.labels),
+        joinedload(Product.size_guide),
+    )
+
+def product_detail_options():
+    # Single row: small M2M collections ride along in the same SELECT
+    return (
+        selectinload(Product.variants),
+        selectinload(Product.product_images),
+        joinedload(Product.categories),
+        joinedload(Product.labels),
+        joinedload(Product.size_guide),
+    )
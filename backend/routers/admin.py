@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Security
+from fastapi import APIRouter, Depends, HTTPException, status, Security, Query
 from fastapi.security import APIKeyHeader
 from sqlalchemy.orm import Session
 from sqlalchemy import func
@@ -6,6 +6,13 @@ from typing import List, Optional
 from pydantic import BaseModel
 import models, schemas
 import os
+import services.search
+import services.catalog
+import services.outbox
+import services.integration
+import services.stock_sync
+import services.stock_audit
+import requests
 from database import get_db
 
 router = APIRouter(
@@ -133,6 +140,7 @@ def delete_category(cat_id: int, db: Session = Depends(get_db)):
     
     db.delete(cat)
     db.commit()
+    services.catalog.notify_change(db)
     return {"status": "success"}
 
 # --- Product Management ---
@@ -185,7 +193,9 @@ def update_product_details(
             labels = db.query(models.Label).filter(models.Label.id.in_(details.label_ids)).all()
             product.labels = labels
         
+    services.search.index_products(db, [product.id])
     db.commit()
+    services.catalog.notify_change(db, [product.id])
     db.refresh(product)
     return product
 
@@ -196,7 +206,7 @@ def get_admin_products(
     search: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
-    query = db.query(models.Product)
+    query = db.query(models.Product).options(*models.product_list_options())
     if search:
         query = query.filter(models.Product.name.contains(search))
     return query.offset(skip).limit(limit).all()
@@ -217,8 +227,10 @@ def update_product_price(
         product.discount_percentage = price_data.discount_percentage
     
     db.commit()
-    db.refresh(product)
-    return product
+    services.catalog.notify_change(db, [product_id])
+    return db.query(models.Product).options(*models.product_detail_options()).filter(
+        models.Product.id == product_id
+    ).first()
 
 class BatchPriceUpdate(BaseModel):
     category: Optional[str] = None
@@ -240,11 +252,18 @@ def update_batch_prices(
         query = query.filter(models.Product.categories.any(models.Category.name == batch_data.category))
         
     updated_count = query.update(
-        {models.Product.discount_percentage: batch_data.discount_percentage}, 
+        {
+            models.Product.discount_percentage: batch_data.discount_percentage,
+            # Bulk UPDATE skips ORM events: recompute with the new discount
+            models.Product.effective_price: models.effective_price_expr(
+                discount_percentage=batch_data.discount_percentage
+            )
+        }, 
         synchronize_session=False
     )
     
     db.commit()
+    services.catalog.notify_change(db)
     return {"status": "success", "updated_count": updated_count}
 
 @router.post("/products/{product_id}/images", response_model=schemas.ProductImage)
@@ -265,6 +284,7 @@ def add_product_image(
     )
     db.add(new_image)
     db.commit()
+    services.catalog.notify_change(db, [product_id])
     db.refresh(new_image)
     return new_image
 
@@ -276,8 +296,10 @@ def delete_image(image_id: int, db: Session = Depends(get_db)):
     if not image:
         raise HTTPException(status_code=404, detail="Image not found")
     
+    product_id = image.product_id
     db.delete(image)
     db.commit()
+    services.catalog.notify_change(db, [product_id])
     return {"status": "success"}
 
 @router.put("/images/{image_id}/reorder")
@@ -288,12 +310,76 @@ def reorder_image(image_id: int, reorder_data: ImageReorder, db: Session = Depen
         
     image.display_order = reorder_data.new_order
     db.commit()
+    services.catalog.notify_change(db, [image.product_id])
     return {"status": "success"}
 
 # --- Stock Sync ---
 
-@router.post("/sync-stock")
-def sync_stock(db: Session = Depends(get_db)):
-    # Placeholder for integration with Management Platform
-    # Logic to fetch stock from external API and update local DB
-    return {"status": "sync_initiated", "message": "Stock sync logic to be implemented"}
+@router.post("/sync-stock", dependencies=[Depends(verify_admin_key)])
+def sync_stock(full: bool = False, dry_run: bool = False, db: Session = Depends(get_db)):
+    """
+    Reconcilia el stock con la plataforma de gestión (ver services/stock_sync.py).
+    - full: ignora el cursor guardado y trae el feed completo.
+    - dry_run: solo reporta el drift, sin aplicar ni avanzar el cursor.
+    """
+    if not os.getenv("MANAGEMENT_STOCK_URL"):
+        raise HTTPException(status_code=503, detail="MANAGEMENT_STOCK_URL not configured")
+    try:
+        with services.integration.http_session() as http:
+            report = services.stock_sync.sync_stock(db, http, full=full, dry_run=dry_run)
+    except services.stock_sync.StockSyncBusy:
+        raise HTTPException(status_code=409, detail="Stock sync already running")
+    except requests.RequestException as e:
+        raise HTTPException(status_code=502, detail=f"Management platform error: {e}")
+    return {"status": "completed", **report}
+
+# --- Stock Audit ---
+
+@router.get("/stock-audit", dependencies=[Depends(verify_admin_key)])
+def stock_audit(db: Session = Depends(get_db)):
+    """
+    Productos cuyo stock no coincide con la suma de sus variantes.
+    """
+    mismatches = services.stock_audit.find_mismatches(db)
+    return {"count": len(mismatches), "mismatches": mismatches}
+
+@router.post("/stock-audit/repair", dependencies=[Depends(verify_admin_key)])
+def repair_stock(strategy: str, dry_run: bool = True, product_ids: Optional[List[str]] = Query(None),
+                 db: Session = Depends(get_db)):
+    """
+    Corrige los desajustes con la estrategia elegida (ver services/stock_audit.py).
+    Por defecto es un dry run: retorna el diff sin aplicarlo (dry_run=false para aplicar).
+    """
+    if strategy not in services.stock_audit.STRATEGIES:
+        raise HTTPException(status_code=400, detail=f"Invalid strategy. Use one of: {services.stock_audit.STRATEGIES}")
+    report = services.stock_audit.repair(db, strategy, dry_run=dry_run, product_ids=product_ids)
+    repaired_ids = report.pop("product_ids")
+    if dry_run:
+        return report
+    db.commit()
+    if repaired_ids:
+        services.catalog.notify_change(db, repaired_ids)
+    return report
+
+# --- Outbox (Management Platform events) ---
+
+@router.get("/outbox", response_model=List[schemas.OutboxEvent], dependencies=[Depends(verify_admin_key)])
+def get_outbox_events(event_status: Optional[str] = Query("dead", alias="status"), limit: int = 100,
+                      db: Session = Depends(get_db)):
+    """
+    Lista eventos del outbox (por defecto los 'dead', que ya agotaron los reintentos).
+    """
+    query = db.query(models.OutboxEvent)
+    if event_status:
+        query = query.filter(models.OutboxEvent.status == event_status)
+    return query.order_by(models.OutboxEvent.id.desc()).limit(limit).all()
+
+@router.post("/outbox/{event_id}/retry", response_model=schemas.OutboxEvent, dependencies=[Depends(verify_admin_key)])
+def retry_outbox_event(event_id: int, db: Session = Depends(get_db)):
+    event = db.query(models.OutboxEvent).filter(models.OutboxEvent.id == event_id).first()
+    if not event:
+        raise HTTPException(status_code=404, detail="Event not found")
+    if event.status == "sent":
+        raise HTTPException(status_code=400, detail="Event already sent")
+    services.outbox.requeue(db, event)
+    return event
@@ -2,6 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
 from typing import List
 import models, schemas, database
+import services.catalog
 from routers.admin import verify_admin_key
 
 router = APIRouter(
@@ -50,6 +51,7 @@ def update_label(
     db_label.name = label_update.name
     db_label.color = label_update.color
     db.commit()
+    services.catalog.notify_change(db)
     db.refresh(db_label)
     return db_label
 
@@ -65,4 +67,5 @@ def delete_label(
         
     db.delete(db_label)
     db.commit()
+    services.catalog.notify_change(db)
     return None
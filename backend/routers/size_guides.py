@@ -2,6 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from typing import List
 import models, schemas
+import services.catalog
 from database import get_db
 # Import admin key verification for protected endpoints
 from routers.admin import verify_admin_key
@@ -56,6 +57,7 @@ def update_size_guide(
         setattr(guide, var, value) if value is not None else None
     
     db.commit()
+    services.catalog.notify_change(db)
     db.refresh(guide)
     return guide
 
@@ -93,6 +93,7 @@ class SizeGuide(SizeGuideBase):
 
 class Product(ProductBase):
     id: str
+    effective_price: Optional[float] = None # Final price (override > discount > price)
     updated_at: Optional[datetime] = None
     size_guide_id: Optional[int] = None
     size_guide: Optional[SizeGuide] = None
@@ -114,11 +115,61 @@ class Product(ProductBase):
     class Config:
         from_attributes = True
 
+class ProductSummary(BaseModel):
+    """
+    Tarjeta del listado (?view=card): solo lo que muestra la grilla.
+    """
+    id: str
+    sku: str
+    name: str
+    price: float
+    price_override: Optional[float] = None
+    discount_percentage: int = 0
+    effective_price: Optional[float] = None
+    image_url: Optional[str] = None # Main image
+    in_stock: bool
+    labels: List[Label] = []
+
+class ProductCardListResponse(BaseModel):
+    items: List[ProductSummary]
+    total: Optional[int] = None
+    page: int
+    limit: int
+    next_cursor: Optional[str] = None
+
+class FacetCount(BaseModel):
+    value: str
+    count: int
+
+class PriceBucket(BaseModel):
+    min: Optional[float] = None # Inclusive; None = no lower bound
+    max: Optional[float] = None # Exclusive; None = no upper bound
+    count: int
+
+class ProductFacets(BaseModel):
+    total: int
+    categories: List[FacetCount]
+    labels: List[FacetCount]
+    price_buckets: List[PriceBucket]
+    in_stock: int
+    out_of_stock: int
+
 class ProductListResponse(BaseModel):
     items: List[Product]
-    total: int
+    total: Optional[int] = None # None when include_total=false
     page: int
     limit: int
+    next_cursor: Optional[str] = None # Keyset pagination (sorted listings)
+class SuggestItem(BaseModel):
+    value: str
+    id: Optional[str] = None # Only for product suggestions
+
+class SuggestResponse(BaseModel):
+    query: str
+    products: List[SuggestItem] = []
+    categories: List[SuggestItem] = []
+    labels: List[SuggestItem] = []
+
 class VariantUpdate(BaseModel):
     sku: str
     size: Optional[str] = None
@@ -137,6 +188,29 @@ class ProductUpdatePayload(BaseModel):
     category: Optional[str] = None
     variants: List[VariantUpdate] = []
 
+class WebhookJob(BaseModel):
+    id: int
+    product_id: str
+    status: str # pending, done, superseded, failed
+    result: Optional[str] = None
+    created_at: Optional[datetime] = None
+    processed_at: Optional[datetime] = None
+    class Config:
+        from_attributes = True
+
+class OutboxEvent(BaseModel):
+    id: int
+    event_type: str
+    aggregate_id: str
+    status: str # pending, sent, dead
+    attempts: int = 0
+    next_attempt_at: Optional[datetime] = None
+    last_error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    sent_at: Optional[datetime] = None
+    class Config:
+        from_attributes = True
+
 class ProductDetailUpdate(BaseModel):
     category_names: Optional[List[str]] = None
     label_ids: Optional[List[int]] = None
@@ -219,6 +293,7 @@ class Order(BaseModel):
     items: List[OrderItem]
     payment_url: Optional[str] = None
     payment_id: Optional[str] = None
+    payment_status: Optional[str] = None # Last known MercadoPago status (GET /orders/{id})
     shipping_data: Optional[str] = None # JSON string
     billing_data: Optional[str] = None # JSON string
     class Config:
@@ -0,0 +1,60 @@
+"""
+Auditoría de stock: productos cuyo stock no coincide con la suma de sus variantes.
+
+Uso (desde backend/):
+    python scripts/stock_audit.py                                  # solo lista desajustes
+    python scripts/stock_audit.py --strategy proportional          # diff (dry run)
+    python scripts/stock_audit.py --strategy proportional --apply  # aplica la corrección
+
+El catálogo en memoria del servidor no se entera de estos cambios hasta que
+reinicia; con el servidor corriendo, usar POST /admin/stock-audit/repair.
+"""
+import argparse
+import sys
+import os
+
+# Add backend directory to sys.path to allow imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import SessionLocal
+import services.stock_audit
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Audit and repair product/variant stock mismatches")
+    parser.add_argument("--strategy", choices=services.stock_audit.STRATEGIES)
+    parser.add_argument("--apply", action="store_true", help="Write the repair (default: dry run)")
+    parser.add_argument("--product", action="append", dest="product_ids", help="Limit to product id (repeatable)")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        if not args.strategy:
+            mismatches = services.stock_audit.find_mismatches(db, args.product_ids)
+            for m in mismatches:
+                print(f"{m['product_id']} | {m['name']} | product: {m['product_stock']} | variants: {m['variant_total']}")
+            print(f"\nDesajustes: {len(mismatches)}")
+            return
+
+        report = services.stock_audit.repair(db, args.strategy, dry_run=not args.apply, product_ids=args.product_ids)
+        for change in report["changes"]:
+            print(f"{change['product_id']} | {change['name']}: product {change['product_stock']} -> {change['product_stock_after']}")
+            for variant in change["variants"]:
+                print(f"    {variant['sku']}: {variant['before']} -> {variant['after']}")
+        for m in report["unresolved"]:
+            print(f"⚠️ {m['product_id']} | {m['name']}: all variants at 0, cannot distribute {m['product_stock']}")
+
+        if args.apply:
+            db.commit()
+            print(f"\n✅ Corregidos: {report['repaired']} de {report['mismatched']} ({args.strategy})")
+        else:
+            print(f"\nDry run: {len(report['changes'])} de {report['mismatched']} se corregirían. Usar --apply para aplicar.")
+    except Exception as e:
+        print(f"❌ Error during stock audit: {e}")
+        db.rollback()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+from bisect import bisect_right
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy.orm import Session
+import models, schemas
+from services.suggest import suggest_index
+import services.inventory
+
+# Snapshot en memoria del catálogo público.
+# /products/{id} y /products/categories se sirven desde acá, y /products solo
+# resuelve en SQL los ids de la página (ver get_products) y toma los productos
+# ya serializados del snapshot.
+#
+# Cada escritura que toca productos (webhook, sync, admin, órdenes) llama a
+# notify_change() después del commit: se arma un snapshot nuevo (solo se
+# re-serializan los productos afectados) y se reemplaza de forma atómica.
+# El snapshot es por proceso: el Dockerfile corre un único worker de uvicorn.
+#
+# El stock publicado es el disponible: stock - reservas activas de órdenes
+# pendientes (ver services/inventory.py). Reservar, confirmar o vencer una
+# reserva también pasa por notify_change().
+#
+# Validadores HTTP (ETag): cada producto y la lista de categorías llevan un
+# hash de su contenido; los listados usan BOOT_ID + versión del snapshot +
+# parámetros del query (la versión reinicia en cada arranque, BOOT_ID no).
+
+BOOT_ID = uuid.uuid4().hex[:8]
+
+
+def content_etag(payload) -> str:
+    digest = hashlib.sha1(json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+    return f'"{digest[:20]}"'
+
+
+def price_bucket_bounds() -> List[float]:
+    """
+    Límites de los rangos de precio para facetas (CATALOG_PRICE_BUCKETS, separados por coma).
+    """
+    raw = os.getenv("CATALOG_PRICE_BUCKETS", "10000,25000,50000,100000")
+    return sorted(float(value) for value in raw.split(",") if value.strip())
+
+
+def cache_control() -> str:
+    max_age = int(os.getenv("CATALOG_CACHE_MAX_AGE", "30"))
+    stale = int(os.getenv("CATALOG_STALE_WHILE_REVALIDATE", "300"))
+    return f"public, max-age={max_age}, stale-while-revalidate={stale}"
+
+
+class CatalogSnapshot:
+    """
+    Vista inmutable del catálogo en una versión dada.
+    - products: id -> producto serializado (dict JSON de schemas.Product), activos e inactivos.
+    - categories: nombres de categorías de productos activos, ordenados.
+    - cards: id -> tarjeta compacta para listados (?view=card).
+    - etags: id -> ETag del producto serializado.
+    """
+    __slots__ = ("version", "products", "cards", "categories", "etags", "categories_etag")
+
+    def __init__(self, version: int, products: Dict[str, dict], cards: Dict[str, dict], categories: List[str],
+                 etags: Dict[str, str]):
+        self.version = version
+        self.products = MappingProxyType(products)
+        self.cards = MappingProxyType(cards)
+        self.categories = tuple(categories)
+        self.etags = MappingProxyType(etags)
+        self.categories_etag = content_etag(categories)
+
+    def list_etag(self, params) -> str:
+        """
+        ETag para un listado: depende de la versión y de los parámetros del query.
+        """
+        digest = hashlib.sha1(repr(sorted(params)).encode()).hexdigest()[:12]
+        return f'"{BOOT_ID}.{self.version}.{digest}"'
+
+
+def _load_products(db: Session, product_ids: Optional[List[str]] = None):
+    query = db.query(models.Product).options(*models.product_list_options())
+    if product_ids is not None:
+        query = query.filter(models.Product.id.in_(product_ids))
+    return query.all()
+
+
+def _serialize(product, held_by_product: Dict[str, int], held_by_variant: Dict[int, int]) -> dict:
+    data = schemas.Product.model_validate(product).model_dump(mode="json")
+    if product.id in held_by_product:
+        data["stock"] = max(0, (data["stock"] or 0) - held_by_product[product.id])
+        for variant in data["variants"]:
+            variant["stock"] = max(0, variant["stock"] - held_by_variant.get(variant["id"], 0))
+    return data
+
+
+def _card(product: dict) -> dict:
+    """
+    Proyección compacta (schemas.ProductSummary) de un producto serializado.
+    """
+    images = sorted(product["product_images"], key=lambda image: image["display_order"])
+    main_image = product["image_url"] or (images[0]["url"] if images else None) or \
+        (product["images"][0] if product["images"] else None)
+    return {
+        "id": product["id"],
+        "sku": product["sku"],
+        "name": product["name"],
+        "price": product["price"],
+        "price_override": product["price_override"],
+        "discount_percentage": product["discount_percentage"],
+        "effective_price": product["effective_price"],
+        "image_url": main_image,
+        "in_stock": (product["stock"] or 0) > 0,
+        "labels": product["labels"],
+    }
+
+
+def _active_categories(products: Dict[str, dict]) -> List[str]:
+    names = {
+        category["name"]
+        for product in products.values() if product["is_active"]
+        for category in product["categories"] if category["name"]
+    }
+    return sorted(names)
+
+
+def facet_counts(snapshot: CatalogSnapshot, product_ids: Optional[Iterable[str]] = None,
+                 categories: Optional[List[str]] = None, min_price: Optional[float] = None,
+                 max_price: Optional[float] = None) -> dict:
+    """
+    Cuenta productos activos por categoría, etiqueta, rango de precio y stock en
+    una sola pasada sobre el snapshot. product_ids acota al resultado de una
+    búsqueda (None = todo el catálogo).
+    Las facetas son disyuntivas: las categorías se cuentan sin aplicar el filtro
+    de categoría y los rangos de precio sin el filtro de precio, así la UI puede
+    mostrar las alternativas; etiquetas y stock respetan todos los filtros.
+    """
+    bounds = price_bucket_bounds()
+    selected = set(categories or [])
+    category_counts: Dict[str, int] = {}
+    label_counts: Dict[str, int] = {}
+    bucket_counts = [0] * (len(bounds) + 1)
+    total = in_stock = 0
+
+    ids = snapshot.products.keys() if product_ids is None else product_ids
+    for product_id in ids:
+        product = snapshot.products.get(product_id)
+        if product is None or not product["is_active"]:
+            continue
+        names = {category["name"] for category in product["categories"] if category["name"]}
+        price = product["effective_price"]
+        in_categories = not selected or not names.isdisjoint(selected)
+        in_price = (min_price is None or (price is not None and price >= min_price)) and \
+            (max_price is None or (price is not None and price <= max_price))
+
+        if in_price:
+            for name in names:
+                category_counts[name] = category_counts.get(name, 0) + 1
+        if in_categories and price is not None:
+            bucket_counts[bisect_right(bounds, price)] += 1
+        if in_categories and in_price:
+            total += 1
+            if (product["stock"] or 0) > 0:
+                in_stock += 1
+            for label in product["labels"]:
+                label_counts[label["name"]] = label_counts.get(label["name"], 0) + 1
+
+    edges = [None] + bounds + [None]
+    return {
+        "total": total,
+        "categories": [{"value": name, "count": count} for name, count in sorted(category_counts.items())],
+        "labels": [{"value": name, "count": count} for name, count in sorted(label_counts.items())],
+        "price_buckets": [
+            {"min": edges[i], "max": edges[i + 1], "count": count} for i, count in enumerate(bucket_counts)
+        ],
+        "in_stock": in_stock,
+        "out_of_stock": total - in_stock,
+    }
+
+
+class CatalogCache:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._version = 0
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def get(self, db: Session) -> CatalogSnapshot:
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                snapshot = self._snapshot or self.refresh(db)
+        return snapshot
+
+    def refresh(self, db: Session, product_ids: Optional[Iterable[str]] = None) -> Optional[CatalogSnapshot]:
+        """
+        Construye y publica un snapshot nuevo. Con product_ids solo recarga
+        esos productos (los que ya no existen se quitan); sin ellos, recarga todo.
+        """
+        with self._lock:
+            current = self._snapshot
+            if current is None and product_ids is not None:
+                # Not built yet: the next read loads everything
+                return None
+            if product_ids is None:
+                holds = services.inventory.active_holds(db)
+                products = {p.id: _serialize(p, *holds) for p in _load_products(db)}
+                cards = {pid: _card(product) for pid, product in products.items()}
+                etags = {pid: content_etag(product) for pid, product in products.items()}
+            else:
+                ids = [pid for pid in set(product_ids) if pid]
+                products = dict(current.products)
+                cards = dict(current.cards)
+                etags = dict(current.etags)
+                for product_id in ids:
+                    products.pop(product_id, None)
+                    cards.pop(product_id, None)
+                    etags.pop(product_id, None)
+                if ids:
+                    holds = services.inventory.active_holds(db, ids)
+                    for product in _load_products(db, ids):
+                        products[product.id] = _serialize(product, *holds)
+                        cards[product.id] = _card(products[product.id])
+                        etags[product.id] = content_etag(products[product.id])
+
+            self._version += 1
+            snapshot = CatalogSnapshot(self._version, products, cards, _active_categories(products), etags)
+            self._snapshot = snapshot
+            return snapshot
+
+    def invalidate(self):
+        """
+        Descarta el snapshot; se reconstruye completo en la próxima lectura.
+        """
+        with self._lock:
+            self._snapshot = None
+
+
+catalog_cache = CatalogCache()
+
+
+def notify_change(db: Session, product_ids: Optional[Iterable[str]] = None):
+    """
+    Hook post-commit para escrituras sobre el catálogo. Con product_ids
+    actualiza incrementalmente; sin ellos (cambios de etiquetas, categorías,
+    guías de talles o borrados masivos) reconstruye todo.
+    """
+    if product_ids is None:
+        suggest_index.invalidate()
+        catalog_cache.invalidate()
+        return
+
+    product_ids = list(product_ids)
+    suggest_index.refresh_products(db, product_ids)
+    catalog_cache.refresh(db, product_ids)
@@ -1,102 +1,166 @@
 import requests
+from requests.adapters import HTTPAdapter
 import os
 import json
-from typing import Any
+from typing import Any, List, Optional, Tuple
 from datetime import datetime
 
+
+def http_session(pool_size: int = 4) -> requests.Session:
+    """
+    Sesión HTTP con pool de conexiones para hablar con la plataforma de gestión.
+    """
+    http = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    http.mount("http://", adapter)
+    http.mount("https://", adapter)
+    return http
+
+
 class IntegrationService:
     def __init__(self):
         self.webhook_url = os.getenv("MANAGEMENT_WEBHOOK_URL", "")
         self.api_token = os.getenv("MANAGEMENT_API_TOKEN", "") # Optional security header
+        # Optional: endpoint that accepts a JSON list of sales in one request
+        self.batch_url = os.getenv("MANAGEMENT_WEBHOOK_BATCH_URL", "")
+        # Stock feed for /admin/sync-stock (see services/stock_sync.py)
+        self.stock_url = os.getenv("MANAGEMENT_STOCK_URL", "")
 
-    def notify_new_sale(self, order: Any, payment_id: str):
+    def headers(self) -> dict:
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_token}"
+        }
+
+    def build_sale_payload(self, order: Any, payment_id: str) -> dict:
         """
-        Notifica una nueva venta a la plataforma de gestión externa.
+        Arma el payload de venta para la plataforma de gestión externa.
         """
-        if not self.webhook_url:
-            print("⚠️ MANAGEMENT_WEBHOOK_URL not set. Skipping integration.")
-            return
-
+        # 1. Parse JSON fields (Stored as text in DB)
+        shipping_data = {}
+        billing_data = {}
         try:
-            # 1. Parse JSON fields (Stored as text in DB)
-            shipping_data = {}
-            billing_data = {}
-            try:
-                if order.shipping_data:
-                    shipping_data = json.loads(order.shipping_data)
-                if order.billing_data:
-                    billing_data = json.loads(order.billing_data)
-            except Exception as e:
-                print(f"Error parsing order JSON data for webhook: {e}")
-
-            # 2. Build Customer Block
-            customer_payload = {
-                "name": order.customer.full_name,
-                "email": order.customer.email,
-                "phone": order.customer.phone or "",
-                # Fallback to billing data for Doc Type/Number if available
-                "doc_type": billing_data.get("invoice_type", "Consumer"), 
-                "doc_number": billing_data.get("dni") or billing_data.get("cuit") or ""
-            }
+            if order.shipping_data:
+                shipping_data = json.loads(order.shipping_data)
+            if order.billing_data:
+                billing_data = json.loads(order.billing_data)
+        except Exception as e:
+            print(f"Error parsing order JSON data for webhook: {e}")
 
-            # 3. Build Shipping Block
-            shipping_payload = {
-                "type": order.delivery_method, # "shipping" or "pickup"
-                "cost": 0, # Todo: logic for shipping cost if stored separately. For now assumed calculated in total or 0 if free.
-            }
-            
-            if order.delivery_method == 'shipping':
-                shipping_payload["address"] = {
-                    "street": shipping_data.get("address", ""),
-                    "number": "", # Address field usually contains full string, might need parsing or just send full line
-                    "city": shipping_data.get("city", ""),
-                    "state": shipping_data.get("province", ""),
-                    "zip": shipping_data.get("zip_code", ""),
-                    "full_address": f"{shipping_data.get('address', '')} {shipping_data.get('floor_apt', '')}" # Helper
-                }
-            elif order.delivery_method == 'pickup':
-                 shipping_payload["pickup_details"] = {
-                     "name": shipping_data.get("pickup_name", ""),
-                     "dni": shipping_data.get("pickup_dni", "")
-                 }
-
-            # 4. Build Items Block
-            items_payload = []
-            for item in order.items:
-                 # Fetch product SKU/Name safely
-                sku = getattr(item.product, 'sku', f"ID-{item.product_id}") if hasattr(item, 'product') else f"ID-{item.product_id}"
-                
-                items_payload.append({
-                    "sku": sku,
-                    "quantity": item.quantity,
-                    "unit_price": item.unit_price
-                })
-
-            # 5. Construct Final Payload
-            payload = {
-                "external_order_id": f"#{order.id}",
-                "payment_id": payment_id,
-                "date": order.created_at.isoformat() if order.created_at else datetime.now().isoformat(),
-                "customer": customer_payload,
-                "shipping": shipping_payload,
-                "billing": billing_data, # Send full billing object
-                "items": items_payload,
-                "total": order.total_amount,
-                "payment_method": "mercadopago"
-            }
+        # 2. Build Customer Block
+        customer_payload = {
+            "name": order.customer.full_name,
+            "email": order.customer.email,
+            "phone": order.customer.phone or "",
+            # Fallback to billing data for Doc Type/Number if available
+            "doc_type": billing_data.get("invoice_type", "Consumer"), 
+            "doc_number": billing_data.get("dni") or billing_data.get("cuit") or ""
+        }
 
-            # 6. Send Request
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.api_token}"
+        # 3. Build Shipping Block
+        shipping_payload = {
+            "type": order.delivery_method, # "shipping" or "pickup"
+            "cost": 0, # Todo: logic for shipping cost if stored separately. For now assumed calculated in total or 0 if free.
+        }
+        
+        if order.delivery_method == 'shipping':
+            shipping_payload["address"] = {
+                "street": shipping_data.get("address", ""),
+                "number": "", # Address field usually contains full string, might need parsing or just send full line
+                "city": shipping_data.get("city", ""),
+                "state": shipping_data.get("province", ""),
+                "zip": shipping_data.get("zip_code", ""),
+                "full_address": f"{shipping_data.get('address', '')} {shipping_data.get('floor_apt', '')}" # Helper
             }
+        elif order.delivery_method == 'pickup':
+             shipping_payload["pickup_details"] = {
+                 "name": shipping_data.get("pickup_name", ""),
+                 "dni": shipping_data.get("pickup_dni", "")
+             }
+
+        # 4. Build Items Block
+        items_payload = []
+        for item in order.items:
+             # Fetch product SKU/Name safely
+            sku = getattr(item.product, 'sku', f"ID-{item.product_id}") if hasattr(item, 'product') else f"ID-{item.product_id}"
             
-            response = requests.post(self.webhook_url, json=payload, headers=headers, timeout=10)
-            
-            if response.status_code in [200, 201]:
-                print(f"✅ Notificación enviada a plataforma de gestión (Orden #{order.id})")
-            else:
-                print(f"❌ Error notificando a plataforma: {response.status_code} - {response.text}")
+            items_payload.append({
+                "sku": sku,
+                "quantity": item.quantity,
+                "unit_price": item.unit_price
+            })
 
-        except Exception as e:
-            print(f"❌ Exception in IntegrationService: {e}")
+        # 5. Construct Final Payload
+        return {
+            "external_order_id": f"#{order.id}",
+            "payment_id": payment_id,
+            "date": order.created_at.isoformat() if order.created_at else datetime.now().isoformat(),
+            "customer": customer_payload,
+            "shipping": shipping_payload,
+            "billing": billing_data, # Send full billing object
+            "items": items_payload,
+            "total": order.total_amount,
+            "payment_method": "mercadopago"
+        }
+
+    def send_sales(self, http: requests.Session, events: List[Tuple[int, dict]],
+                   timeout=(3, 10)) -> List[Tuple[int, str]]:
+        """
+        Envía ventas (event_id, payload) usando la sesión HTTP compartida.
+        Con MANAGEMENT_WEBHOOK_BATCH_URL las manda en un solo request; si no,
+        una por una. Retorna (event_id, error) de las que fallaron.
+        Cada request lleva X-Event-Id para que el receptor descarte reintentos duplicados.
+        """
+        if self.batch_url and len(events) > 1:
+            headers = {**self.headers(), "X-Event-Id": ",".join(str(event_id) for event_id, _ in events)}
+            error = self._post(http, self.batch_url, [payload for _, payload in events], headers, timeout)
+            return [(event_id, error) for event_id, _ in events] if error else []
+
+        failed = []
+        for event_id, payload in events:
+            error = self._post(http, self.webhook_url, payload, {**self.headers(), "X-Event-Id": str(event_id)}, timeout)
+            if error:
+                failed.append((event_id, error))
+        return failed
+
+    def _post(self, http: requests.Session, url: str, body, headers: dict, timeout) -> str:
+        try:
+            response = http.post(url, json=body, headers=headers, timeout=timeout)
+        except requests.RequestException as e:
+            return f"{type(e).__name__}: {e}"
+        if response.status_code in [200, 201, 202, 204]:
+            return ""
+        return f"HTTP {response.status_code}: {response.text[:200]}"
+
+    def fetch_stock_page(self, http: requests.Session, since: Optional[str] = None, etag: Optional[str] = None,
+                         timeout=(3, 30)) -> Optional[Tuple[dict, Optional[str]]]:
+        """
+        Pide una página del feed de stock: GET MANAGEMENT_STOCK_URL?since=<cursor>.
+        Respuesta esperada: {"items": [{"sku", "stock"}], "cursor": "...", "has_more": bool}.
+        Retorna (body, etag), o None si la plataforma responde 304 (sin cambios).
+        """
+        headers = self.headers()
+        if etag:
+            headers["If-None-Match"] = etag
+        params = {"since": since} if since else {}
+        response = http.get(self.stock_url, params=params, headers=headers, timeout=timeout)
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        return response.json(), response.headers.get("ETag")
+
+    def notify_new_sale(self, order: Any, payment_id: str):
+        """
+        Notifica una venta de forma sincrónica (scripts de prueba). El checkout
+        usa el outbox (services/outbox.py), que reintenta en segundo plano.
+        """
+        if not self.webhook_url:
+            print("⚠️ MANAGEMENT_WEBHOOK_URL not set. Skipping integration.")
+            return
+
+        with requests.Session() as http:
+            failed = self.send_sales(http, [(order.id, self.build_sale_payload(order, payment_id))])
+        if failed:
+            print(f"❌ Error notificando a plataforma: {failed[0][1]}")
+        else:
+            print(f"✅ Notificación enviada a plataforma de gestión (Orden #{order.id})")
@@ -0,0 +1,242 @@
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import case, delete, func, insert, select, update
+from sqlalchemy.orm import Session
+import database, models
+import services.catalog
+
+# Stock de órdenes: reservas con vencimiento + descuento definitivo al pagar.
+#
+# POST /orders no descuenta stock: reserva (tabla stock_reservations) por
+# RESERVATION_TTL_MINUTES. El disponible es stock - reservas activas (sin
+# liberar y sin vencer); se calcula con SUM agrupado sobre los índices
+# (product_id | variant_id, expires_at), así una reserva vencida deja de contar
+# en el acto, aunque el sweeper todavía no haya pasado.
+# Al reservar se bloquean las filas de stock involucradas (SELECT ... FOR UPDATE,
+# productos y después variantes, por id para un orden de locks estable); el
+# producto padre se bloquea también para las líneas con variante: dos checkouts
+# solo se serializan si compiten por el mismo producto. En SQLite el lock de
+# escritura de la transacción ya los serializa.
+#
+# confirm_order convierte las reservas en descuentos con UPDATE condicionales
+# (... SET stock = stock - :q WHERE id = :id AND stock >= :q). Las órdenes
+# creadas antes de las reservas no tienen filas: su stock ya se descontó.
+# El sweeper marca en bloque las reservas vencidas (released_at) y refresca el
+# catálogo de esos productos. Son UPDATE masivos (sin eventos del ORM): los
+# descuentos vencen el payload_hash del producto a mano.
+
+RESERVATION_TTL_MINUTES = int(os.getenv("RESERVATION_TTL_MINUTES", "30"))
+RESERVATION_SWEEP_SECONDS = float(os.getenv("RESERVATION_SWEEP_SECONDS", "60"))
+RESERVATION_RETENTION_DAYS = int(os.getenv("RESERVATION_RETENTION_DAYS", "30"))
+
+
+def _active(now: datetime):
+    return (models.StockReservation.released_at.is_(None), models.StockReservation.expires_at > now)
+
+
+def active_holds(db: Session, product_ids: Optional[Iterable[str]] = None) -> Tuple[Dict[str, int], Dict[int, int]]:
+    """
+    Unidades reservadas (activas) por producto y por variante, en una consulta
+    agrupada. Las reservas de variantes también cuentan para su producto.
+    """
+    reservation = models.StockReservation
+    query = select(reservation.product_id, reservation.variant_id, func.sum(reservation.quantity)).where(
+        *_active(datetime.now(timezone.utc))
+    ).group_by(reservation.product_id, reservation.variant_id)
+    if product_ids is not None:
+        query = query.where(reservation.product_id.in_(list(product_ids)))
+
+    by_product: Dict[str, int] = {}
+    by_variant: Dict[int, int] = {}
+    for product_id, variant_id, quantity in db.execute(query):
+        by_product[product_id] = by_product.get(product_id, 0) + quantity
+        if variant_id:
+            by_variant[variant_id] = quantity
+    return by_product, by_variant
+
+
+def available_stock(db: Session, model, row_id) -> int:
+    """
+    Stock disponible de una fila (producto o variante): stock - reservas activas.
+    """
+    stock = db.scalar(select(model.stock).where(model.id == row_id)) or 0
+    column = models.StockReservation.variant_id if model is models.ProductVariant else models.StockReservation.product_id
+    held = db.scalar(
+        select(func.coalesce(func.sum(models.StockReservation.quantity), 0))
+        .where(column == row_id, *_active(datetime.now(timezone.utc)))
+    )
+    return max(0, stock - held)
+
+
+def reserve(db: Session, order_id: int, wanted: Dict[Tuple[Optional[int], str], int]) -> List[tuple]:
+    """
+    Reserva para la orden las cantidades pedidas ((variant_id | None, product_id) -> cantidad)
+    en la transacción actual, con una cantidad fija de consultas.
+    Retorna los faltantes (variant_id, product_id, disponible); si hay alguno
+    no reserva nada y el llamador debe hacer rollback.
+    """
+    variant_ids = sorted(variant_id for variant_id, _ in wanted if variant_id)
+    product_ids = sorted({product_id for _, product_id in wanted})
+
+    # Lock the stock rows (row-level, stable order: products, then variants) and
+    # read their stock. The parent product is locked for variant lines too, so a
+    # variant checkout and a product-level checkout of the same product serialize.
+    stock_by_product = dict(db.execute(
+        select(models.Product.id, models.Product.stock)
+        .where(models.Product.id.in_(product_ids))
+        .order_by(models.Product.id).with_for_update()
+    ).all())
+    stock_by_variant = {}
+    if variant_ids:
+        stock_by_variant = dict(db.execute(
+            select(models.ProductVariant.id, models.ProductVariant.stock)
+            .where(models.ProductVariant.id.in_(variant_ids))
+            .order_by(models.ProductVariant.id).with_for_update()
+        ).all())
+
+    held_by_product, held_by_variant = active_holds(db, product_ids)
+
+    shortfalls = []
+    for (variant_id, product_id), quantity in wanted.items():
+        if variant_id:
+            available = (stock_by_variant.get(variant_id) or 0) - held_by_variant.get(variant_id, 0)
+        else:
+            available = (stock_by_product.get(product_id) or 0) - held_by_product.get(product_id, 0)
+        if available < quantity:
+            shortfalls.append((variant_id, product_id, max(0, available)))
+    if shortfalls:
+        return shortfalls
+
+    expires_at = datetime.now(timezone.utc) + timedelta(minutes=RESERVATION_TTL_MINUTES)
+    db.execute(insert(models.StockReservation), [
+        {"order_id": order_id, "product_id": product_id, "variant_id": variant_id,
+         "quantity": quantity, "expires_at": expires_at}
+        for (variant_id, product_id), quantity in wanted.items()
+    ])
+    return []
+
+
+def _take(db: Session, model, row_id, quantity: int, **values) -> bool:
+    result = db.execute(
+        update(model).where(model.id == row_id, model.stock >= quantity)
+        .values(stock=model.stock - quantity, **values)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def _take_clamped(db: Session, model, row_id, quantity: int, **values):
+    db.execute(
+        update(model).where(model.id == row_id)
+        .values(stock=case((model.stock >= quantity, model.stock - quantity), else_=0), **values)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def take_product_stock(db: Session, product_id: str, quantity: int) -> bool:
+    """
+    Descuenta stock de un producto sin variantes. False si no alcanza.
+    """
+    return _take(db, models.Product, product_id, quantity, payload_hash=None)
+
+
+def take_variant_stock(db: Session, variant_id: int, product_id: str, quantity: int) -> bool:
+    """
+    Descuenta stock de una variante (condicional) y del total del producto.
+    False si la variante no alcanza. El total del producto no se valida
+    (la variante manda): si está desalineado se lleva a 0 en vez de fallar.
+    """
+    if not _take(db, models.ProductVariant, variant_id, quantity):
+        return False
+    _take_clamped(db, models.Product, product_id, quantity, payload_hash=None)
+    return True
+
+
+def convert_reservations(db: Session, order: models.Order) -> bool:
+    """
+    Pasa las reservas de una orden pagada a descuentos definitivos (sin commit:
+    va en la misma transacción que el cambio de estado). Si la reserva ya había
+    vencido el pago igual se respeta: se descuenta lo que haya y se avisa.
+    Retorna False si la orden no tenía reservas (orden previa a las reservas).
+    """
+    held = db.execute(
+        delete(models.StockReservation).where(models.StockReservation.order_id == order.id)
+    ).rowcount
+    if not held:
+        return False
+
+    wanted: Dict[Tuple[Optional[int], str], int] = {}
+    for item in order.items:
+        key = (item.variant_id or None, item.product_id)
+        wanted[key] = wanted.get(key, 0) + item.quantity
+    for (variant_id, product_id), quantity in wanted.items():
+        taken = take_variant_stock(db, variant_id, product_id, quantity) if variant_id \
+            else take_product_stock(db, product_id, quantity)
+        if not taken:
+            print(f"⚠️ Order #{order.id}: reservation expired and stock ran out for {variant_id or product_id}. Oversold {quantity}.")
+            if variant_id:
+                _take_clamped(db, models.ProductVariant, variant_id, quantity)
+            _take_clamped(db, models.Product, product_id, quantity, payload_hash=None)
+    return True
+
+
+def release_expired(db: Session) -> List[str]:
+    """
+    Marca como liberadas las reservas vencidas y purga las viejas. Retorna los
+    productos cuyo disponible cambió (para refrescar el catálogo).
+    """
+    now = datetime.now(timezone.utc)
+    expired = (models.StockReservation.released_at.is_(None), models.StockReservation.expires_at <= now)
+    if db.execute(select(models.StockReservation.id).where(*expired).limit(1)).first() is None:
+        return []
+
+    database.lock_for_write(db)
+    product_ids = list(db.execute(select(models.StockReservation.product_id).where(*expired).distinct()).scalars())
+    db.execute(
+        update(models.StockReservation).where(*expired).values(released_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    db.execute(delete(models.StockReservation).where(
+        models.StockReservation.released_at < now - timedelta(days=RESERVATION_RETENTION_DAYS)
+    ))
+    db.commit()
+    return product_ids
+
+
+class ReservationSweeper:
+    def __init__(self):
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="reservation-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            db = database.SessionLocal()
+            try:
+                product_ids = release_expired(db)
+                if product_ids:
+                    print(f"🔓 Released expired stock reservations for {len(product_ids)} products")
+                    services.catalog.notify_change(db, product_ids)
+            except Exception as e:
+                print(f"❌ Reservation sweeper failed: {e}")
+                db.rollback()
+            finally:
+                db.close()
+            self._stop.wait(RESERVATION_SWEEP_SECONDS)
+
+
+sweeper = ReservationSweeper()
@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+import requests
+from sqlalchemy.orm import Session
+import database, models
+import services.integration
+
+# Outbox transaccional para la plataforma de gestión.
+# confirm_order inserta el evento 'sale.created' en la misma transacción que
+# marca la orden como pagada (nunca hay orden pagada sin evento, ni evento sin
+# orden pagada), y responde sin esperar a la plataforma.
+# Un dispatcher en segundo plano entrega los eventos pendientes:
+# - Una sesión HTTP con pool de conexiones reutilizada entre envíos.
+# - Tandas de hasta OUTBOX_BATCH_SIZE eventos (un solo request si la plataforma
+#   expone MANAGEMENT_WEBHOOK_BATCH_URL).
+# - Reintentos con backoff exponencial; tras OUTBOX_MAX_ATTEMPTS el evento queda
+#   'dead' y solo se reintenta a mano (POST /admin/outbox/{id}/retry).
+# La entrega es at-least-once: cada request lleva X-Event-Id para deduplicar.
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "5.0"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_BACKOFF_SECONDS", "30"))
+OUTBOX_BACKOFF_MAX_SECONDS = float(os.getenv("OUTBOX_BACKOFF_MAX_SECONDS", "3600"))
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", "30"))
+
+
+def backoff(attempts: int) -> timedelta:
+    """
+    Espera antes del próximo intento: 30s, 60s, 120s, ... hasta OUTBOX_BACKOFF_MAX_SECONDS.
+    """
+    return timedelta(seconds=min(OUTBOX_BACKOFF_SECONDS * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX_SECONDS))
+
+
+def enqueue_sale(db: Session, order: models.Order, payment_id: str) -> models.OutboxEvent:
+    """
+    Agrega el evento de venta a la sesión, sin commit: lo confirma el mismo
+    commit que marca la orden como pagada.
+    """
+    payload = services.integration.IntegrationService().build_sale_payload(order, payment_id)
+    event = models.OutboxEvent(
+        event_type="sale.created",
+        aggregate_id=str(order.id),
+        payload=json.dumps(payload),
+        status="pending",
+        attempts=0,
+        next_attempt_at=datetime.now(timezone.utc),
+    )
+    db.add(event)
+    return event
+
+
+def dispatch_batch(db: Session, http: requests.Session, limit: Optional[int] = None) -> int:
+    """
+    Entrega una tanda de eventos vencidos. Retorna cuántos intentó enviar.
+    Los envíos se hacen fuera de la transacción; el lock de escritura se toma
+    recién para registrar el resultado.
+    """
+    service = services.integration.IntegrationService()
+    if not service.webhook_url:
+        return 0
+
+    now = datetime.now(timezone.utc)
+    events: List[models.OutboxEvent] = db.query(models.OutboxEvent).filter(
+        models.OutboxEvent.status == "pending",
+        models.OutboxEvent.next_attempt_at <= now
+    ).order_by(models.OutboxEvent.id).limit(limit or OUTBOX_BATCH_SIZE).all()
+    if not events:
+        return 0
+
+    failed = dict(service.send_sales(http, [(event.id, json.loads(event.payload)) for event in events]))
+
+    database.lock_for_write(db)
+    now = datetime.now(timezone.utc)
+    for event in events:
+        event.attempts = (event.attempts or 0) + 1
+        if event.id not in failed:
+            event.status = "sent"
+            event.sent_at = now
+            event.last_error = None
+            continue
+        event.last_error = failed[event.id]
+        if event.attempts >= OUTBOX_MAX_ATTEMPTS:
+            event.status = "dead"
+            print(f"❌ Outbox event {event.id} ({event.event_type} #{event.aggregate_id}) dead after {event.attempts} attempts: {event.last_error}")
+        else:
+            event.next_attempt_at = now + backoff(event.attempts)
+    db.commit()
+
+    if failed:
+        print(f"⚠️ Outbox: {len(failed)}/{len(events)} events failed, will retry")
+    return len(events)
+
+
+def requeue(db: Session, event: models.OutboxEvent):
+    """
+    Vuelve a encolar un evento (p. ej. uno 'dead' después de arreglar la plataforma).
+    """
+    event.status = "pending"
+    event.attempts = 0
+    event.next_attempt_at = datetime.now(timezone.utc)
+    db.commit()
+    dispatcher.wake()
+
+
+def purge_sent(db: Session, days: int = OUTBOX_RETENTION_DAYS) -> int:
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    deleted = db.query(models.OutboxEvent).filter(
+        models.OutboxEvent.status == "sent",
+        models.OutboxEvent.sent_at < cutoff
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+
+class OutboxDispatcher:
+    def __init__(self):
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread:
+            return
+        if not os.getenv("MANAGEMENT_WEBHOOK_URL"):
+            print("⚠️ MANAGEMENT_WEBHOOK_URL not set. Sale events stay in the outbox.")
+            return
+        db = database.SessionLocal()
+        try:
+            purge_sent(db)
+        finally:
+            db.close()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="outbox-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _run(self):
+        with services.integration.http_session() as http:
+            while not self._stop.is_set():
+                db = database.SessionLocal()
+                try:
+                    taken = dispatch_batch(db, http)
+                except Exception as e:
+                    print(f"❌ Outbox dispatcher failed: {e}")
+                    db.rollback()
+                    taken = 0
+                finally:
+                    db.close()
+                if taken < OUTBOX_BATCH_SIZE:
+                    # Nothing (or little) left due: wait for a new sale or the next retry
+                    self._wakeup.wait(OUTBOX_POLL_SECONDS)
+                    self._wakeup.clear()
+
+
+dispatcher = OutboxDispatcher()
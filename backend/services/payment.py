@@ -1,20 +1,180 @@
+import asyncio
 import mercadopago
 import os
-from typing import List, Dict, Any
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from mercadopago.config.request_options import RequestOptions
+from mercadopago.http.http_client import HttpClient
+
+# Cliente de MercadoPago compartido.
+# Un solo SDK por proceso sobre un requests.Session con pool de conexiones
+# (el HttpClient del SDK abre una sesión nueva en cada llamada). Cada llamada
+# tiene timeout (MP_TIMEOUT_SECONDS) y sin reintentos automáticos: reintentar
+# contra un gateway lento solo multiplica la espera del checkout.
+# El circuit breaker cuenta errores consecutivos (conexión, timeout, 5xx/429);
+# al llegar a MP_BREAKER_FAILURES corta las llamadas durante
+# MP_BREAKER_RESET_SECONDS (PaymentGatewayUnavailable, sin tocar la red) y
+# después deja pasar una sola llamada de prueba.
+# create_preference_async corre en un executor propio (MP_MAX_CONCURRENCY
+# hilos) con presupuesto de tiempo total: un MercadoPago lento ocupa esos
+# hilos, no el threadpool que atiende al resto de la API.
+
+MP_API_BASE_URL = "https://api.mercadopago.com"
+MP_TIMEOUT_SECONDS = float(os.getenv("MP_TIMEOUT_SECONDS", "8"))
+MP_PREFERENCE_BUDGET_SECONDS = float(os.getenv("MP_PREFERENCE_BUDGET_SECONDS", "10"))
+MP_MAX_CONCURRENCY = int(os.getenv("MP_MAX_CONCURRENCY", "8"))
+MP_BREAKER_FAILURES = int(os.getenv("MP_BREAKER_FAILURES", "5"))
+MP_BREAKER_RESET_SECONDS = float(os.getenv("MP_BREAKER_RESET_SECONDS", "30"))
+
+
+class PaymentGatewayUnavailable(Exception):
+    """MercadoPago no respondió a tiempo, falló o el circuit breaker está abierto."""
+
+
+class PaymentLookupError(Exception):
+    """MercadoPago rechazó la consulta (4xx: pago inexistente, id inválido). Reintentar no sirve."""
+
+
+class CircuitBreaker:
+    def __init__(self, failures: int = MP_BREAKER_FAILURES, reset_seconds: float = MP_BREAKER_RESET_SECONDS):
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._consecutive = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half_open" if time.monotonic() - self._opened_at >= self.reset_seconds else "open"
+
+    def before_call(self):
+        """
+        Deja pasar la llamada o levanta PaymentGatewayUnavailable si el circuito
+        está abierto. Pasado el reset_seconds, solo una llamada de prueba a la vez.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.reset_seconds or self._probing:
+                raise PaymentGatewayUnavailable("MercadoPago circuit open")
+            self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._consecutive += 1
+            if self._probing or self._consecutive >= self.failures:
+                if self._opened_at is None or self._probing:
+                    print(f"⚠️ MercadoPago circuit open after {self._consecutive} consecutive failures")
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def reset(self):
+        self.record_success()
+
+
+class PooledHttpClient(HttpClient):
+    """
+    HttpClient del SDK sobre una sesión compartida, con timeout por llamada y
+    circuit breaker. MP_API_BASE_URL permite apuntar a otro host (stub en tests).
+    """
+
+    def __init__(self, breaker: CircuitBreaker, pool_size: int = MP_MAX_CONCURRENCY,
+                 timeout: float = MP_TIMEOUT_SECONDS):
+        self.breaker = breaker
+        self.timeout = timeout
+        self.base_url = os.getenv("MP_API_BASE_URL", MP_API_BASE_URL).rstrip("/")
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method, url, maxretries=None, retry_on=None, backoff_factor=None, **kwargs):
+        self.breaker.before_call()
+        if url.startswith(MP_API_BASE_URL):
+            url = self.base_url + url[len(MP_API_BASE_URL):]
+        kwargs["timeout"] = self.timeout
+        try:
+            api_result = self.session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            self.breaker.record_failure()
+            raise PaymentGatewayUnavailable(f"MercadoPago request failed: {e}") from e
+
+        if api_result.status_code >= 500 or api_result.status_code == 429:
+            self.breaker.record_failure()
+        else:
+            # 4xx is a bad request on our side, not a gateway outage
+            self.breaker.record_success()
+
+        response = {"status": api_result.status_code, "response": None}
+        if api_result.status_code != 204 and api_result.content:
+            try:
+                response["response"] = api_result.json()
+            except ValueError:
+                response["response"] = {"message": "Invalid JSON in response body"}
+        return response
+
+
+breaker = CircuitBreaker()
+_sdk_lock = threading.Lock()
+_sdk: Optional[mercadopago.SDK] = None
+_executor = ThreadPoolExecutor(max_workers=MP_MAX_CONCURRENCY, thread_name_prefix="mercadopago")
+
+
+def shared_sdk() -> mercadopago.SDK:
+    """
+    SDK único del proceso (se crea en el primer uso).
+    """
+    global _sdk
+    with _sdk_lock:
+        if _sdk is None:
+            access_token = os.getenv("MP_ACCESS_TOKEN")
+            if not access_token:
+                print("WARNING: MP_ACCESS_TOKEN not found in environment variables")
+            # Fallback to avoid crash on init, but calls will fail
+            access_token = access_token or "TEST-0000000000"
+            options = RequestOptions(access_token=access_token, connection_timeout=MP_TIMEOUT_SECONDS, max_retries=0)
+            _sdk = mercadopago.SDK(access_token, http_client=PooledHttpClient(breaker, timeout=MP_TIMEOUT_SECONDS),
+                                 request_options=options)
+        return _sdk
+
+
+def reset_client():
+    """
+    Descarta el SDK compartido (se recrea con el entorno actual) y cierra el breaker.
+    """
+    global _sdk
+    with _sdk_lock:
+        if _sdk is not None:
+            _sdk.http_client.session.close()
+        _sdk = None
+    breaker.reset()
+
 
 class PaymentService:
     def __init__(self):
-        # Initialize SDK with Access Token from env
-        access_token = os.getenv("MP_ACCESS_TOKEN")
-        if not access_token:
-            print("WARNING: MP_ACCESS_TOKEN not found in environment variables")
-        self.sdk = mercadopago.SDK(access_token or "TEST-0000000000") # Fallback to avoid crash on init, but calls will fail
+        # Cheap: every instance shares the pooled SDK
+        self.sdk = shared_sdk()
 
     def create_preference(self, order_id: int, items: List[Dict[str, Any]], payer_email: str) -> str:
         """
         Creates a Mercado Pago Preference and returns the init_point URL.
+        Raises PaymentGatewayUnavailable if the gateway is down, slow or the circuit is open.
         """
-        
+
         # Transform items to MP format
         mp_items = []
         for item in items:
@@ -45,23 +205,39 @@ class PaymentService:
         }
 
         preference_response = self.sdk.preference().create(preference_data)
-        
+
         # Validate response
+        if preference_response["status"] >= 300:
+            raise PaymentGatewayUnavailable(f"MercadoPago preference failed with status {preference_response['status']}")
         response = preference_response["response"]
 
         # Use init_point for PRODUCTION (User Request)
         # This will lead to the real payment gateway.
         return response.get("init_point")
 
-    def get_payment_status(self, payment_id: str) -> str:
+    async def create_preference_async(self, order_id: int, items: List[Dict[str, Any]], payer_email: str,
+                                      budget: Optional[float] = None) -> str:
         """
-        Verifica el estado de un pago específico en Mercado Pago.
-        Retorna: 'approved', 'pending', 'rejected', etc.
+        create_preference sin bloquear el event loop: corre en el executor de
+        MercadoPago y falla con PaymentGatewayUnavailable si excede el presupuesto
+        (incluye la espera por un hilo libre).
         """
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(_executor, self.create_preference, order_id, items, payer_email)
         try:
-            payment_info = self.sdk.payment().get(payment_id)
-            status = payment_info["response"]["status"]
-            return status
-        except Exception as e:
-            print(f"Error fetching payment {payment_id}: {e}")
-            return "unknown"
+            return await asyncio.wait_for(future, budget or MP_PREFERENCE_BUDGET_SECONDS)
+        except asyncio.TimeoutError:
+            raise PaymentGatewayUnavailable(f"MercadoPago preference for order #{order_id} exceeded its time budget")
+
+    def get_payment(self, payment_id: str) -> Dict[str, Any]:
+        """
+        Pago completo de Mercado Pago (status, external_reference, ...).
+        Raises PaymentLookupError on 4xx (permanent) and PaymentGatewayUnavailable
+        on 5xx/429, timeouts or an open circuit (worth retrying).
+        """
+        payment_info = self.sdk.payment().get(payment_id)
+        if 400 <= payment_info["status"] < 500 and payment_info["status"] != 429:
+            raise PaymentLookupError(f"MercadoPago payment {payment_id} lookup failed with status {payment_info['status']}")
+        if payment_info["status"] != 200 or not payment_info["response"]:
+            raise PaymentGatewayUnavailable(f"MercadoPago payment {payment_id} fetch failed with status {payment_info['status']}")
+        return payment_info["response"]
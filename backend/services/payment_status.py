@@ -0,0 +1,75 @@
+from typing import Optional
+from sqlalchemy import insert, select, true, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+import models
+import services.payment
+
+# Caché de estados de pago por payment_id (tabla payment_statuses).
+# La alimentan las notificaciones de MercadoPago (POST /webhooks/mercadopago)
+# y las consultas de confirm_order; order_id siempre sale del external_reference
+# del pago, así un payment_id de otra orden no confirma esta. Un estado terminal ya no cambia para el
+# checkout: confirm_order y get_order lo responden desde acá sin ir al gateway.
+# Los estados intermedios (pending, in_process, ...) se vuelven a consultar.
+# Un estado terminal no se pisa con uno intermedio (notificaciones fuera de
+# orden); refunded/charged_back sí reemplazan a approved.
+
+TERMINAL_STATUSES = {"approved", "rejected", "cancelled", "refunded", "charged_back"}
+
+
+def cached(db: Session, payment_id: str) -> Optional[models.PaymentStatus]:
+    return db.get(models.PaymentStatus, payment_id)
+
+
+def record(db: Session, payment_id: str, status: str, order_id: Optional[int] = None):
+    """
+    Guarda (upsert) el estado del pago y hace commit. order_id solo se
+    completa desde el external_reference que informa MercadoPago.
+    """
+    values = {"status": status}
+    if order_id is not None:
+        values["order_id"] = order_id
+    newer = models.PaymentStatus.status.notin_(TERMINAL_STATUSES) if status not in TERMINAL_STATUSES else true()
+    for attempt in range(2):
+        exists = db.scalar(select(models.PaymentStatus.payment_id).where(models.PaymentStatus.payment_id == payment_id))
+        try:
+            if exists:
+                db.execute(
+                    update(models.PaymentStatus).where(models.PaymentStatus.payment_id == payment_id, newer)
+                    .values(**values).execution_options(synchronize_session=False)
+                )
+            else:
+                db.execute(insert(models.PaymentStatus).values(payment_id=payment_id, **values))
+            db.commit()
+            return
+        except IntegrityError:
+            # Concurrent notification inserted it first: update instead
+            db.rollback()
+            if attempt:
+                raise
+
+
+class PaymentOrderMismatch(Exception):
+    """El pago pertenece a otra orden (su external_reference no es la orden)."""
+
+
+def resolve(db: Session, payment_id: str, order_id: int) -> str:
+    """
+    Estado del pago de la orden: desde la caché si es terminal; si no, lee el
+    pago de MP, verifica que su external_reference sea la orden y lo guarda.
+    Levanta PaymentOrderMismatch si el pago es de otra orden; los errores del
+    gateway (services.payment) se propagan.
+    """
+    row = cached(db, payment_id)
+    if row and row.order_id is not None:
+        if row.order_id != order_id:
+            raise PaymentOrderMismatch(f"Payment {payment_id} belongs to order #{row.order_id}")
+        if row.status in TERMINAL_STATUSES:
+            return row.status
+
+    payment = services.payment.PaymentService().get_payment(payment_id)
+    if str(payment.get("external_reference") or "") != str(order_id):
+        raise PaymentOrderMismatch(f"Payment {payment_id} is not for order #{order_id}")
+    status = payment.get("status") or "unknown"
+    record(db, payment_id, status, order_id=order_id)
+    return status
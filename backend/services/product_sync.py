@@ -0,0 +1,515 @@
+import hashlib
+import json
+import uuid
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+from pydantic import ValidationError
+from sqlalchemy import delete, insert, or_, select, update
+from sqlalchemy.orm import Session, selectinload
+import database
+import models
+import schemas
+import services.search
+
+# Upsert masivo de productos desde la Plataforma de Gestión (/integration/products/sync).
+# En lugar de varias consultas por ítem, el lote se resuelve por conjuntos:
+#   1. Prefetch: productos, categorías, vínculos y variantes referenciados, con IN por tandas.
+#   2. Diff en memoria contra lo que ya existe (solo se escriben filas que cambiaron).
+#   3. Escritura con INSERT/UPDATE/DELETE masivos (executemany) por tandas.
+# Los INSERT/UPDATE masivos no disparan los eventos del ORM: effective_price se calcula acá.
+#
+# El lote se procesa en tandas de SYNC_CHUNK_SIZE ítems: cada tanda corre dentro
+# de un SAVEPOINT y se commitea al terminar, así el progreso parcial sobrevive y
+# la sesión no acumula estado. Si una tanda falla se revierte y se reintenta ítem
+# por ítem (un SAVEPOINT cada uno) para aislar los SKUs con error.
+
+SYNC_CHUNK_SIZE = 500
+
+_PRODUCT_FIELDS = (
+    "id", "sku", "external_id", "name", "description", "price", "stock", "image_url", "images",
+    "category", "is_active", "price_override", "discount_percentage", "effective_price"
+)
+
+
+def _chunks(values: List, size: int = SYNC_CHUNK_SIZE) -> Iterable[List]:
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _category_name(item) -> str:
+    return item.category.strip() if item.category else ""
+
+
+def _variant_fields(v) -> dict:
+    return {
+        "sku": v.sku,
+        "stock": v.stock,
+        "size": v.size,
+        "color": v.color,
+        "attributes": json.dumps(v.attributes) if v.attributes else None,
+    }
+
+
+def _product_fields(item, current: dict = None) -> dict:
+    """
+    Columnas que el sync escribe para un ítem (mismas reglas que el upsert por ítem:
+    en updates, images y external_id solo se pisan si vienen en el payload).
+    """
+    fields = {
+        "name": item.name,
+        "description": item.description,
+        "price": item.price,
+        "stock": item.stock,
+        "image_url": item.image_url,
+        "category": item.category,
+        "is_active": item.is_active,
+    }
+    if current is None:
+        fields["images"] = json.dumps(item.images) if item.images else "[]"
+        fields["external_id"] = item.external_id
+        fields["price_override"] = None
+        fields["discount_percentage"] = 0
+    else:
+        if item.images:
+            fields["images"] = json.dumps(item.images)
+        if item.external_id:
+            fields["external_id"] = item.external_id
+    if item.variants:
+        # Product stock is the sum of its variants
+        fields["stock"] = sum(v.stock for v in item.variants)
+
+    source = current or fields
+    fields["effective_price"] = models.compute_effective_price(
+        item.price, source["price_override"], source["discount_percentage"]
+    )
+    return fields
+
+
+def sync_products(db: Session, items: List, chunk_size: int = SYNC_CHUNK_SIZE):
+    """
+    Sincroniza el lote commiteando cada tanda. Retorna (conteos created/updated/errors,
+    ids de productos sincronizados, errores por SKU [{"sku", "error"}]).
+    """
+    results = {"created": 0, "updated": 0, "errors": 0}
+    synced_ids: List[str] = []
+    failures: List[dict] = []
+
+    # Repeated SKUs in one payload: the last occurrence wins, earlier ones count as updates
+    latest = {}
+    for item in items:
+        if item.sku in latest:
+            results["updated"] += 1
+        latest[item.sku] = item
+
+    for chunk in _chunks(list(latest.values()), chunk_size):
+        try:
+            with db.begin_nested():
+                outcomes = [_apply_chunk(db, chunk)]
+        except Exception as e:
+            print(f"Sync chunk failed ({len(chunk)} items), retrying one by one: {e}")
+            outcomes = []
+            for item in chunk:
+                try:
+                    with db.begin_nested():
+                        outcomes.append(_apply_chunk(db, [item]))
+                except Exception as item_error:
+                    outcomes.append(({}, [], [], [{"sku": item.sku, "error": str(item_error)}]))
+
+        chunk_ids, reindex_ids = [], []
+        for counts, ids, renamed_ids, errors in outcomes:
+            for key, value in counts.items():
+                results[key] += value
+            chunk_ids.extend(ids)
+            reindex_ids.extend(renamed_ids)
+            failures.extend(errors)
+        services.search.index_products(db, reindex_ids)
+        db.commit()
+        synced_ids.extend(chunk_ids)
+
+    results["errors"] = len(failures)
+    return results, synced_ids, failures
+
+
+def _apply_chunk(db: Session, items: List) -> Tuple[Dict[str, int], List[str], List[str], List[dict]]:
+    """
+    Upsert por conjuntos de una tanda (SKUs únicos) en la transacción actual.
+    Retorna (conteos created/updated, ids sincronizados, ids a reindexar por
+    nombre/categoría nuevos, errores de armado por SKU).
+    """
+    results = {"created": 0, "updated": 0}
+    failures = []
+    latest = {item.sku: item for item in items}
+
+    # --- 1. Prefetch ---
+    existing: Dict[str, dict] = {}
+    columns = [getattr(models.Product, name) for name in _PRODUCT_FIELDS]
+    for chunk in _chunks(list(latest)):
+        for row in db.execute(select(*columns).where(models.Product.sku.in_(chunk))).mappings():
+            existing[row["sku"]] = dict(row)
+
+    category_names = sorted({_category_name(item) for item in latest.values()} - {""})
+    category_ids: Dict[str, int] = {}
+    for chunk in _chunks(category_names):
+        rows = db.execute(
+            select(models.Category.name, models.Category.id).where(models.Category.name.in_(chunk))
+        )
+        category_ids.update({name: category_id for name, category_id in rows})
+
+    # --- 2. Diff ---
+    product_inserts, product_updates = [], []
+    wanted_links = set()
+    wanted_variants: Dict[str, dict] = {}
+    variant_owners = {}  # product_id -> payload variant SKUs (only items that send variants)
+    synced_ids, reindex_ids = [], []
+
+    for sku, item in latest.items():
+        try:
+            current = existing.get(sku)
+            fields = _product_fields(item, current)
+            product_id = str(uuid.uuid4()) if current is None else current["id"]
+            variants = [{"product_id": product_id, **_variant_fields(v)} for v in item.variants or []]
+        except Exception as e:
+            print(f"Error syncing product {item.sku}: {e}")
+            failures.append({"sku": sku, "error": str(e)})
+            continue
+
+        if current is None:
+            product_inserts.append({"id": product_id, "sku": sku, **fields})
+            reindex_ids.append(product_id)
+            results["created"] += 1
+        else:
+            changed = {key: value for key, value in fields.items() if current[key] != value}
+            if changed:
+                product_updates.append({"id": product_id, **changed})
+            if "name" in changed or "category" in changed:
+                reindex_ids.append(product_id)
+            results["updated"] += 1
+
+        if _category_name(item):
+            wanted_links.add((product_id, _category_name(item)))
+        if variants:
+            variant_owners[product_id] = {v["sku"] for v in variants}
+            wanted_variants.update({v["sku"]: v for v in variants})
+        synced_ids.append(product_id)
+
+    # Categories (additive M2M): create the missing ones first
+    missing_categories = sorted({name for _, name in wanted_links} - set(category_ids))
+    if missing_categories:
+        rows = db.execute(
+            insert(models.Category).returning(models.Category.name, models.Category.id),
+            [{"name": name} for name in missing_categories]
+        )
+        category_ids.update({name: category_id for name, category_id in rows})
+
+    existing_ids = {current["id"] for current in existing.values()}
+    linked = set()
+    for chunk in _chunks(sorted(existing_ids)):
+        linked.update(db.execute(
+            select(models.product_categories.c.product_id, models.product_categories.c.category_id)
+            .where(models.product_categories.c.product_id.in_(chunk))
+        ).tuples())
+    link_inserts = [
+        {"product_id": product_id, "category_id": category_ids[name]}
+        for product_id, name in sorted(wanted_links)
+        if (product_id, category_ids[name]) not in linked
+    ]
+
+    # Variants: match by SKU (may move between products), drop the ones left out of the payload
+    current_variants: Dict[str, dict] = {}
+    variant_columns = [
+        models.ProductVariant.id, models.ProductVariant.product_id, models.ProductVariant.sku,
+        models.ProductVariant.stock, models.ProductVariant.size, models.ProductVariant.color,
+        models.ProductVariant.attributes
+    ]
+    for chunk in _chunks(list(wanted_variants)):
+        for row in db.execute(select(*variant_columns).where(models.ProductVariant.sku.in_(chunk))).mappings():
+            current_variants[row["sku"]] = dict(row)
+
+    stale_variant_ids = []
+    touched = {row["id"] for row in product_updates}  # Existing products whose data changed
+    for chunk in _chunks([pid for pid in variant_owners if pid in existing_ids]):
+        rows = db.execute(
+            select(models.ProductVariant.id, models.ProductVariant.product_id, models.ProductVariant.sku)
+            .where(models.ProductVariant.product_id.in_(chunk))
+        )
+        for variant_id, product_id, sku in rows:
+            if sku not in variant_owners[product_id] and sku not in wanted_variants:
+                stale_variant_ids.append(variant_id)
+                touched.add(product_id)
+
+    variant_inserts, variant_updates = [], []
+    for sku, fields in wanted_variants.items():
+        current = current_variants.get(sku)
+        if current is None:
+            variant_inserts.append(fields)
+            touched.add(fields["product_id"])
+        else:
+            changed = {key: value for key, value in fields.items() if current[key] != value}
+            if changed:
+                variant_updates.append({"id": current["id"], **changed})
+                touched.update((fields["product_id"], current["product_id"]))
+
+    # Webhook change detection: the next webhook for these products must be applied again
+    updates_by_id = {row["id"]: row for row in product_updates}
+    for product_id in sorted(touched & existing_ids):
+        if product_id in updates_by_id:
+            updates_by_id[product_id]["payload_hash"] = None
+        else:
+            product_updates.append({"id": product_id, "payload_hash": None})
+
+    # --- 3. Apply (executemany by chunks) ---
+    for chunk in _chunks(product_inserts):
+        db.execute(insert(models.Product), chunk)
+    for chunk in _chunks(product_updates):
+        db.execute(update(models.Product), chunk)
+    for chunk in _chunks(link_inserts):
+        db.execute(insert(models.product_categories), chunk)
+    for chunk in _chunks(stale_variant_ids):
+        db.execute(delete(models.ProductVariant).where(models.ProductVariant.id.in_(chunk)))
+    for chunk in _chunks(variant_updates):
+        db.execute(update(models.ProductVariant), chunk)
+    for chunk in _chunks(variant_inserts):
+        db.execute(insert(models.ProductVariant), chunk)
+
+    return results, synced_ids, reindex_ids, failures
+
+
+async def ndjson_batches(chunks: AsyncIterator[bytes], batch_size: Optional[int] = None):
+    """
+    Parsea un cuerpo NDJSON (un ProductCreate por línea) a medida que llega y
+    entrega tandas (productos válidos, errores de parseo por línea). Solo retiene
+    en memoria la tanda actual y la línea incompleta.
+    """
+    batch_size = batch_size or SYNC_CHUNK_SIZE
+    buffer = b""
+    line_number = 0
+    batch, errors = [], []
+
+    def parse(line: bytes):
+        try:
+            batch.append(schemas.ProductCreate.model_validate_json(line))
+        except ValidationError as e:
+            errors.append({"line": line_number, "error": e.errors(include_url=False)[0]["msg"]})
+
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                parse(line)
+            if len(batch) >= batch_size:
+                yield batch, errors
+                batch, errors = [], []
+
+    if buffer.strip():
+        line_number += 1
+        parse(buffer)
+    if batch or errors:
+        yield batch, errors
+
+
+# --- Webhook (/api/webhooks/products): un producto por llamada ---
+
+def payload_hash(payload) -> str:
+    """
+    Hash canónico (JSON con claves ordenadas) de un ProductUpdatePayload.
+    """
+    canonical = json.dumps(payload.model_dump(mode="json"), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def _assign(obj, fields: dict) -> bool:
+    """
+    Setea solo los atributos que cambian. Retorna True si cambió alguno.
+    """
+    changed = False
+    for key, value in fields.items():
+        if getattr(obj, key) != value:
+            setattr(obj, key, value)
+            changed = True
+    return changed
+
+
+def _get_or_create_category(db: Session, name: str):
+    category = db.query(models.Category).filter(models.Category.name == name).first()
+    if not category:
+        category = models.Category(name=name)
+        db.add(category)
+        db.flush()
+    return category
+
+
+def apply_product_payload(db: Session, payload, db_product=None, images=None, variants=None) -> bool:
+    """
+    Aplica un ProductUpdatePayload en la sesión (sin commit).
+    Si es idéntico al último aplicado a ese producto no escribe nada y retorna
+    False. Si cambió, compara imágenes y variantes campo a campo y solo escribe
+    las filas que difieren.
+    db_product / images / variants permiten pasar filas ya cargadas (lotes);
+    si faltan se consultan.
+    """
+    digest = payload_hash(payload)
+    if db_product is None:
+        db_product = db.query(models.Product).filter(models.Product.id == payload.id).first()
+    if db_product is not None and db_product.payload_hash == digest:
+        return False
+
+    images_json = json.dumps(payload.images) if payload.images else "[]"
+    cat_name = payload.category.strip() if payload.category else ""
+
+    # 1. Product
+    if db_product:
+        fields = {"sku": payload.sku, "name": payload.name, "price": payload.price, "images": images_json}
+        if payload.description:
+            fields["description"] = payload.description
+        if payload.image_url:
+            fields["image_url"] = payload.image_url
+        if payload.category:
+            fields["category"] = payload.category
+        _assign(db_product, fields)
+        # Note: Stock will be recalculated from variants below
+    else:
+        db_product = models.Product(
+            id=payload.id,
+            sku=payload.sku,
+            name=payload.name,
+            description=payload.description,
+            price=payload.price,
+            stock=0,
+            image_url=payload.image_url,
+            images=images_json,
+            category=payload.category,
+            is_active=True
+        )
+        db.add(db_product)
+
+    # M2M Category (Additive)
+    if cat_name:
+        category = _get_or_create_category(db, cat_name)
+        if category not in db_product.categories:
+            db_product.categories.append(category)
+
+    # 2. Product Images: payload 'images' is a list of URLs, index 0 is Main.
+    # Existing rows are matched by URL; leftovers are reused for new URLs, then deleted.
+    if images is None:
+        images = db.query(models.ProductImage).filter(models.ProductImage.product_id == db_product.id).all()
+    current_images = sorted(images, key=lambda image: (image.display_order or 0, image.id))
+    by_url = {}
+    for image in current_images:
+        by_url.setdefault(image.url, []).append(image)
+    pending = []
+    for idx, img_url in enumerate(payload.images or []):
+        if by_url.get(img_url):
+            _assign(by_url[img_url].pop(0), {"display_order": idx, "color_variant": None})
+        else:
+            pending.append((idx, img_url))
+    leftovers = [image for images in by_url.values() for image in images]
+    for idx, img_url in pending:
+        fields = {"url": img_url, "display_order": idx, "color_variant": None}
+        if leftovers:
+            _assign(leftovers.pop(0), fields)
+        else:
+            db.add(models.ProductImage(product_id=db_product.id, **fields))
+    for image in leftovers:
+        db.delete(image)
+
+    # 3. Variants: payload variants are the ACTIVE ones. One query loads this
+    # product's variants and any payload SKU attached elsewhere.
+    payload_skus = [v.sku for v in payload.variants]
+    current_variants = variants
+    if current_variants is None:
+        current_variants = db.query(models.ProductVariant).filter(or_(
+            models.ProductVariant.product_id == db_product.id,
+            models.ProductVariant.sku.in_(payload_skus)
+        )).all()
+    by_sku = {variant.sku: variant for variant in current_variants}
+    for variant in current_variants:
+        if variant.product_id == db_product.id and variant.sku not in payload_skus:
+            db.delete(variant)
+
+    for v in payload.variants:
+        fields = {"product_id": db_product.id, **_variant_fields(v)}
+        db_variant = by_sku.get(v.sku)
+        if db_variant:
+            _assign(db_variant, fields)
+        else:
+            db.add(models.ProductVariant(**fields))
+
+    # Update total stock on parent product
+    if payload.variants:
+        _assign(db_product, {"stock": sum(v.stock for v in payload.variants)})
+
+    # Set in the same flush as the changes, so the expiry hooks in models keep it
+    db_product.payload_hash = digest
+    return True
+
+
+def apply_product_payloads(db: Session, payloads: List) -> Tuple[List[dict], List[str]]:
+    """
+    Aplica varios ProductUpdatePayload en la transacción actual (sin commit),
+    cada uno en su SAVEPOINT para que un ítem inválido no tire el resto.
+    Productos, imágenes y variantes del lote se cargan con unas pocas consultas IN.
+    Retorna (resultado por ítem {"id", "status": updated|unchanged|error, "error"},
+    ids de productos modificados).
+    """
+    ids = list({payload.id for payload in payloads})
+    skus = list({v.sku for payload in payloads for v in payload.variants})
+    products, variants_by_sku = {}, {}
+    for chunk in _chunks(ids):
+        products.update({
+            product.id: product
+            for product in db.query(models.Product).filter(models.Product.id.in_(chunk)).options(
+                selectinload(models.Product.categories),
+                selectinload(models.Product.product_images),
+                selectinload(models.Product.variants)
+            )
+        })
+    for chunk in _chunks(skus):
+        variants_by_sku.update({
+            variant.sku: variant
+            for variant in db.query(models.ProductVariant).filter(models.ProductVariant.sku.in_(chunk))
+        })
+
+    results, changed_ids, seen = [], [], set()
+    for payload in payloads:
+        prefetched = {}
+        if payload.id not in seen:
+            # Repeated ids in one batch are re-read after the first apply
+            product = products.get(payload.id)
+            candidates = {v.id: v for v in (product.variants if product else [])}
+            candidates.update({
+                variants_by_sku[v.sku].id: variants_by_sku[v.sku] for v in payload.variants if v.sku in variants_by_sku
+            })
+            prefetched = {
+                "db_product": product,
+                "images": list(product.product_images) if product else [],
+                "variants": list(candidates.values()),
+            }
+            seen.add(payload.id)
+        try:
+            with db.begin_nested():
+                changed = apply_product_payload(db, payload, **prefetched)
+        except Exception as e:
+            print(f"Error applying product payload {payload.id}: {e}")
+            results.append({"id": payload.id, "status": "error", "error": str(e)})
+            continue
+        results.append({"id": payload.id, "status": "updated" if changed else "unchanged", "error": None})
+        if changed:
+            changed_ids.append(payload.id)
+    return results, changed_ids
+
+
+def apply_product_batch(db: Session, payloads: List) -> Tuple[List[dict], List[str]]:
+    """
+    Lote de webhooks (/api/webhooks/products/batch): una transacción por tanda
+    de SYNC_CHUNK_SIZE productos, commiteada al terminar.
+    """
+    results, changed_ids = [], []
+    for chunk in _chunks(payloads):
+        database.lock_for_write(db)
+        chunk_results, chunk_changed = apply_product_payloads(db, chunk)
+        services.search.index_products(db, chunk_changed)
+        db.commit()
+        results.extend(chunk_results)
+        changed_ids.extend(chunk_changed)
+    return results, changed_ids
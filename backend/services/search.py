@@ -0,0 +1,310 @@
+import math
+import os
+import re
+import unicodedata
+from typing import Iterable, List, Optional, Set
+from sqlalchemy import Float, String, bindparam, text
+from sqlalchemy.orm import Session
+
+# Índice de búsqueda de productos.
+# - SQLite: tabla virtual FTS5 'products_fts' (contenido externo sobre 'products'),
+#   mantenida por triggers, así que cualquier escritura (webhook, sync, admin) la actualiza.
+# - Postgres: columna generada 'search_vector' (tsvector con unaccent) + índice GIN.
+# Si el motor no soporta ninguno de los dos, SEARCH_BACKEND queda en None y
+# get_products usa el filtrado en Python de siempre.
+#
+# Índice de trigramas (búsqueda tolerante a errores de tipeo, nombre + categoría):
+# - SQLite: tabla 'product_trigrams' (trigram, product_id), mantenida desde
+#   los endpoints de escritura con index_products().
+# - Postgres: pg_trgm con índice GIN sobre la expresión normalizada.
+SEARCH_BACKEND: Optional[str] = None
+FUZZY_BACKEND: Optional[str] = None
+
+FTS_TABLE = "products_fts"
+TRIGRAM_TABLE = "product_trigrams"
+
+# Peso de cada columna en el ranking (name > category > description).
+# SQLite: argumentos de bm25(); Postgres: setweight A/B/C + ts_rank {D, C, B, A}.
+RANK_WEIGHTS = {"name": 10.0, "category": 4.0, "description": 1.0}
+
+_SQLITE_DDL = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, category, description,
+        content='products', content_rowid='rowid',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, category, description)
+        VALUES (new.rowid, new.name, new.category, new.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, category, description)
+        VALUES ('delete', old.rowid, old.name, old.category, old.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name, category, description ON products BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, category, description)
+        VALUES ('delete', old.rowid, old.name, old.category, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, name, category, description)
+        VALUES (new.rowid, new.name, new.category, new.description);
+    END
+    """,
+    # Rebuild on every boot: cheap for our catalog size and heals any drift
+    # (e.g. rowids renumbered by a manual VACUUM).
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+_POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    # unaccent() is STABLE, generated columns need an IMMUTABLE wrapper
+    """
+    CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text AS
+    $$ SELECT public.unaccent('public.unaccent', $1) $$
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+    """,
+    """
+    ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', f_unaccent(coalesce(name, ''))), 'A') ||
+        setweight(to_tsvector('simple', f_unaccent(coalesce(category, ''))), 'B') ||
+        setweight(to_tsvector('simple', f_unaccent(coalesce(description, ''))), 'C')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_products_search_vector ON products USING GIN (search_vector)",
+]
+
+_SQLITE_TRIGRAM_DDL = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {TRIGRAM_TABLE} (
+        trigram TEXT NOT NULL,
+        product_id TEXT NOT NULL,
+        PRIMARY KEY (trigram, product_id)
+    ) WITHOUT ROWID
+    """,
+    f"CREATE INDEX IF NOT EXISTS ix_{TRIGRAM_TABLE}_product_id ON {TRIGRAM_TABLE} (product_id)",
+]
+
+_PG_TRIGRAM_EXPR = "f_unaccent(lower(coalesce(name, '') || ' ' || coalesce(category, '')))"
+
+_POSTGRES_TRIGRAM_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"CREATE INDEX IF NOT EXISTS ix_products_name_trgm ON products USING GIN (({_PG_TRIGRAM_EXPR}) gin_trgm_ops)",
+]
+
+
+def fuzzy_threshold() -> float:
+    """
+    Similitud mínima (0..1) para aceptar un resultado aproximado.
+    """
+    return float(os.getenv("SEARCH_FUZZY_THRESHOLD", "0.5"))
+
+
+def normalize_text(text: str) -> str:
+    if not text: return ""
+    return ''.join(c for c in unicodedata.normalize('NFD', text) if unicodedata.category(c) != 'Mn').lower()
+
+
+def tokenize(value: str) -> List[str]:
+    """
+    Normaliza (sin acentos, minúsculas) y separa en tokens alfanuméricos.
+    """
+    return re.findall(r"\w+", normalize_text(value))
+
+
+def trigrams(value: str) -> Set[str]:
+    """
+    Trigramas por palabra, con el mismo padding que pg_trgm ('  w', ' wo', ..., 'o ').
+    """
+    result = set()
+    for token in tokenize(value):
+        padded = f"  {token} "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def _trigram_rows(product_id: str, name: Optional[str], category: Optional[str]):
+    return [
+        {"trigram": trigram, "product_id": product_id}
+        for trigram in trigrams(f"{name or ''} {category or ''}")
+    ]
+
+
+def _rebuild_trigrams(conn) -> None:
+    conn.execute(text(f"DELETE FROM {TRIGRAM_TABLE}"))
+    rows = []
+    for product_id, name, category in conn.execute(text("SELECT id, name, category FROM products")):
+        rows.extend(_trigram_rows(product_id, name, category))
+    if rows:
+        conn.execute(text(f"INSERT INTO {TRIGRAM_TABLE} (trigram, product_id) VALUES (:trigram, :product_id)"), rows)
+
+
+def index_products(db: Session, product_ids: Optional[Iterable[str]] = None) -> None:
+    """
+    Actualiza el índice de trigramas (SQLite) para los productos indicados
+    (None = todos). Llamar antes del commit, después de modificar nombre/categoría
+    o de borrar productos. En Postgres no hace nada: el índice es de expresión.
+    """
+    if FUZZY_BACKEND != "sqlite":
+        return
+
+    if product_ids is None:
+        _rebuild_trigrams(db.connection())
+        return
+
+    ids = [pid for pid in set(product_ids) if pid]
+    if not ids:
+        return
+
+    db.flush()
+    db.execute(
+        text(f"DELETE FROM {TRIGRAM_TABLE} WHERE product_id IN :ids").bindparams(bindparam("ids", expanding=True)),
+        {"ids": ids}
+    )
+    rows = []
+    products = db.execute(
+        text("SELECT id, name, category FROM products WHERE id IN :ids").bindparams(bindparam("ids", expanding=True)),
+        {"ids": ids}
+    )
+    for product_id, name, category in products:
+        rows.extend(_trigram_rows(product_id, name, category))
+    if rows:
+        db.execute(text(f"INSERT INTO {TRIGRAM_TABLE} (trigram, product_id) VALUES (:trigram, :product_id)"), rows)
+
+
+def ensure_search_index(engine) -> None:
+    """
+    Crea (si no existe) el índice de búsqueda para el motor actual.
+    """
+    global SEARCH_BACKEND, FUZZY_BACKEND
+    dialect = engine.dialect.name
+    ddl = {"sqlite": _SQLITE_DDL, "postgresql": _POSTGRES_DDL}.get(dialect)
+    if ddl is None:
+        print(f"⚠️ Search index not supported for dialect '{dialect}'. Using in-memory search.")
+        return
+
+    try:
+        with engine.begin() as conn:
+            for statement in ddl:
+                conn.execute(text(statement))
+        SEARCH_BACKEND = dialect
+    except Exception as e:
+        print(f"⚠️ Could not create search index ({dialect}): {e}. Using in-memory search.")
+        SEARCH_BACKEND = None
+
+    trigram_ddl = {"sqlite": _SQLITE_TRIGRAM_DDL, "postgresql": _POSTGRES_TRIGRAM_DDL}[dialect]
+    try:
+        with engine.begin() as conn:
+            for statement in trigram_ddl:
+                conn.execute(text(statement))
+            if dialect == "sqlite":
+                _rebuild_trigrams(conn)
+        FUZZY_BACKEND = dialect
+    except Exception as e:
+        print(f"⚠️ Could not create trigram index ({dialect}): {e}. Fuzzy search disabled.")
+        FUZZY_BACKEND = None
+
+
+def match_products(db: Session, search: str):
+    """
+    Retorna un subquery con las columnas 'product_id' y 'rank' (mayor = más
+    relevante) de los productos que contienen todos los tokens de la búsqueda
+    (por prefijo), o None si no hay índice disponible o la búsqueda no tiene tokens.
+    """
+    tokens = tokenize(search)
+    if SEARCH_BACKEND is None or not tokens:
+        return None
+
+    if SEARCH_BACKEND == "sqlite":
+        fts_query = " ".join(f'"{token}"*' for token in tokens)
+        # bm25() is lower-is-better, negate it so both backends sort DESC
+        statement = text(
+            f"SELECT products.id AS product_id, "
+            f"-bm25({FTS_TABLE}, {RANK_WEIGHTS['name']}, {RANK_WEIGHTS['category']}, {RANK_WEIGHTS['description']}) AS rank "
+            f"FROM {FTS_TABLE} "
+            f"JOIN products ON products.rowid = {FTS_TABLE}.rowid "
+            f"WHERE {FTS_TABLE} MATCH :search_query"
+        )
+    else:
+        fts_query = " & ".join(f"{token}:*" for token in tokens)
+        pg_weights = "{%s, %s, %s, %s}" % (
+            0.0, RANK_WEIGHTS["description"] / RANK_WEIGHTS["name"],
+            RANK_WEIGHTS["category"] / RANK_WEIGHTS["name"], 1.0
+        )
+        statement = text(
+            f"SELECT id AS product_id, "
+            f"ts_rank('{pg_weights}', search_vector, to_tsquery('simple', :search_query)) AS rank "
+            f"FROM products "
+            f"WHERE search_vector @@ to_tsquery('simple', :search_query)"
+        )
+
+    return statement.bindparams(search_query=fts_query).columns(product_id=String, rank=Float).subquery("search_matches")
+
+
+def fuzzy_match_products(db: Session, search: str):
+    """
+    Búsqueda aproximada por trigramas. Retorna un subquery con 'product_id' y
+    'similarity' (fracción de trigramas de la búsqueda presentes en nombre +
+    categoría), filtrado por SEARCH_FUZZY_THRESHOLD, o None si no aplica.
+    """
+    threshold = fuzzy_threshold()
+
+    if FUZZY_BACKEND == "sqlite":
+        query_trigrams = sorted(trigrams(search))
+        if not query_trigrams:
+            return None
+        statement = text(
+            f"SELECT product_id, COUNT(*) * 1.0 / :trigram_count AS similarity "
+            f"FROM {TRIGRAM_TABLE} WHERE trigram IN :trigrams "
+            f"GROUP BY product_id HAVING COUNT(*) >= :min_shared"
+        ).bindparams(
+            bindparam("trigrams", value=query_trigrams, expanding=True),
+            trigram_count=len(query_trigrams),
+            min_shared=max(1, math.ceil(threshold * len(query_trigrams)))
+        )
+    elif FUZZY_BACKEND == "postgresql":
+        normalized = " ".join(tokenize(search))
+        if not normalized:
+            return None
+        # '<%' uses the GIN index; the threshold is scoped to the current transaction
+        db.execute(text("SELECT set_config('pg_trgm.word_similarity_threshold', :threshold, true)"),
+                   {"threshold": str(threshold)})
+        statement = text(
+            f"SELECT id AS product_id, word_similarity(:fuzzy_query, {_PG_TRIGRAM_EXPR}) AS similarity "
+            f"FROM products WHERE :fuzzy_query <% {_PG_TRIGRAM_EXPR}"
+        ).bindparams(fuzzy_query=normalized)
+    else:
+        return None
+
+    return statement.columns(product_id=String, similarity=Float).subquery("fuzzy_matches")
+
+
+def scan_products(candidates, search: str):
+    """
+    Fallback sin índice: filtra en Python (normalizado, por tokens) y ordena
+    por relevancia usando los mismos pesos por campo que el índice.
+    """
+    normalized_query = normalize_text(search)
+    query_tokens = normalized_query.split()
+
+    scored = []
+    for product in candidates:
+        fields = {
+            "name": normalize_text(product.name),
+            "category": normalize_text(product.category),
+            "description": normalize_text(product.description),
+        }
+        p_text = " ".join(fields.values())
+        if normalized_query in p_text or all(token in p_text for token in query_tokens):
+            score = sum(
+                weight * sum(fields[field].count(token) for token in query_tokens)
+                for field, weight in RANK_WEIGHTS.items()
+            )
+            scored.append((score, product))
+    scored.sort(key=lambda pair: pair[0], reverse=True)
+    return [product for _, product in scored]
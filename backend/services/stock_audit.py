@@ -0,0 +1,159 @@
+from typing import Dict, Iterable, List, Optional
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+import models
+
+# Auditoría del invariante product.stock == sum(variant.stock).
+# find_mismatches() resuelve todo el catálogo con una sola consulta agrupada
+# (products JOIN product_variants ... GROUP BY ... HAVING) y repair() corrige
+# los productos desalineados con UPDATE masivos según la estrategia:
+# - trust_variants: product.stock = suma de las variantes.
+# - trust_product: ajusta las variantes para que sumen product.stock; la
+#   diferencia se descuenta primero de las variantes con más stock (o se suma
+#   a la de más stock si faltan unidades).
+# - proportional: reescala las variantes con stock a product.stock manteniendo
+#   las proporciones (método del resto mayor, como find_test_product.py pero
+#   sin restos negativos). Las variantes en 0 quedan en 0; si todas están en 0
+#   el producto no se puede repartir y queda en 'unresolved'.
+
+STRATEGIES = ["trust_variants", "trust_product", "proportional"]
+AUDIT_CHUNK_SIZE = 500
+
+
+def _chunks(values: List, size: int = AUDIT_CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def variant_total():
+    """
+    Subconsulta correlacionada: suma del stock de las variantes de products.id.
+    """
+    return select(func.coalesce(func.sum(models.ProductVariant.stock), 0)).where(
+        models.ProductVariant.product_id == models.Product.id
+    ).scalar_subquery()
+
+
+def recount_stock(db: Session, product_ids: Iterable[str]):
+    """
+    product.stock = suma de sus variantes para los ids dados, en un UPDATE por
+    tanda. Los UPDATE masivos no pasan por los eventos del ORM: también vence
+    el payload_hash del webhook.
+    """
+    for chunk in _chunks(sorted(set(product_ids))):
+        db.execute(
+            update(models.Product).where(models.Product.id.in_(chunk))
+            .values(stock=variant_total(), payload_hash=None)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def find_mismatches(db: Session, product_ids: Optional[List[str]] = None) -> List[dict]:
+    """
+    Productos con variantes cuyo stock no coincide con la suma de ellas.
+    """
+    total = func.sum(func.coalesce(models.ProductVariant.stock, 0))
+    query = (
+        select(models.Product.id, models.Product.sku, models.Product.name, models.Product.stock,
+               total.label("variant_total"), func.count(models.ProductVariant.id).label("variant_count"))
+        .join(models.ProductVariant, models.ProductVariant.product_id == models.Product.id)
+        .group_by(models.Product.id, models.Product.sku, models.Product.name, models.Product.stock)
+        .having(func.coalesce(models.Product.stock, 0) != total)
+        .order_by(models.Product.id)
+    )
+    if product_ids is not None:
+        query = query.where(models.Product.id.in_(product_ids))
+    return [
+        {"product_id": row.id, "sku": row.sku, "name": row.name, "product_stock": row.stock or 0,
+         "variant_total": row.variant_total, "variant_count": row.variant_count}
+        for row in db.execute(query)
+    ]
+
+
+def _trust_product(target: int, variants: List[dict]) -> Optional[Dict[int, int]]:
+    stocks = {v["id"]: v["stock"] for v in variants}
+    ordered = sorted(variants, key=lambda v: (-v["stock"], v["id"]))
+    difference = target - sum(stocks.values())
+    if difference > 0:
+        stocks[ordered[0]["id"]] += difference
+    for variant in ordered:
+        if difference >= 0:
+            break
+        taken = min(stocks[variant["id"]], -difference)
+        stocks[variant["id"]] -= taken
+        difference += taken
+    return stocks
+
+
+def _proportional(target: int, variants: List[dict]) -> Optional[Dict[int, int]]:
+    current = sum(v["stock"] for v in variants)
+    if current <= 0:
+        return None
+    shares = {v["id"]: target * v["stock"] / current for v in variants}
+    stocks = {variant_id: int(share) for variant_id, share in shares.items()}
+    # Largest remainder: hand out the units lost to rounding down
+    leftover = target - sum(stocks.values())
+    for variant_id in sorted(shares, key=lambda vid: (-(shares[vid] - stocks[vid]), vid))[:leftover]:
+        stocks[variant_id] += 1
+    return stocks
+
+
+def repair(db: Session, strategy: str, dry_run: bool = True, product_ids: Optional[List[str]] = None) -> dict:
+    """
+    Audita y corrige (salvo dry_run) en la transacción actual, sin commit.
+    Retorna el diff por producto y los ids modificados.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown strategy: {strategy}")
+
+    mismatches = find_mismatches(db, product_ids)
+    ids = [m["product_id"] for m in mismatches]
+    variants: Dict[str, List[dict]] = {}
+    if strategy != "trust_variants":
+        for chunk in _chunks(ids):
+            rows = db.execute(
+                select(models.ProductVariant.id, models.ProductVariant.product_id, models.ProductVariant.sku,
+                       models.ProductVariant.stock)
+                .where(models.ProductVariant.product_id.in_(chunk))
+                .order_by(models.ProductVariant.id)
+            )
+            for variant_id, product_id, sku, stock in rows:
+                variants.setdefault(product_id, []).append({"id": variant_id, "sku": sku, "stock": stock or 0})
+
+    changes, unresolved, variant_updates = [], [], []
+    for mismatch in mismatches:
+        product_id = mismatch["product_id"]
+        if strategy == "trust_variants":
+            changes.append({**mismatch, "product_stock_after": mismatch["variant_total"], "variants": []})
+            continue
+
+        target = max(0, mismatch["product_stock"])
+        rebalance = _trust_product if strategy == "trust_product" else _proportional
+        stocks = rebalance(target, variants[product_id])
+        if stocks is None:
+            unresolved.append(mismatch)
+            continue
+        diff = [
+            {"sku": v["sku"], "before": v["stock"], "after": stocks[v["id"]]}
+            for v in variants[product_id] if stocks[v["id"]] != v["stock"]
+        ]
+        variant_updates.extend({"id": v["id"], "stock": stocks[v["id"]]} for v in variants[product_id]
+                               if stocks[v["id"]] != v["stock"])
+        changes.append({**mismatch, "product_stock_after": target, "variants": diff})
+
+    repaired_ids = [change["product_id"] for change in changes]
+    if not dry_run:
+        for chunk in _chunks(variant_updates):
+            db.execute(update(models.ProductVariant), chunk)
+        # Variant strategies also recount: covers negative product stock clamped to 0
+        recount_stock(db, repaired_ids)
+
+    return {
+        "strategy": strategy,
+        "dry_run": dry_run,
+        "mismatched": len(mismatches),
+        "repaired": 0 if dry_run else len(repaired_ids),
+        "changes": changes,
+        "unresolved": unresolved,
+        "product_ids": [] if dry_run else repaired_ids,
+    }
@@ -0,0 +1,165 @@
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import requests
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+import database, models
+import services.catalog
+import services.integration
+import services.stock_audit
+
+# Reconciliación de stock contra la plataforma de gestión (/admin/sync-stock).
+# 1. Pull incremental: GET MANAGEMENT_STOCK_URL?since=<cursor> con If-None-Match;
+#    un 304 corta sin tocar la base. El cursor y el ETag se guardan en
+#    'sync_cursors' en el mismo commit que las correcciones.
+# 2. Comparación por conjuntos: los SKUs recibidos se resuelven con IN por
+#    tandas, primero contra variantes y después contra productos sin variantes.
+# 3. Corrección con UPDATE masivos; el stock de los productos afectados se
+#    recalcula como la suma de sus variantes en un solo UPDATE.
+
+STOCK_CURSOR = "management_stock"
+STOCK_CHUNK_SIZE = 500
+DRIFT_REPORT_LIMIT = 1000
+
+_running = threading.Lock()
+
+
+class StockSyncBusy(Exception):
+    pass
+
+
+def _chunks(values: List, size: int = STOCK_CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def pull_stock(http: requests.Session, since: Optional[str] = None, etag: Optional[str] = None):
+    """
+    Recorre el feed desde el cursor. Retorna (sku -> stock, cursor, etag), o
+    None si no hubo cambios (304). Si un SKU aparece varias veces gana el último.
+    El ETag devuelto valida el pedido 'since=<cursor>' de la próxima corrida, así
+    que solo se conserva si la última página no movió el cursor.
+    """
+    service = services.integration.IntegrationService()
+    remote: Dict[str, int] = {}
+    cursor = since
+    conditional = etag  # Only the first page is conditional
+    while True:
+        page = service.fetch_stock_page(http, since=cursor, etag=conditional)
+        if page is None:
+            return None
+        body, response_etag = page
+        for item in body.get("items", []):
+            remote[str(item["sku"])] = max(0, int(item["stock"]))
+        next_cursor = body.get("cursor") or cursor
+        etag = response_etag if next_cursor == cursor else None
+        cursor, conditional = next_cursor, None
+        if not body.get("has_more"):
+            break
+    return remote, cursor, etag
+
+
+def reconcile_stock(db: Session, remote: Dict[str, int], dry_run: bool = False) -> dict:
+    """
+    Compara el stock remoto (sku -> stock) con el local y, salvo dry_run, aplica
+    las diferencias en la transacción actual (sin commit).
+    Retorna el reporte de drift y los ids de producto modificados.
+    """
+    skus = list(remote)
+    variants: Dict[str, tuple] = {}
+    for chunk in _chunks(skus):
+        rows = db.execute(
+            select(models.ProductVariant.sku, models.ProductVariant.id, models.ProductVariant.product_id,
+                   models.ProductVariant.stock).where(models.ProductVariant.sku.in_(chunk))
+        )
+        variants.update({sku: (variant_id, product_id, stock) for sku, variant_id, product_id, stock in rows})
+
+    products: Dict[str, tuple] = {}
+    for chunk in _chunks([sku for sku in skus if sku not in variants]):
+        rows = db.execute(
+            select(models.Product.sku, models.Product.id, models.Product.stock).where(models.Product.sku.in_(chunk))
+        )
+        products.update({sku: (product_id, stock) for sku, product_id, stock in rows})
+
+    # Products with variants derive their stock from them
+    with_variants = set()
+    for chunk in _chunks([product_id for product_id, _ in products.values()]):
+        with_variants.update(db.execute(
+            select(models.ProductVariant.product_id).where(models.ProductVariant.product_id.in_(chunk)).distinct()
+        ).scalars())
+
+    drift, unknown, skipped = [], [], []
+    variant_updates, product_updates = [], []
+    recount_ids = set()
+    for sku, stock in remote.items():
+        if sku in variants:
+            variant_id, product_id, local = variants[sku]
+            if (local or 0) != stock:
+                drift.append({"sku": sku, "product_id": product_id, "level": "variant", "local": local, "remote": stock})
+                variant_updates.append({"id": variant_id, "stock": stock})
+                recount_ids.add(product_id)
+        elif sku in products:
+            product_id, local = products[sku]
+            if product_id in with_variants:
+                skipped.append(sku)
+            elif (local or 0) != stock:
+                drift.append({"sku": sku, "product_id": product_id, "level": "product", "local": local, "remote": stock})
+                product_updates.append({"id": product_id, "stock": stock, "payload_hash": None})
+        else:
+            unknown.append(sku)
+
+    if not dry_run:
+        for chunk in _chunks(variant_updates):
+            db.execute(update(models.ProductVariant), chunk)
+        for chunk in _chunks(product_updates):
+            db.execute(update(models.Product), chunk)
+        services.stock_audit.recount_stock(db, recount_ids)
+
+    return {
+        "dry_run": dry_run,
+        "pulled": len(remote),
+        "changed": len(drift),
+        "drift": drift[:DRIFT_REPORT_LIMIT],
+        "unknown_skus": unknown[:DRIFT_REPORT_LIMIT],
+        "skipped_skus": skipped[:DRIFT_REPORT_LIMIT],
+        "product_ids": sorted(recount_ids | {row["id"] for row in product_updates}),
+    }
+
+
+def sync_stock(db: Session, http: requests.Session, full: bool = False, dry_run: bool = False) -> dict:
+    """
+    Corre una reconciliación completa: pull desde el cursor guardado (o desde
+    cero con full), comparación, corrección y avance del cursor.
+    """
+    if not _running.acquire(blocking=False):
+        raise StockSyncBusy()
+    try:
+        state = db.get(models.SyncCursor, STOCK_CURSOR) or models.SyncCursor(name=STOCK_CURSOR)
+        since, etag = (None, None) if full else (state.cursor, state.etag)
+
+        pulled = pull_stock(http, since, etag)
+        if pulled is None:
+            return {"dry_run": dry_run, "pulled": 0, "changed": 0, "drift": [], "unknown_skus": [],
+                    "skipped_skus": [], "cursor": since, "not_modified": True}
+        remote, cursor, etag = pulled
+
+        database.lock_for_write(db)
+        report = reconcile_stock(db, remote, dry_run=dry_run)
+        product_ids = report.pop("product_ids")
+        report["cursor"] = cursor
+        if dry_run:
+            db.rollback()
+            return report
+
+        state.cursor, state.etag = cursor, etag
+        state.updated_at = datetime.now(timezone.utc)
+        db.merge(state)
+        db.commit()
+        if product_ids:
+            services.catalog.notify_change(db, product_ids)
+        print(f"✅ Stock sync: {report['pulled']} SKUs pulled, {report['changed']} corrected, "
+              f"{len(report['unknown_skus'])} unknown")
+        return report
+    finally:
+        _running.release()
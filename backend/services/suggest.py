@@ -0,0 +1,163 @@
+import threading
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy.orm import Session, selectinload
+import models
+from services.search import tokenize
+
+# Índice en memoria para autocompletar (typeahead).
+# Cada nombre de producto / categoría / etiqueta se indexa por todos sus
+# "sufijos de palabras" normalizados: "Bombacha de Campo" -> "bombacha de campo",
+# "de campo", "campo". Las claves viven en una lista ordenada por tipo y un
+# prefijo se resuelve con bisect + recorrido secuencial mientras la clave
+# empiece con él; cada tipo corta al llenar su cupo, así un prefijo corto no
+# recorre el índice entero. La reconstrucción completa ordena una sola vez.
+
+SUGGEST_TYPES = ("product", "category", "label")
+
+
+def _phrase_keys(value: str) -> List[str]:
+    tokens = tokenize(value)
+    return [" ".join(tokens[i:]) for i in range(len(tokens))]
+
+
+class SuggestIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        # Per type, sorted list of (key, entry) where entry = (type, value, product_id or None)
+        self._keys: Dict[str, List[Tuple[str, Tuple[str, str, Optional[str]]]]] = {kind: [] for kind in SUGGEST_TYPES}
+        # product_id -> (name, category names, label names) currently indexed
+        self._products: Dict[str, Tuple[str, Tuple[str, ...], Tuple[str, ...]]] = {}
+        # Shared entries (categories / labels) are reference counted by product
+        self._refcounts: Dict[Tuple[str, str], int] = {}
+
+    # --- Maintenance ---
+
+    def invalidate(self):
+        """
+        Marca el índice para reconstrucción completa en la próxima consulta.
+        """
+        with self._lock:
+            self._loaded = False
+
+    def rebuild(self, db: Session):
+        products = db.query(models.Product).filter(models.Product.is_active == True).options(
+            selectinload(models.Product.categories),
+            selectinload(models.Product.labels)
+        ).all()
+        with self._lock:
+            self._keys = {kind: [] for kind in SUGGEST_TYPES}
+            self._products = {}
+            self._refcounts = {}
+            for product in products:
+                self._add(product.id, *self._product_terms(product), bulk=True)
+            # One sort instead of an insort per key
+            for keys in self._keys.values():
+                keys.sort()
+            self._loaded = True
+
+    def refresh_products(self, db: Session, product_ids: Iterable[str]):
+        """
+        Actualiza incrementalmente los productos indicados (creados, editados,
+        desactivados o borrados). Llamar después del commit.
+        """
+        ids = [pid for pid in set(product_ids) if pid]
+        if not ids or not self._loaded:
+            # Not built yet: the first lookup will load the current state
+            return
+
+        products = db.query(models.Product).filter(models.Product.id.in_(ids)).options(
+            selectinload(models.Product.categories),
+            selectinload(models.Product.labels)
+        ).all()
+        by_id = {p.id: p for p in products}
+
+        with self._lock:
+            for product_id in ids:
+                self._remove(product_id)
+                product = by_id.get(product_id)
+                if product is not None and product.is_active:
+                    self._add(product_id, *self._product_terms(product))
+
+    def _product_terms(self, product):
+        categories = {c.name for c in product.categories if c.name}
+        if product.category:
+            categories.add(product.category.strip())
+        labels = {l.name for l in product.labels if l.name}
+        return product.name or "", tuple(sorted(categories)), tuple(sorted(labels))
+
+    def _insert(self, value: str, entry, bulk: bool = False):
+        keys = self._keys[entry[0]]
+        for key in _phrase_keys(value):
+            if bulk:
+                # rebuild() sorts once at the end
+                keys.append((key, entry))
+            else:
+                insort(keys, (key, entry))
+
+    def _delete(self, value: str, entry):
+        keys = self._keys[entry[0]]
+        for key in _phrase_keys(value):
+            position = bisect_left(keys, (key, entry))
+            if position < len(keys) and keys[position] == (key, entry):
+                keys.pop(position)
+
+    def _add(self, product_id: str, name: str, categories, labels, bulk: bool = False):
+        self._products[product_id] = (name, categories, labels)
+        self._insert(name, ("product", name, product_id), bulk)
+        for kind, values in (("category", categories), ("label", labels)):
+            for value in values:
+                ref = (kind, value)
+                self._refcounts[ref] = self._refcounts.get(ref, 0) + 1
+                if self._refcounts[ref] == 1:
+                    self._insert(value, (kind, value, None), bulk)
+
+    def _remove(self, product_id: str):
+        indexed = self._products.pop(product_id, None)
+        if indexed is None:
+            return
+        name, categories, labels = indexed
+        self._delete(name, ("product", name, product_id))
+        for kind, values in (("category", categories), ("label", labels)):
+            for value in values:
+                ref = (kind, value)
+                self._refcounts[ref] -= 1
+                if self._refcounts[ref] == 0:
+                    del self._refcounts[ref]
+                    self._delete(value, (kind, value, None))
+
+    # --- Lookup ---
+
+    def suggest(self, db: Session, prefix: str, limit: int = 5) -> Dict[str, List[dict]]:
+        """
+        Retorna hasta 'limit' sugerencias por tipo para el prefijo dado.
+        """
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.rebuild(db)
+
+        results: Dict[str, List[dict]] = {kind: [] for kind in SUGGEST_TYPES}
+        normalized = " ".join(tokenize(prefix))
+        if not normalized:
+            return results
+
+        with self._lock:
+            for kind in SUGGEST_TYPES:
+                keys, bucket, seen = self._keys[kind], results[kind], set()
+                position = bisect_left(keys, (normalized,))
+                while position < len(keys) and len(bucket) < limit:
+                    key, entry = keys[position]
+                    if not key.startswith(normalized):
+                        break
+                    position += 1
+                    if entry in seen:
+                        continue
+                    seen.add(entry)
+                    _, value, product_id = entry
+                    bucket.append({"value": value, "id": product_id} if kind == "product" else {"value": value})
+        return results
+
+
+suggest_index = SuggestIndex()
@@ -0,0 +1,144 @@
+import os
+import threading
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from sqlalchemy.orm import Session
+import database, models, schemas
+import services.catalog
+import services.product_sync
+import services.search
+
+# Cola de webhooks de productos (modo async de /api/webhooks/products).
+# El endpoint solo persiste el payload en 'webhook_jobs' y responde 202 con el
+# id del job; workers en segundo plano toman los pendientes por tandas:
+# - Coalescen por producto: de varios jobs pendientes del mismo producto solo se
+#   aplica el último (last write wins), el resto queda 'superseded'.
+# - Aplican toda la tanda en una sola transacción, junto con el cambio de estado
+#   de los jobs: si el proceso muere a mitad, la tanda sigue 'pending'.
+# Con varios workers, cada producto pertenece siempre al mismo worker
+# (crc32(product_id) % workers), así se respeta el orden por producto.
+
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "200"))
+WEBHOOK_POLL_SECONDS = float(os.getenv("WEBHOOK_POLL_SECONDS", "1.0"))
+WEBHOOK_JOB_RETENTION_DAYS = int(os.getenv("WEBHOOK_JOB_RETENTION_DAYS", "7"))
+
+
+def _partition(product_id: str, workers: int) -> int:
+    return zlib.crc32(product_id.encode()) % workers
+
+
+def enqueue(db: Session, payload) -> models.WebhookJob:
+    """
+    Persiste el payload como job pendiente (commit incluido) y despierta a los workers.
+    """
+    job = models.WebhookJob(product_id=payload.id, payload=payload.model_dump_json(), status="pending")
+    db.add(job)
+    db.commit()
+    webhook_queue.wake()
+    return job
+
+
+def process_batch(db: Session, worker: int = 0, workers: int = 1, limit: Optional[int] = None) -> int:
+    """
+    Procesa una tanda de jobs pendientes del worker indicado. Retorna cuántos jobs tomó.
+    """
+    limit = limit or WEBHOOK_BATCH_SIZE
+    pending = db.query(models.WebhookJob.id).filter(models.WebhookJob.status == "pending")
+    if pending.first() is None:
+        return 0
+
+    database.lock_for_write(db)
+    jobs: List[models.WebhookJob] = db.query(models.WebhookJob).filter(
+        models.WebhookJob.status == "pending"
+    ).order_by(models.WebhookJob.id).limit(limit * workers).all()
+    jobs = [job for job in jobs if _partition(job.product_id, workers) == worker][:limit]
+    if not jobs:
+        return 0
+
+    # Coalesce: last write wins per product
+    latest = {}
+    for job in jobs:
+        latest[job.product_id] = job
+    now = datetime.now(timezone.utc)
+    for job in jobs:
+        if latest[job.product_id] is not job:
+            job.status = "superseded"
+            job.result = f"superseded by job {latest[job.product_id].id}"
+            job.processed_at = now
+
+    applied = list(latest.values())
+    payloads = [schemas.ProductUpdatePayload.model_validate_json(job.payload) for job in applied]
+    results, changed_ids = services.product_sync.apply_product_payloads(db, payloads)
+    for job, result in zip(applied, results):
+        job.status = "failed" if result["status"] == "error" else "done"
+        job.result = result["error"] or result["status"]
+        job.processed_at = now
+
+    services.search.index_products(db, changed_ids)
+    db.commit()
+    if changed_ids:
+        services.catalog.notify_change(db, changed_ids)
+    return len(jobs)
+
+
+def purge_finished(db: Session, days: int = WEBHOOK_JOB_RETENTION_DAYS) -> int:
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    deleted = db.query(models.WebhookJob).filter(
+        models.WebhookJob.status != "pending",
+        models.WebhookJob.processed_at < cutoff
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+
+class WebhookQueue:
+    def __init__(self):
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self, workers: int = 1):
+        if self._threads:
+            return
+        db = database.SessionLocal()
+        try:
+            purge_finished(db)
+        finally:
+            db.close()
+        self._stop.clear()
+        for index in range(workers):
+            thread = threading.Thread(
+                target=self._run, args=(index, workers), name=f"webhook-worker-{index}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _run(self, worker: int, workers: int):
+        while not self._stop.is_set():
+            db = database.SessionLocal()
+            try:
+                taken = process_batch(db, worker, workers)
+            except Exception as e:
+                print(f"❌ Webhook worker {worker} failed: {e}")
+                db.rollback()
+                taken = 0
+            finally:
+                db.close()
+            if not taken:
+                # Idle: sleep until a new job arrives (or poll, for jobs from other processes)
+                self._wakeup.wait(WEBHOOK_POLL_SECONDS)
+                self._wakeup.clear()
+
+
+webhook_queue = WebhookQueue()
@@ -0,0 +1,131 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import pytest
+import models
+import services.catalog
+import services.payment
+
+STORE_KEY = "test-store-key"
+
+def order_payload(email, items):
+    return {
+        "buyer": {"first_name": "Carga", "last_name": "Test", "email": email},
+        "shipping": {"method": "pickup"},
+        "billing": {"invoice_type": "B"},
+        "items": items,
+    }
+
+def seed(db, product_id, product_stock, variant_stocks=()):
+    """
+    Recrea el producto (y sus variantes) con el stock dado, hace commit y
+    refresca el catálogo. Retorna los ids de las variantes.
+    """
+    db.query(models.StockReservation).filter(models.StockReservation.product_id == product_id).delete()
+    db.query(models.ProductVariant).filter(models.ProductVariant.product_id == product_id).delete()
+    db.query(models.Product).filter(models.Product.id == product_id).delete()
+    product = models.Product(id=product_id, sku=product_id, name=f"Producto {product_id}", price=10.0, stock=product_stock)
+    product.variants = [models.ProductVariant(sku=f"{product_id}-{i}", stock=s) for i, s in enumerate(variant_stocks)]
+    db.add(product)
+    db.commit()
+    services.catalog.notify_change(db, [product_id])
+    return [v.id for v in product.variants]
+
+class StubServer:
+    """
+    Servidor HTTP local (puerto libre, hilo daemon) para probar integraciones.
+    `respond(request)` recibe {"method", "path", "query", "headers", "body"} y
+    retorna (status, body) o (status, body, headers); un body dict/list se
+    envía como JSON. Cada request recibido queda en `requests`.
+    """
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _handle(self):
+                url = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                request = {"method": self.command, "path": url.path,
+                           "query": {key: values[0] for key, values in parse_qs(url.query).items()},
+                           "headers": self.headers, "body": json.loads(raw) if raw else None}
+                stub.requests.append(request)
+                status, body, *extra = stub.respond(request)
+                payload = json.dumps(body).encode() if body is not None else b""
+                self.send_response(status)
+                for name, value in (extra[0] if extra else {}).items():
+                    self.send_header(name, value)
+                if payload:
+                    self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = _handle
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        # Slow handlers (latency injection) must not block shutdown
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def count(self, method: str) -> int:
+        return sum(1 for request in self.requests if request["method"] == method)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def stub_server():
+    """
+    Fábrica de StubServer: stub_server(respond). Los servidores se cierran
+    (shutdown + server_close) al terminar el test.
+    """
+    servers = []
+
+    def start(respond):
+        server = StubServer(respond)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
+
+@pytest.fixture
+def mp_stub(stub_server, monkeypatch):
+    """
+    MercadoPago local: POST /checkout/preferences responde `status` tras `delay`
+    segundos; GET /v1/payments/{id} sale de `payments` (404 si no está).
+    El cliente compartido de services.payment apunta al stub durante el test.
+    """
+    def respond(request):
+        if request["method"] == "GET":
+            payment = stub.payments.get(request["path"].rsplit("/", 1)[-1])
+            if stub.status >= 300:
+                return stub.status, {"message": "internal_error"}
+            return (200, payment) if payment else (404, {"message": "not_found"})
+        time.sleep(stub.delay)
+        if stub.status >= 300:
+            return stub.status, {"message": "internal_error"}
+        return stub.status, {"init_point": f"https://mp.test/pay/{request['body']['external_reference']}"}
+
+    stub = stub_server(respond)
+    stub.delay, stub.status, stub.payments = 0.0, 201, {}
+    monkeypatch.setenv("MP_API_BASE_URL", stub.url)
+    monkeypatch.setenv("MP_ACCESS_TOKEN", "TEST-stub")
+    monkeypatch.setattr(services.payment, "MP_TIMEOUT_SECONDS", 0.3)
+    monkeypatch.setattr(services.payment.breaker, "failures", 3)
+    monkeypatch.setattr(services.payment.breaker, "reset_seconds", 0.5)
+    services.payment.reset_client()
+    yield stub
+    monkeypatch.undo()
+    services.payment.reset_client()
@@ -0,0 +1,78 @@
+import pytest
+from httpx import AsyncClient, ASGITransport
+from main import app
+from services.catalog import catalog_cache
+from conftest import STORE_KEY
+
+@pytest.mark.asyncio
+async def test_catalog_snapshot_is_swapped_after_writes(monkeypatch):
+    monkeypatch.setenv("STORE_API_KEY", STORE_KEY)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        payload = {
+            "id": "CAT-001", "sku": "CAT-001", "name": "Guardamonte", "price": 500.0, "category": "Talabartería",
+            "variants": [{"sku": "CAT-001-U", "stock": 2}]
+        }
+        await ac.post("/api/webhooks/products", json=payload, headers={"x-store-api-key": STORE_KEY})
+
+        response = await ac.get("/products/CAT-001")
+        assert response.status_code == 200
+        assert response.json()["variants"][0]["stock"] == 2
+        assert "Talabartería" in (await ac.get("/products/categories")).json()
+
+        before = catalog_cache.get(None)
+        response = await ac.put("/admin/products/CAT-001/price", json={"discount_percentage": 15})
+        assert response.status_code == 200
+
+        after = catalog_cache.get(None)
+        assert after.version > before.version
+        assert before.products["CAT-001"]["discount_percentage"] == 0
+        assert (await ac.get("/products/CAT-001")).json()["discount_percentage"] == 15
+
+        assert (await ac.get("/products/NOPE-404")).status_code == 404
+
+@pytest.mark.asyncio
+async def test_catalog_endpoints_answer_304_on_matching_etag(monkeypatch):
+    monkeypatch.setenv("STORE_API_KEY", STORE_KEY)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        payload = {"id": "CAT-002", "sku": "CAT-002", "name": "Estribo", "price": 900.0, "category": "Talabartería"}
+        await ac.post("/api/webhooks/products", json=payload, headers={"x-store-api-key": STORE_KEY})
+
+        for url in ["/products/CAT-002", "/products/categories", "/products?search=estribo"]:
+            response = await ac.get(url)
+            etag = response.headers["etag"]
+            assert "max-age" in response.headers["cache-control"]
+
+            cached = await ac.get(url, headers={"If-None-Match": etag})
+            assert cached.status_code == 304
+            assert cached.headers["etag"] == etag
+
+        list_etag = (await ac.get("/products?search=estribo")).headers["etag"]
+        payload["name"] = "Estribo de plata"
+        await ac.post("/api/webhooks/products", json=payload, headers={"x-store-api-key": STORE_KEY})
+
+        response = await ac.get("/products/CAT-002", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        response = await ac.get("/products?search=estribo", headers={"If-None-Match": list_etag})
+        assert response.status_code == 200
+        assert response.json()["items"][0]["name"] == "Estribo de plata"
+
+@pytest.mark.asyncio
+async def test_card_view_returns_compact_items(monkeypatch):
+    monkeypatch.setenv("STORE_API_KEY", STORE_KEY)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        payload = {
+            "id": "CAT-003", "sku": "CAT-003", "name": "Rebenque Kxcard", "price": 700.0,
+            "images": ["http://img/rebenque.jpg"], "variants": [{"sku": "CAT-003-U", "stock": 0}]
+        }
+        await ac.post("/api/webhooks/products", json=payload, headers={"x-store-api-key": STORE_KEY})
+
+        response = await ac.get("/products", params={"search": "kxcard", "view": "card"})
+        card = response.json()["items"][0]
+        assert card["image_url"] == "http://img/rebenque.jpg"
+        assert card["in_stock"] is False
+        assert "variants" not in card and "description" not in card
+
+        assert (await ac.get("/products", params={"view": "bogus"})).status_code == 400
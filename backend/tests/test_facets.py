@@ -0,0 +1,39 @@
+import pytest
+from httpx import AsyncClient, ASGITransport
+from main import app
+from conftest import STORE_KEY
+
+@pytest.mark.asyncio
+async def test_facets_count_within_search_context(monkeypatch):
+    monkeypatch.setenv("STORE_API_KEY", STORE_KEY)
+    monkeypatch.setenv("CATALOG_PRICE_BUCKETS", "1000,5000")
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        products = [
+            ("FAC-001", 800.0, "Boinas", 3),
+            ("FAC-002", 2500.0, "Boinas", 0),
+            ("FAC-003", 7000.0, "Ponchos", 1),
+        ]
+        for pid, price, category, stock in products:
+            payload = {
+                "id": pid, "sku": pid, "name": f"Pilcha {pid}", "price": price, "category": category,
+                "variants": [{"sku": f"{pid}-U", "stock": stock}]
+            }
+            await ac.post("/api/webhooks/products", json=payload, headers={"x-store-api-key": STORE_KEY})
+
+        body = (await ac.get("/products/facets", params={"search": "pilcha"})).json()
+        assert body["total"] == 3
+        assert {c["value"]: c["count"] for c in body["categories"]} == {"Boinas": 2, "Ponchos": 1}
+        assert [b["count"] for b in body["price_buckets"]] == [1, 1, 1]
+        assert (body["in_stock"], body["out_of_stock"]) == (2, 1)
+
+        # Category facet ignores its own filter; the others narrow to it
+        body = (await ac.get("/products/facets", params={"search": "pilcha", "category": "Boinas"})).json()
+        assert body["total"] == 2
+        assert {c["value"]: c["count"] for c in body["categories"]} == {"Boinas": 2, "Ponchos": 1}
+        assert [b["count"] for b in body["price_buckets"]] == [1, 1, 0]
+        assert body["price_buckets"][0] == {"min": None, "max": 1000.0, "count": 1}
+
+        body = (await ac.get("/products/facets", params={"search": "pilcha", "max_price": 3000})).json()
+        assert {c["value"]: c["count"] for c in body["categories"]} == {"Boinas": 2}
+        assert [b["count"] for b in body["price_buckets"]] == [1, 1, 1]
@@ -0,0 +1,63 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Products/variants as the baseline release created them (before effective_price, payload_hash, ...)
+BASELINE_SCHEMA = """
+CREATE TABLE size_guides (id INTEGER NOT NULL, name VARCHAR, image_url VARCHAR, content TEXT, PRIMARY KEY (id));
+CREATE TABLE products (
+    id VARCHAR NOT NULL, external_id VARCHAR, sku VARCHAR, name VARCHAR, description TEXT, price FLOAT,
+    stock INTEGER, image_url VARCHAR, images TEXT, category VARCHAR, is_active BOOLEAN, price_override FLOAT,
+    discount_percentage INTEGER, size_guide_id INTEGER,
+    PRIMARY KEY (id), FOREIGN KEY(size_guide_id) REFERENCES size_guides (id)
+);
+CREATE UNIQUE INDEX ix_products_sku ON products (sku);
+CREATE INDEX ix_products_name ON products (name);
+CREATE INDEX ix_products_category ON products (category);
+CREATE TABLE product_variants (
+    id INTEGER NOT NULL, product_id VARCHAR, sku VARCHAR, size VARCHAR, color VARCHAR, attributes TEXT,
+    stock INTEGER, PRIMARY KEY (id), FOREIGN KEY(product_id) REFERENCES products (id)
+);
+INSERT INTO products (id, sku, name, price, stock, category, is_active, discount_percentage)
+VALUES ('OLD-1', 'OLD-1', 'Mate viejo', 100.0, 3, 'Mates', 1, 10);
+"""
+
+# Starts the app (startup migrations included) in its own process against DATABASE_URL
+START_APP = """
+import json
+from fastapi.testclient import TestClient
+from main import app
+with TestClient(app) as client:
+    products = client.get("/products")
+    categories = client.get("/products/categories")
+    print(json.dumps({"products": [products.status_code, products.json()],
+                      "categories": [categories.status_code, categories.json()]}))
+"""
+
+def test_startup_migrates_baseline_database(tmp_path):
+    db_path = tmp_path / "baseline.db"
+    conn = sqlite3.connect(db_path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.close()
+
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}")
+    result = subprocess.run([sys.executable, "-c", START_APP], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert "Migration error" not in result.stdout
+    assert "✅ Migrations successful." in result.stdout
+    responses = json.loads(result.stdout.strip().splitlines()[-1])
+    assert responses["products"][0] == 200
+    assert [(p["id"], p["effective_price"]) for p in responses["products"][1]["items"]] == [("OLD-1", 90.0)]
+    assert responses["categories"][0] == 200
+
+    conn = sqlite3.connect(db_path)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(products)")}
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    conn.close()
+    assert {"effective_price", "payload_hash"} <= columns
+    assert {"ix_products_sort_name_id", "ix_products_sort_price_id", "ix_products_effective_price_id"} <= indexes
@@ -0,0 +1,194 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+import pytest
+from sqlalchemy import create_engine, delete, text
+from sqlalchemy.orm import Session
+from httpx import AsyncClient, ASGITransport
+import database, models
+import services.catalog
+import services.email
+import services.inventory
+import services.payment
+from main import app
+from test_query_counts import count_queries
+from conftest import order_payload, seed
+
+@pytest.fixture
+def no_gateway(monkeypatch):
+    monkeypatch.setattr(services.payment.PaymentService, "create_preference",
+                        lambda self, order_id, items, payer_email: f"http://pay/{order_id}")
+
+@pytest.mark.asyncio
+async def test_parallel_orders_never_oversell(no_gateway):
+    db = database.SessionLocal()
+    variant_id, = seed(db, "ORD-HOT", 10, [10])
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        responses = await asyncio.gather(*[
+            ac.post("/orders", json=order_payload(f"hot-{i}@example.com", [
+                {"product_id": "ORD-HOT", "variant_id": variant_id, "quantity": 1, "unit_price": 10.0}
+            ]))
+            for i in range(40)
+        ])
+    codes = [r.status_code for r in responses]
+    assert codes.count(201) == 10
+    assert codes.count(400) == 30
+    assert all("Sin stock" in r.json()["detail"] for r in responses if r.status_code == 400)
+
+    # Pending orders hold the stock; the physical stock moves on payment
+    db.expire_all()
+    assert db.get(models.ProductVariant, variant_id).stock == 10
+    assert services.inventory.available_stock(db, models.ProductVariant, variant_id) == 0
+    assert db.query(models.OrderItem).filter(models.OrderItem.variant_id == variant_id).count() == 10
+    # Rejected checkouts leave nothing behind
+    assert db.query(models.Customer).filter(models.Customer.email.like("hot-%@example.com")).count() == 10
+    db.close()
+
+@pytest.mark.asyncio
+async def test_shortfall_rolls_back_whole_order(no_gateway):
+    db = database.SessionLocal()
+    seed(db, "ORD-A", 5)
+    variant_id, = seed(db, "ORD-B", 1, [1])
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        response = await ac.post("/orders", json=order_payload("rollback@example.com", [
+            {"product_id": "ORD-A", "quantity": 2, "unit_price": 10.0},
+            {"product_id": "ORD-B", "variant_id": variant_id, "quantity": 3, "unit_price": 10.0},
+        ]))
+        assert response.status_code == 400
+        assert response.json()["detail"].endswith("Disponible: 1")
+
+        response = await ac.post("/orders", json=order_payload("rollback@example.com", [
+            {"product_id": "ORD-A", "quantity": -3, "unit_price": 10.0},
+        ]))
+        assert response.status_code == 400
+
+    db.expire_all()
+    assert db.get(models.Product, "ORD-A").stock == 5
+    assert db.get(models.ProductVariant, variant_id).stock == 1
+    assert db.query(models.Customer).filter(models.Customer.email == "rollback@example.com").count() == 0
+    db.close()
+
+def test_decrement_checks_stock_at_write_time():
+    # Interleaving of two checkouts of the last unit: both read stock 1 before either writes
+    db = database.SessionLocal()
+    variant_id, = seed(db, "ORD-LAST", 1, [1])
+    buyer_a, buyer_b = database.SessionLocal(), database.SessionLocal()
+    assert buyer_a.get(models.ProductVariant, variant_id).stock == 1
+    assert buyer_b.get(models.ProductVariant, variant_id).stock == 1
+
+    assert services.inventory.take_variant_stock(buyer_a, variant_id, "ORD-LAST", 1)
+    buyer_a.commit()
+    assert not services.inventory.take_variant_stock(buyer_b, variant_id, "ORD-LAST", 1)
+    buyer_b.rollback()
+
+    db.expire_all()
+    assert db.get(models.ProductVariant, variant_id).stock == 0
+    assert db.get(models.Product, "ORD-LAST").stock == 0
+    for session in (db, buyer_a, buyer_b):
+        session.close()
+
+@pytest.mark.asyncio
+async def test_create_order_reads_are_constant_in_cart_size(no_gateway):
+    db = database.SessionLocal()
+    cart = []
+    for i in range(10):
+        variant_id, = seed(db, f"ORD-QC-{i}", 5, [5])
+        cart.append({"product_id": f"ORD-QC-{i}", "variant_id": variant_id, "quantity": 1, "unit_price": 10.0})
+    db.close()
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        with count_queries() as small:
+            response = await ac.post("/orders", json=order_payload("qc-small@example.com", cart[:1]))
+        assert response.status_code == 201
+        with count_queries() as large:
+            response = await ac.post("/orders", json=order_payload("qc-large@example.com", cart))
+        assert response.status_code == 201
+        assert len(response.json()["items"]) == 10
+
+    selects = lambda statements: [s for s in statements if s.lstrip().startswith("SELECT")]
+    assert len(selects(large)) == len(selects(small))
+    # Writes: one executemany INSERT for the reservations and one for the items
+    assert [s.split()[2] for s in large if s.startswith(("INSERT", "UPDATE", "DELETE"))] == \
+        ["customers", "orders", "stock_reservations", "order_items"]
+
+@pytest.mark.asyncio
+async def test_reservations_expire_and_convert_on_payment(no_gateway, monkeypatch):
+    payments = {}  # payment_id -> order_id (external_reference)
+    monkeypatch.setattr(services.payment.PaymentService, "get_payment",
+                        lambda self, pid: {"status": "approved", "external_reference": str(payments[pid])})
+    monkeypatch.setattr(services.email.EmailService, "send_order_confirmation_client", lambda self, o: None)
+    monkeypatch.setattr(services.email.EmailService, "send_order_notification_admin", lambda self, o: None)
+    db = database.SessionLocal()
+    variant_id, = seed(db, "ORD-RES", 3, [3])
+    line = lambda quantity: [{"product_id": "ORD-RES", "variant_id": variant_id, "quantity": quantity, "unit_price": 10.0}]
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        abandoned = (await ac.post("/orders", json=order_payload("res-a@example.com", line(2)))).json()["id"]
+        assert (await ac.get("/products/ORD-RES")).json()["stock"] == 1
+        response = await ac.post("/orders", json=order_payload("res-b@example.com", line(2)))
+        assert response.json()["detail"].endswith("Disponible: 1")
+
+        # An expired hold stops counting at once; the sweeper marks it and refreshes the catalog
+        db.query(models.StockReservation).filter(models.StockReservation.order_id == abandoned).update(
+            {"expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)})
+        db.commit()
+        assert services.inventory.available_stock(db, models.ProductVariant, variant_id) == 3
+        product_ids = services.inventory.release_expired(db)
+        assert product_ids == ["ORD-RES"]
+        services.catalog.notify_change(db, product_ids)
+        assert (await ac.get("/products/ORD-RES")).json()["stock"] == 3
+
+        paid = (await ac.post("/orders", json=order_payload("res-c@example.com", line(3)))).json()["id"]
+        payments.update({"PAY-RES-C": paid, "PAY-RES-A": abandoned})
+        response = await ac.post(f"/orders/{paid}/confirm", params={"payment_id": "PAY-RES-C"})
+        assert response.json()["status"] == "paid"
+        db.expire_all()
+        assert db.get(models.ProductVariant, variant_id).stock == 0
+        assert db.get(models.Product, "ORD-RES").stock == 0
+        assert db.query(models.StockReservation).filter(models.StockReservation.order_id == paid).count() == 0
+        assert (await ac.get("/products/ORD-RES")).json()["stock"] == 0
+
+        # A late payment for the abandoned order is still honoured (stock cannot go negative)
+        response = await ac.post(f"/orders/{abandoned}/confirm", params={"payment_id": "PAY-RES-A"})
+        assert response.json()["status"] == "paid"
+        db.expire_all()
+        assert db.get(models.ProductVariant, variant_id).stock == 0
+    db.close()
+
+def test_reserve_locks_parent_product_before_variants():
+    # A variant line also locks its product row, so it serializes with product-level checkouts
+    db = database.SessionLocal()
+    variant_id, = seed(db, "ORD-LOCK", 2, [2])
+    order = models.Order(customer_id=None, total_amount=10.0, status="pending")
+    db.add(order)
+    db.flush()
+    with count_queries() as statements:
+        assert services.inventory.reserve(db, order.id, {(variant_id, "ORD-LOCK"): 1}) == []
+    tables = [s.split("FROM", 1)[1].split()[0] for s in statements if s.lstrip().startswith("SELECT")]
+    assert tables[:2] == ["products", "product_variants"]
+    db.rollback()
+    db.close()
+
+@pytest.mark.asyncio
+async def test_reserved_variant_can_be_deleted(no_gateway):
+    db = database.SessionLocal()
+    variant_id, = seed(db, "ORD-DEL", 2, [2])
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        response = await ac.post("/orders", json=order_payload("del@example.com", [
+            {"product_id": "ORD-DEL", "variant_id": variant_id, "quantity": 1, "unit_price": 10.0}
+        ]))
+        assert response.status_code == 201
+    db.close()
+
+    # Catalog sync drops the variant while its (kept) reservation still points at it
+    engine = create_engine(database.DATABASE_URL)
+    with Session(engine) as strict:
+        strict.execute(text("PRAGMA foreign_keys=ON"))
+        strict.execute(delete(models.ProductVariant).where(models.ProductVariant.id == variant_id))
+        strict.commit()
+        assert strict.query(models.StockReservation).filter(models.StockReservation.variant_id == variant_id).count() == 1
+    engine.dispose()
@@ -0,0 +1,129 @@
+import json
+from datetime import datetime, timedelta, timezone
+import pytest
+from httpx import AsyncClient, ASGITransport
+import database, models
+import services.email
+import services.integration
+import services.outbox
+import services.payment
+from main import app
+
+def platform(stub_server, responses):
+    """
+    Plataforma de gestión local: responde con los códigos de `responses`
+    (el último se repite).
+    """
+    def respond(request):
+        return (responses.pop(0) if len(responses) > 1 else responses[0]), None
+    return stub_server(respond)
+
+def make_order(db, email):
+    customer = models.Customer(full_name="Outbox Test", email=email)
+    order = models.Order(customer=customer, total_amount=1500.0, delivery_method="pickup",
+                         shipping_data='{"pickup_name": "Ana", "pickup_dni": "1"}', status="pending")
+    db.add(order)
+    db.commit()
+    return order.id
+
+def make_event(db, aggregate_id):
+    event = models.OutboxEvent(event_type="sale.created", aggregate_id=aggregate_id,
+                               payload=json.dumps({"external_order_id": f"#{aggregate_id}"}),
+                               status="pending", attempts=0, next_attempt_at=datetime.now(timezone.utc))
+    db.add(event)
+    db.commit()
+    return event.id
+
+def make_due(db, event_id):
+    db.query(models.OutboxEvent).filter(models.OutboxEvent.id == event_id).update(
+        {"next_attempt_at": datetime.now(timezone.utc) - timedelta(seconds=1)})
+    db.commit()
+
+def clear_pending(db):
+    db.query(models.OutboxEvent).filter(models.OutboxEvent.status == "pending").update({"status": "sent"})
+    db.commit()
+
+@pytest.mark.asyncio
+async def test_confirm_order_writes_outbox_and_dispatcher_retries(monkeypatch, stub_server):
+    stub = platform(stub_server, [503, 200])
+    monkeypatch.setenv("MANAGEMENT_WEBHOOK_URL", stub.url + "/sales")
+    monkeypatch.setattr(services.payment.PaymentService, "__init__", lambda self: None)
+    payments = {}  # payment_id -> order_id (external_reference)
+    monkeypatch.setattr(services.payment.PaymentService, "get_payment",
+                        lambda self, pid: {"status": "approved", "external_reference": str(payments[pid])})
+    monkeypatch.setattr(services.email.EmailService, "send_order_confirmation_client", lambda self, o: None)
+    monkeypatch.setattr(services.email.EmailService, "send_order_notification_admin", lambda self, o: None)
+
+    db = database.SessionLocal()
+    try:
+        clear_pending(db)
+        order_id = make_order(db, "outbox-confirm@example.com")
+        payments["PAY-OUT-1"] = order_id
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            response = await ac.post(f"/orders/{order_id}/confirm", params={"payment_id": "PAY-OUT-1"})
+        assert response.json()["status"] == "paid"
+        # Nothing was sent inline: the event waits in the outbox
+        assert stub.requests == []
+        event = db.query(models.OutboxEvent).filter(models.OutboxEvent.aggregate_id == str(order_id)).one()
+        assert event.status == "pending"
+        assert json.loads(event.payload)["payment_id"] == "PAY-OUT-1"
+
+        with services.integration.http_session() as http:
+            assert services.outbox.dispatch_batch(db, http) == 1
+            db.refresh(event)
+            assert (event.status, event.attempts) == ("pending", 1)
+            assert event.last_error.startswith("HTTP 503")
+            # Backoff: not due yet
+            assert services.outbox.dispatch_batch(db, http) == 0
+
+            make_due(db, event.id)
+            assert services.outbox.dispatch_batch(db, http) == 1
+        db.refresh(event)
+        assert (event.status, event.attempts, event.last_error) == ("sent", 2, None)
+        assert [r["headers"]["X-Event-Id"] for r in stub.requests] == [str(event.id)] * 2
+        assert stub.requests[-1]["body"]["external_order_id"] == f"#{order_id}"
+    finally:
+        db.close()
+
+@pytest.mark.asyncio
+async def test_outbox_dead_letters_and_batches(monkeypatch, stub_server):
+    responses = [500]
+    stub = platform(stub_server, responses)
+    monkeypatch.setenv("MANAGEMENT_WEBHOOK_URL", stub.url + "/sales")
+    monkeypatch.setattr(services.outbox, "OUTBOX_MAX_ATTEMPTS", 2)
+    db = database.SessionLocal()
+    try:
+        clear_pending(db)
+        event_id = make_event(db, "dead-1")
+        with services.integration.http_session() as http:
+            services.outbox.dispatch_batch(db, http)
+            make_due(db, event_id)
+            services.outbox.dispatch_batch(db, http)
+        event = db.get(models.OutboxEvent, event_id)
+        db.refresh(event)
+        assert (event.status, event.attempts) == ("dead", 2)
+
+        monkeypatch.setenv("ADMIN_API_KEY", "test-admin-key")
+        headers = {"x-admin-key": "test-admin-key"}
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            dead = (await ac.get("/admin/outbox", headers=headers)).json()
+            assert event_id in [e["id"] for e in dead]
+            response = await ac.post(f"/admin/outbox/{event_id}/retry", headers=headers)
+            assert response.json()["status"] == "pending"
+
+        # With a batch endpoint, due events go out in a single request
+        responses[:] = [200]
+        stub.requests.clear()
+        monkeypatch.setenv("MANAGEMENT_WEBHOOK_BATCH_URL", stub.url + "/sales/batch")
+        ids = [event_id, make_event(db, "batch-2"), make_event(db, "batch-3")]
+        with services.integration.http_session() as http:
+            assert services.outbox.dispatch_batch(db, http) == 3
+        assert len(stub.requests) == 1
+        assert stub.requests[0]["path"] == "/sales/batch"
+        assert len(stub.requests[0]["body"]) == 3
+        db.expire_all()
+        assert {db.get(models.OutboxEvent, i).status for i in ids} == {"sent"}
+    finally:
+        db.close()
@@ -0,0 +1,106 @@
+import time
+import pytest
+from httpx import AsyncClient, ASGITransport
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+import database
+import main
+import models
+from main import app
+from conftest import STORE_KEY
+
+@pytest.mark.asyncio
+async def test_cursor_pagination_walks_all_products(monkeypatch):
+    monkeypatch.setenv("STORE_API_KEY", STORE_KEY)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        for i in range(5):
+            payload = {"id": f"PAG-{i}", "sku": f"PAG-{i}", "name": f"Yerbera Pagtest {i % 2}", "price": 10.0}
+            await ac.post("/api/webhooks/products", json=payload, headers={"x-store-api-key": STORE_KEY})
+
+        offset_page = (await ac.get("/products", params={"search": "pagtest", "sort": "name", "limit": 5})).json()
+        expected = [p["id"] for p in offset_page["items"]]
+        assert offset_page["total"] == 5
+
+        seen, after = [], None
+        while True:
+            params = {"search": "pagtest", "sort": "name", "limit": 2, "include_total": "false"}
+            if after:
+                params["after"] = after
+            page = (await ac.get("/products", params=params)).json()
+            assert page["total"] is None
+            seen.extend(p["id"] for p in page["items"])
+            after = page["next_cursor"]
+            if not after:
+                break
+        assert seen == expected
+
+        response = await ac.get("/products", params={"after": "not-a-cursor"})
+        assert response.status_code == 400
+
+def test_benchmark_offset_vs_keyset_100k(tmp_path):
+    """
+    Benchmark: página profunda con OFFSET vs keyset sobre 100k productos.
+    """
+    engine = create_engine(f"sqlite:///{tmp_path / 'bench.db'}")
+    models.Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(models.Product), [
+            {"id": f"B{i:06d}", "sku": f"B{i:06d}", "name": f"Producto {i % 997:03d}", "price": float(i % 500),
+             "stock": 1, "is_active": True}
+            for i in range(100_000)
+        ])
+    db = sessionmaker(bind=engine)()
+    try:
+        id_query = db.query(models.Product.id).filter(models.Product.is_active == True)
+        limit, deep_skip = 20, 99_000
+
+        started = time.perf_counter()
+        offset_ids, total, _ = main._page_product_ids(id_query, deep_skip, limit, "name")
+        offset_seconds = time.perf_counter() - started
+        assert total == 100_000
+
+        # Cursor pointing right before the same deep page
+        previous_ids, _, cursor = main._page_product_ids(id_query, deep_skip - limit, limit, "name")
+        started = time.perf_counter()
+        keyset_ids, keyset_total, _ = main._page_product_ids(
+            id_query, 0, limit, "name", cursor=main.decode_cursor(cursor), include_total=False
+        )
+        keyset_seconds = time.perf_counter() - started
+
+        assert keyset_ids == offset_ids
+        assert keyset_total is None
+        print(f"\n100k products, page at offset {deep_skip}: "
+              f"offset+count {offset_seconds * 1000:.1f} ms, keyset {keyset_seconds * 1000:.1f} ms")
+        assert keyset_seconds < offset_seconds
+    finally:
+        db.close()
+        engine.dispose()
+
+@pytest.mark.parametrize("sort", ["name", "price_asc", "price_desc"])
+def test_cursor_walk_includes_null_sort_keys(sort):
+    db = database.SessionLocal()
+    db.query(models.Product).filter(models.Product.id.like("NUL-%")).delete(synchronize_session=False)
+    db.execute(insert(models.Product), [
+        {"id": "NUL-1", "sku": "NUL-1", "name": "Mate", "price": 5.0, "effective_price": 5.0, "is_active": True},
+        {"id": "NUL-2", "sku": "NUL-2", "name": None, "price": None, "effective_price": None, "is_active": True},
+        {"id": "NUL-3", "sku": "NUL-3", "name": "Bombilla", "price": None, "effective_price": None, "is_active": True},
+        {"id": "NUL-4", "sku": "NUL-4", "name": "Termo", "price": 2.0, "effective_price": 2.0, "is_active": True},
+    ])
+    db.commit()
+    id_query = db.query(models.Product.id).filter(models.Product.id.like("NUL-%"))
+
+    expected, _, _ = main._page_product_ids(id_query, 0, 10, sort)
+    seen, cursor = [], None
+    while True:
+        ids, _, next_cursor = main._page_product_ids(id_query, 0, 1, sort, cursor=cursor, include_total=False)
+        seen.extend(ids)
+        if not next_cursor:
+            break
+        cursor = main.decode_cursor(next_cursor)
+    # Not valid for the API schemas: keep them out of the shared catalog
+    db.query(models.Product).filter(models.Product.id.like("NUL-%")).delete(synchronize_session=False)
+    db.commit()
+    db.close()
+    assert sorted(expected) == ["NUL-1", "NUL-2", "NUL-3", "NUL-4"]
+    assert seen == expected
@@ -0,0 +1,63 @@
+import asyncio
+import time
+import pytest
+from httpx import AsyncClient, ASGITransport
+import database
+import services.payment
+from main import app
+from conftest import order_payload, seed
+
+ITEMS = [{"product_id": "P1", "name": "Poncho", "quantity": 1, "unit_price": 100.0}]
+
+def test_timeouts_and_circuit_breaker(mp_stub):
+    service = services.payment.PaymentService()
+    assert service.create_preference(1, ITEMS, "a@example.com") == "https://mp.test/pay/1"
+
+    # A slow gateway is cut at the per-call timeout
+    mp_stub.delay = 1.0
+    started = time.monotonic()
+    with pytest.raises(services.payment.PaymentGatewayUnavailable):
+        service.create_preference(2, ITEMS, "a@example.com")
+    assert time.monotonic() - started < 0.9
+
+    # Two more failures (5xx) open the circuit; then calls fail without touching the network
+    mp_stub.delay, mp_stub.status = 0.0, 500
+    for order_id in (3, 4):
+        with pytest.raises(services.payment.PaymentGatewayUnavailable):
+            service.create_preference(order_id, ITEMS, "a@example.com")
+    assert services.payment.breaker.state == "open"
+    calls = mp_stub.count("POST")
+    with pytest.raises(services.payment.PaymentGatewayUnavailable, match="circuit open"):
+        service.create_preference(5, ITEMS, "a@example.com")
+    assert mp_stub.count("POST") == calls
+
+    # After the cooldown a single probe goes through and closes the circuit
+    mp_stub.status = 201
+    time.sleep(0.6)
+    assert services.payment.breaker.state == "half_open"
+    assert service.create_preference(6, ITEMS, "a@example.com") == "https://mp.test/pay/6"
+    assert services.payment.breaker.state == "closed"
+
+@pytest.mark.asyncio
+async def test_slow_gateway_does_not_hold_checkout(mp_stub, monkeypatch):
+    monkeypatch.setattr(services.payment, "MP_PREFERENCE_BUDGET_SECONDS", 0.2)
+    db = database.SessionLocal()
+    seed(db, "PAY-SLOW", 50)
+    db.close()
+    payload = lambda i: order_payload(f"slow-{i}@example.com",
+                                      [{"product_id": "PAY-SLOW", "quantity": 1, "unit_price": 10.0}])
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        response = await ac.post("/orders", json=payload(0))
+        assert response.status_code == 201
+        assert response.json()["payment_url"] == f"https://mp.test/pay/{response.json()['id']}"
+
+        # Gateway hangs: each checkout gives up at the budget and the order is still created
+        mp_stub.delay = 2.0
+        started = time.monotonic()
+        responses = await asyncio.gather(*[ac.post("/orders", json=payload(i)) for i in range(1, 13)],
+                                         ac.get("/health"))
+        assert time.monotonic() - started < 1.5
+        assert responses[-1].status_code == 200
+        assert all(r.status_code == 201 and r.json()["payment_url"] is None for r in responses[:-1])
@@ -0,0 +1,136 @@
+import hashlib
+import hmac
+import pytest
+from httpx import AsyncClient, ASGITransport
+import database, models
+import services.email
+from main import app
+from conftest import order_payload, seed
+
+ITEMS = [{"product_id": "PAY-IPN", "quantity": 1, "unit_price": 10.0}]
+
+@pytest.fixture
+def emails(monkeypatch):
+    sent = []
+    monkeypatch.setattr(services.email.EmailService, "send_order_confirmation_client", lambda self, o: sent.append(o.id))
+    monkeypatch.setattr(services.email.EmailService, "send_order_notification_admin", lambda self, o: None)
+    db = database.SessionLocal()
+    seed(db, "PAY-IPN", 10)
+    db.close()
+    return sent
+
+def notify(ac, payment_id, **kwargs):
+    return ac.post("/webhooks/mercadopago", params={"type": "payment", "data.id": payment_id},
+                   json={"type": "payment", "action": "payment.updated", "data": {"id": payment_id}}, **kwargs)
+
+@pytest.mark.asyncio
+async def test_notification_pays_order_once_and_feeds_status_cache(mp_stub, emails):
+    db = database.SessionLocal()
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        order_id = (await ac.post("/orders", json=order_payload("ipn-a@example.com", ITEMS))).json()["id"]
+        mp_stub.payments["9001"] = {"id": 9001, "status": "approved", "external_reference": str(order_id)}
+
+        # MP delivers the same notification more than once
+        for _ in range(3):
+            response = await notify(ac, "9001")
+            assert response.json() == {"payment_id": "9001", "status": "approved", "order_id": order_id}
+        order = db.get(models.Order, order_id)
+        assert (order.status, order.payment_id) == ("paid", "9001")
+        assert db.get(models.Product, "PAY-IPN").stock == 9
+        assert db.query(models.OutboxEvent).filter(models.OutboxEvent.aggregate_id == order_id).count() == 1
+        assert emails == [order_id]
+
+        # The success page answers from the cache: no gateway round trip
+        gets = mp_stub.count("GET")
+        response = await ac.post(f"/orders/{order_id}/confirm", params={"payment_id": "9001"})
+        assert response.json()["status"] == "paid"
+        response = await ac.get(f"/orders/{order_id}", params={"payment_id": "9001"})
+        assert response.json()["payment_status"] == "approved"
+        assert mp_stub.count("GET") == gets
+        assert emails == [order_id]
+
+        # That payment belongs to another order
+        other = (await ac.post("/orders", json=order_payload("ipn-b@example.com", ITEMS))).json()["id"]
+        assert (await ac.post(f"/orders/{other}/confirm", params={"payment_id": "9001"})).status_code == 403
+    db.close()
+
+@pytest.mark.asyncio
+async def test_pending_status_is_rechecked_until_terminal(mp_stub, emails):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        order_id = (await ac.post("/orders", json=order_payload("ipn-c@example.com", ITEMS))).json()["id"]
+        mp_stub.payments["9002"] = {"id": 9002, "status": "in_process", "external_reference": str(order_id)}
+        # Legacy IPN format
+        response = await ac.post("/webhooks/mercadopago", params={"topic": "payment", "id": "9002"})
+        assert response.json()["status"] == "in_process"
+
+        gets = mp_stub.count("GET")
+        mp_stub.payments["9002"]["status"] = "approved"
+        response = await ac.post(f"/orders/{order_id}/confirm", params={"payment_id": "9002"})
+        assert response.json()["status"] == "paid"
+        assert mp_stub.count("GET") == gets + 1
+        # A late, out-of-order 'pending' does not overwrite the terminal status
+        mp_stub.payments["9002"]["status"] = "pending"
+        await notify(ac, "9002")
+        response = await ac.get(f"/orders/{order_id}", params={"payment_id": "9002"})
+        assert (response.json()["status"], response.json()["payment_status"]) == ("paid", "approved")
+        assert emails == [order_id]
+
+        # Unknown payments (404) and other topics are acknowledged; gateway errors ask MP to retry
+        response = await notify(ac, "404404")
+        assert (response.status_code, response.json()["message"]) == (200, "Ignored")
+        response = await ac.post("/webhooks/mercadopago", params={"topic": "merchant_order", "id": "1"})
+        assert response.json()["message"] == "Ignored"
+        mp_stub.status = 500
+        assert (await notify(ac, "9003")).status_code == 503
+
+@pytest.mark.asyncio
+async def test_notification_signature(mp_stub, emails, monkeypatch):
+    monkeypatch.setenv("MP_WEBHOOK_SECRET", "shh")
+    mp_stub.payments["9004"] = {"id": 9004, "status": "rejected", "external_reference": "unknown"}
+    manifest = "id:9004;request-id:req-1;ts:1700000000;"
+    signature = hmac.new(b"shh", manifest.encode(), hashlib.sha256).hexdigest()
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        response = await notify(ac, "9004", headers={"x-request-id": "req-1", "x-signature": "ts=1700000000,v1=bad"})
+        assert response.status_code == 401
+        response = await notify(ac, "9004", headers={"x-request-id": "req-1",
+                                                     "x-signature": f"ts=1700000000,v1={signature}"})
+        assert response.json() == {"payment_id": "9004", "status": "rejected", "order_id": None}
+
+@pytest.mark.asyncio
+async def test_confirm_requires_payment_for_that_order(mp_stub, emails):
+    db = database.SessionLocal()
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        mine = (await ac.post("/orders", json=order_payload("ipn-d@example.com", ITEMS))).json()["id"]
+        other = (await ac.post("/orders", json=order_payload("ipn-e@example.com", ITEMS))).json()["id"]
+        # Approved payment for `other`, never notified: nothing cached yet
+        mp_stub.payments["9005"] = {"id": 9005, "status": "approved", "external_reference": str(other)}
+
+        assert (await ac.post(f"/orders/{mine}/confirm", params={"payment_id": "9005"})).status_code == 403
+        assert (await ac.post(f"/orders/{mine}/confirm", params={"payment_id": "404404"})).status_code == 403
+        order = db.get(models.Order, mine)
+        assert (order.status, order.payment_id) == ("pending", None)
+        assert emails == []
+
+        response = await ac.post(f"/orders/{other}/confirm", params={"payment_id": "9005"})
+        assert response.json()["status"] == "paid"
+        assert emails == [other]
+    db.close()
+
+@pytest.mark.asyncio
+async def test_pending_order_does_not_show_another_orders_payment(mp_stub, emails):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        mine = (await ac.post("/orders", json=order_payload("ipn-f@example.com", ITEMS))).json()["id"]
+        other = (await ac.post("/orders", json=order_payload("ipn-g@example.com", ITEMS))).json()["id"]
+        mp_stub.payments["9006"] = {"id": 9006, "status": "approved", "external_reference": str(other)}
+        await notify(ac, "9006")
+
+        # `mine` has no payment_id yet: the cached status of `other`'s payment is not exposed
+        response = await ac.get(f"/orders/{mine}", params={"payment_id": "9006"})
+        assert (response.json()["status"], response.json()["payment_status"]) == ("pending", None)
+        response = await ac.get(f"/orders/{other}", params={"payment_id": "9006"})
+        assert response.json()["payment_status"] == "approved"
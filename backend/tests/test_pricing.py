@@ -0,0 +1,39 @@
+import pytest
+from httpx import AsyncClient, ASGITransport
+from main import app
+from conftest import STORE_KEY
+
+@pytest.mark.asyncio
+async def test_effective_price_drives_filters_and_sort(monkeypatch):
+    monkeypatch.setenv("STORE_API_KEY", STORE_KEY)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        for pid, price in [("PRC-001", 1000.0), ("PRC-002", 2000.0), ("PRC-003", 3000.0)]:
+            payload = {"id": pid, "sku": pid, "name": f"Talero {pid}", "price": price, "category": "Rebenques"}
+            await ac.post("/api/webhooks/products", json=payload, headers={"x-store-api-key": STORE_KEY})
+
+        # 3000 -> 1500 with a 50% discount; 2000 -> 500 with an override
+        await ac.put("/admin/products/PRC-003/price", json={"discount_percentage": 50})
+        await ac.put("/admin/products/PRC-002/price", json={"price_override": 500.0})
+
+        detail = (await ac.get("/products/PRC-003")).json()
+        assert detail["effective_price"] == 1500.0
+
+        response = await ac.get("/products", params={"search": "talero", "sort": "price_asc"})
+        assert [p["id"] for p in response.json()["items"]] == ["PRC-002", "PRC-001", "PRC-003"]
+
+        response = await ac.get("/products", params={"search": "talero", "sort": "price_desc", "limit": 2})
+        body = response.json()
+        assert [p["id"] for p in body["items"]] == ["PRC-003", "PRC-001"]
+        response = await ac.get("/products", params={"search": "talero", "sort": "price_desc", "after": body["next_cursor"]})
+        assert [p["id"] for p in response.json()["items"]] == ["PRC-002"]
+
+        response = await ac.get("/products", params={"search": "talero", "min_price": 900, "max_price": 1600, "view": "card"})
+        items = response.json()["items"]
+        assert sorted(p["id"] for p in items) == ["PRC-001", "PRC-003"]
+        assert all("effective_price" in p for p in items)
+
+        # Bulk discount goes through a single UPDATE and must keep the column in sync
+        await ac.put("/admin/products/prices/batch", json={"category": "Rebenques", "discount_percentage": 10})
+        assert (await ac.get("/products/PRC-001")).json()["effective_price"] == 900.0
+        assert (await ac.get("/products/PRC-002")).json()["effective_price"] == 500.0
@@ -0,0 +1,42 @@
+import contextlib
+import pytest
+from httpx import AsyncClient, ASGITransport
+from sqlalchemy import event
+import database
+from main import app
+from conftest import STORE_KEY
+
+@contextlib.contextmanager
+def count_queries():
+    statements = []
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(database.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(database.engine, "before_cursor_execute", before_cursor_execute)
+
+@pytest.mark.asyncio
+async def test_admin_product_list_query_count_is_constant(monkeypatch):
+    monkeypatch.setenv("STORE_API_KEY", STORE_KEY)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        for i in range(6):
+            payload = {
+                "id": f"QC-{i}", "sku": f"QC-{i}", "name": f"Qcount {i}", "price": 10.0, "category": "Qcount",
+                "images": [f"http://img/{i}.jpg"],
+                "variants": [{"sku": f"QC-{i}-S", "stock": 1}, {"sku": f"QC-{i}-M", "stock": 1}]
+            }
+            await ac.post("/api/webhooks/products", json=payload, headers={"x-store-api-key": STORE_KEY})
+
+        with count_queries() as small:
+            response = await ac.get("/admin/products", params={"search": "Qcount", "limit": 1})
+        assert len(response.json()) == 1
+
+        with count_queries() as large:
+            response = await ac.get("/admin/products", params={"search": "Qcount", "limit": 6})
+        assert len(response.json()) == 6
+        assert response.json()[0]["variants"]
+
+        assert len(small) == len(large)
@@ -0,0 +1,107 @@
+import pytest
+from httpx import AsyncClient, ASGITransport
+import services.search
+from main import app
+from conftest import STORE_KEY
+
+# Pruebas de búsqueda indexada (FTS5 en SQLite)
+
+async def push_product(ac, product_id, name, category, description=""):
+    payload = {
+        "id": product_id,
+        "sku": product_id,
+        "name": name,
+        "description": description,
+        "price": 1000.0,
+        "category": category,
+        "variants": [{"sku": f"{product_id}-U", "stock": 5}]
+    }
+    response = await ac.post("/api/webhooks/products", json=payload, headers={"x-store-api-key": STORE_KEY})
+    assert response.status_code == 200
+
+@pytest.mark.asyncio
+async def test_search_is_accent_and_case_insensitive(monkeypatch):
+    monkeypatch.setenv("STORE_API_KEY", STORE_KEY)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        await push_product(ac, "SRCH-001", "Facón Criollo Zzyzx", "Cuchillería")
+        await push_product(ac, "SRCH-002", "Rastra Zzyzx", "Cintos", "Con monedas de plata")
+
+        response = await ac.get("/products", params={"search": "FACON zzyz"})
+        data = response.json()
+        assert data["total"] == 1
+        assert data["items"][0]["id"] == "SRCH-001"
+
+        response = await ac.get("/products", params={"search": "zzyzx cuchilleria"})
+        assert [p["id"] for p in response.json()["items"]] == ["SRCH-001"]
+
+        response = await ac.get("/products", params={"search": "zzyzx plata", "limit": 1})
+        data = response.json()
+        assert data["total"] == 1
+        assert data["items"][0]["id"] == "SRCH-002"
+
+@pytest.mark.asyncio
+async def test_search_index_follows_updates(monkeypatch):
+    monkeypatch.setenv("STORE_API_KEY", STORE_KEY)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        await push_product(ac, "SRCH-003", "Poncho Qwvuta", "Ponchos")
+        await push_product(ac, "SRCH-003", "Poncho Salteño Qwvuta", "Ponchos")
+
+        response = await ac.get("/products", params={"search": "salteno qwvuta"})
+        assert response.json()["total"] == 1
+
+@pytest.mark.asyncio
+async def test_fuzzy_search_tolerates_typos(monkeypatch):
+    monkeypatch.setenv("STORE_API_KEY", STORE_KEY)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        await push_product(ac, "SRCH-004", "Cuchillo Xkwambiro", "Cuchillería")
+
+        response = await ac.get("/products", params={"search": "cuchiyo xkwanbiro"})
+        data = response.json()
+        assert data["total"] >= 1
+        assert data["items"][0]["id"] == "SRCH-004"
+
+@pytest.mark.asyncio
+async def test_search_ranks_name_above_description(monkeypatch):
+    monkeypatch.setenv("STORE_API_KEY", STORE_KEY)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        await push_product(ac, "SRCH-005", "Mate de calabaza", "Mates", "Ideal para acompañar un plovtek")
+        await push_product(ac, "SRCH-006", "Bombilla Plovtek", "Mates")
+
+        response = await ac.get("/products", params={"search": "plovtek", "sort": "relevance"})
+        assert [p["id"] for p in response.json()["items"]] == ["SRCH-006", "SRCH-005"]
+
+        response = await ac.get("/products", params={"search": "plovtek", "limit": 1, "skip": 1})
+        data = response.json()
+        assert data["total"] == 2
+        assert data["items"][0]["id"] == "SRCH-005"
+
+        response = await ac.get("/products", params={"sort": "bogus"})
+        assert response.status_code == 400
+
+@pytest.mark.asyncio
+async def test_unindexed_search_applies_sort_and_cursor(monkeypatch):
+    monkeypatch.setenv("STORE_API_KEY", STORE_KEY)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        for product_id, name in (("SRCH-010", "Poncho Zwirtal Rojo"), ("SRCH-011", "Abrigo Zwirtal"),
+                                 ("SRCH-012", "Manta Zwirtal")):
+            await push_product(ac, product_id, name, "Abrigos")
+
+        # No search index: matching falls back to Python, the order still follows 'sort'
+        monkeypatch.setattr(services.search, "SEARCH_BACKEND", None)
+        seen, after = [], None
+        while True:
+            params = {"search": "zwirtal", "sort": "name", "limit": 2}
+            if after:
+                params["after"] = after
+            data = (await ac.get("/products", params=params)).json()
+            seen += [p["id"] for p in data["items"]]
+            after = data["next_cursor"]
+            if not after:
+                break
+        assert seen == ["SRCH-011", "SRCH-012", "SRCH-010"]
+        assert data["total"] == 3
@@ -0,0 +1,74 @@
+import pytest
+from httpx import AsyncClient, ASGITransport
+import database, models
+from main import app
+from test_query_counts import count_queries
+from conftest import seed
+
+ADMIN_KEY = "test-admin-key"
+
+def variant_stocks(db, product_id):
+    return [v.stock for v in db.query(models.ProductVariant)
+            .filter(models.ProductVariant.product_id == product_id).order_by(models.ProductVariant.id)]
+
+@pytest.mark.asyncio
+async def test_stock_audit_finds_mismatches_and_repairs_by_strategy(monkeypatch):
+    monkeypatch.setenv("ADMIN_API_KEY", ADMIN_KEY)
+    headers = {"x-admin-key": ADMIN_KEY}
+    ids = ["AUD-1", "AUD-2", "AUD-3", "AUD-OK"]
+    db = database.SessionLocal()
+    seed(db, "AUD-1", 10, [4, 0, 2])   # variants short by 4
+    seed(db, "AUD-2", 3, [5, 3, 2])    # variants over by 7
+    seed(db, "AUD-3", 6, [0, 0])       # nothing to scale
+    seed(db, "AUD-OK", 3, [1, 2])
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        with count_queries() as statements:
+            audit = (await ac.get("/admin/stock-audit", headers=headers)).json()
+        assert len(statements) == 1
+        found = {m["product_id"]: m for m in audit["mismatches"] if m["product_id"] in ids}
+        assert sorted(found) == ["AUD-1", "AUD-2", "AUD-3"]
+        assert (found["AUD-2"]["product_stock"], found["AUD-2"]["variant_total"]) == (3, 10)
+
+        params = [("strategy", "proportional"), *[("product_ids", i) for i in ids]]
+        report = (await ac.post("/admin/stock-audit/repair", params=params, headers=headers)).json()
+        assert report["dry_run"] is True
+        changes = {c["product_id"]: c for c in report["changes"]}
+        assert [(v["before"], v["after"]) for v in changes["AUD-1"]["variants"]] == [(4, 7), (2, 3)]
+        assert [(v["before"], v["after"]) for v in changes["AUD-2"]["variants"]] == [(5, 1), (3, 1), (2, 1)]
+        assert [m["product_id"] for m in report["unresolved"]] == ["AUD-3"]
+        db.expire_all()
+        assert variant_stocks(db, "AUD-1") == [4, 0, 2]
+
+        report = (await ac.post("/admin/stock-audit/repair", params=params + [("dry_run", "false")],
+                                headers=headers)).json()
+        assert report["repaired"] == 2
+        db.expire_all()
+        assert variant_stocks(db, "AUD-1") == [7, 0, 3]
+        assert variant_stocks(db, "AUD-2") == [1, 1, 1]
+        assert sum(v["stock"] for v in (await ac.get("/products/AUD-2")).json()["variants"]) == 3
+
+        # trust_product moves the difference onto the largest variants
+        seed(db, "AUD-2", 3, [5, 3, 2])
+        report = (await ac.post("/admin/stock-audit/repair", params=[("strategy", "trust_product"), ("dry_run", "false"),
+                                                                       ("product_ids", "AUD-2"), ("product_ids", "AUD-3")],
+                                headers=headers)).json()
+        db.expire_all()
+        assert variant_stocks(db, "AUD-2") == [0, 1, 2]
+        assert variant_stocks(db, "AUD-3") == [6, 0]
+
+        # trust_variants rewrites the product total
+        seed(db, "AUD-1", 99, [1, 1])
+        report = (await ac.post("/admin/stock-audit/repair", params=[("strategy", "trust_variants"), ("dry_run", "false"),
+                                                                       ("product_ids", "AUD-1")],
+                                headers=headers)).json()
+        assert report["changes"][0]["product_stock_after"] == 2
+        assert (await ac.get("/products/AUD-1")).json()["stock"] == 2
+
+        audit = (await ac.get("/admin/stock-audit", headers=headers)).json()
+        assert not [m for m in audit["mismatches"] if m["product_id"] in ids]
+
+        assert (await ac.post("/admin/stock-audit/repair", params={"strategy": "guess"},
+                              headers=headers)).status_code == 400
+    db.close()
@@ -0,0 +1,88 @@
+import pytest
+from httpx import AsyncClient, ASGITransport
+import database, models
+import services.catalog
+from main import app
+
+ADMIN_KEY = "test-admin-key"
+
+def stock_feed(stub_server, pages):
+    """
+    Feed de stock local: pages[since] = {"items", "cursor", "has_more"}.
+    Responde 304 si If-None-Match coincide con el ETag de la página.
+    """
+    def respond(request):
+        since = request["query"].get("since", "")
+        page = pages.get(since, {"items": [], "cursor": since, "has_more": False})
+        etag = f'"{since or "start"}-{len(page["items"])}"'
+        if request["headers"].get("If-None-Match") == etag:
+            return 304, None
+        return 200, page, {"ETag": etag}
+    return stub_server(respond)
+
+def polls(stub):
+    return [(r["query"].get("since", ""), r["headers"].get("If-None-Match")) for r in stub.requests]
+
+@pytest.mark.asyncio
+async def test_sync_stock_pulls_incrementally_and_corrects_drift(monkeypatch, stub_server):
+    pages = {}
+    stub = stock_feed(stub_server, pages)
+    monkeypatch.setenv("MANAGEMENT_STOCK_URL", stub.url + "/stock")
+    monkeypatch.setenv("ADMIN_API_KEY", ADMIN_KEY)
+    headers = {"x-admin-key": ADMIN_KEY}
+
+    db = database.SessionLocal()
+    db.query(models.SyncCursor).delete()
+    product = models.Product(id="STK-1", sku="STK-1", name="Bombacha Stock", price=100.0, stock=5)
+    product.variants = [
+        models.ProductVariant(sku="STK-1-S", stock=2),
+        models.ProductVariant(sku="STK-1-M", stock=3),
+    ]
+    db.add(product)
+    db.add(models.Product(id="STK-2", sku="STK-2", name="Rebenque Stock", price=100.0, stock=4))
+    db.commit()
+    services.catalog.notify_change(db, ["STK-1", "STK-2"])
+    db.close()
+
+    pages[""] = {"items": [{"sku": "STK-1-S", "stock": 7}, {"sku": "STK-2", "stock": 4}],
+                      "cursor": "c1", "has_more": True}
+    pages["c1"] = {"items": [{"sku": "STK-1-M", "stock": 3}, {"sku": "STK-404", "stock": 1},
+                                  {"sku": "STK-1", "stock": 99}],
+                        "cursor": "c2", "has_more": False}
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        assert (await ac.post("/admin/sync-stock")).status_code == 403
+
+        # Dry run reports drift without applying it or moving the cursor
+        report = (await ac.post("/admin/sync-stock", params={"dry_run": True}, headers=headers)).json()
+        assert report["changed"] == 1
+        assert report["drift"] == [
+            {"sku": "STK-1-S", "product_id": "STK-1", "level": "variant", "local": 2, "remote": 7}
+        ]
+        assert report["unknown_skus"] == ["STK-404"]
+        assert report["skipped_skus"] == ["STK-1"]
+        assert (await ac.get("/products/STK-1")).json()["stock"] == 5
+
+        report = (await ac.post("/admin/sync-stock", headers=headers)).json()
+        assert (report["pulled"], report["changed"], report["cursor"]) == (5, 1, "c2")
+        product = (await ac.get("/products/STK-1")).json()
+        assert product["stock"] == 10
+        assert sorted(v["stock"] for v in product["variants"]) == [3, 7]
+
+        # Next run starts from the saved cursor
+        pages["c2"] = {"items": [{"sku": "STK-2", "stock": 0}], "cursor": "c3", "has_more": False}
+        stub.requests.clear()
+        report = (await ac.post("/admin/sync-stock", headers=headers)).json()
+        assert polls(stub) == [("c2", None)]
+        assert report["drift"] == [
+            {"sku": "STK-2", "product_id": "STK-2", "level": "product", "local": 4, "remote": 0}
+        ]
+        assert (await ac.get("/products/STK-2")).json()["stock"] == 0
+
+        # Caught up: the platform validates the repeated cursor with its ETag (304)
+        report = (await ac.post("/admin/sync-stock", headers=headers)).json()
+        assert (report["pulled"], report["cursor"]) == (0, "c3")
+        stub.requests.clear()
+        report = (await ac.post("/admin/sync-stock", headers=headers)).json()
+        assert report["not_modified"] is True
+        assert polls(stub) == [("c3", '"c3-0"')]
@@ -0,0 +1,78 @@
+import pytest
+from httpx import AsyncClient, ASGITransport
+from main import app
+from services.suggest import SuggestIndex
+from conftest import STORE_KEY
+
+class FakeProduct:
+    def __init__(self, id, name, category=None, labels=()):
+        self.id = id
+        self.name = name
+        self.category = category
+        self.categories = []
+        self.labels = [type("L", (), {"name": l}) for l in labels]
+        self.is_active = True
+
+def test_prefix_index_matches_any_word_and_removes():
+    index = SuggestIndex()
+    index._loaded = True
+    index._add("P1", *index._product_terms(FakeProduct("P1", "Bombacha de Campo", "Indumentaria", ["Oferta"])))
+    index._add("P2", *index._product_terms(FakeProduct("P2", "Boina Vasca", "Indumentaria")))
+
+    results = index.suggest(None, "Bo")
+    assert [s["id"] for s in results["product"]] == ["P2", "P1"]
+
+    results = index.suggest(None, "camp")
+    assert results["product"] == [{"value": "Bombacha de Campo", "id": "P1"}]
+
+    results = index.suggest(None, "indu")
+    assert results["category"] == [{"value": "Indumentaria"}]
+
+    index._remove("P1")
+    assert index.suggest(None, "camp")["product"] == []
+    assert index.suggest(None, "ofer")["label"] == []
+    assert index.suggest(None, "indu")["category"] == [{"value": "Indumentaria"}]
+
+def test_bulk_load_matches_incremental_index_and_short_prefix_stops_early():
+    products = [FakeProduct(f"B{i}", f"Alfajor {i:04d}", "Almacén", ["Artesanal"] if i % 500 == 0 else [])
+                for i in range(2000)]
+    incremental, bulk = SuggestIndex(), SuggestIndex()
+    incremental._loaded = bulk._loaded = True
+    for product in products:
+        incremental._add(product.id, *incremental._product_terms(product))
+        bulk._add(product.id, *bulk._product_terms(product), bulk=True)
+    for keys in bulk._keys.values():
+        keys.sort()
+    assert bulk._keys == incremental._keys
+
+    # A full product bucket stops the product scan even though labels match few keys
+    class CountingList(list):
+        reads = 0
+        def __getitem__(self, position):
+            CountingList.reads += 1
+            return super().__getitem__(position)
+    bulk._keys["product"] = CountingList(bulk._keys["product"])
+    results = bulk.suggest(None, "a")
+    assert [s["id"] for s in results["product"]] == ["B0", "B1", "B2", "B3", "B4"]
+    assert results["label"] == [{"value": "Artesanal"}]
+    assert CountingList.reads < 20
+
+@pytest.mark.asyncio
+async def test_suggest_endpoint_follows_webhook(monkeypatch):
+    monkeypatch.setenv("STORE_API_KEY", STORE_KEY)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        payload = {"id": "SUG-001", "sku": "SUG-001", "name": "Alpargata Ñandú", "price": 10.0, "category": "Calzado"}
+        await ac.post("/api/webhooks/products", json=payload, headers={"x-store-api-key": STORE_KEY})
+
+        response = await ac.get("/products/suggest", params={"q": "nand"})
+        assert response.status_code == 200
+        assert {"value": "Alpargata Ñandú", "id": "SUG-001"} in response.json()["products"]
+
+        payload["name"] = "Alpargata Rústica"
+        await ac.post("/api/webhooks/products", json=payload, headers={"x-store-api-key": STORE_KEY})
+
+        response = await ac.get("/products/suggest", params={"q": "nand"})
+        assert response.json()["products"] == []
+        response = await ac.get("/products/suggest", params={"q": "rust"})
+        assert response.json()["products"][0]["id"] == "SUG-001"
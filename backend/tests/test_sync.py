@@ -0,0 +1,133 @@
+import json
+import time
+import pytest
+from httpx import AsyncClient, ASGITransport
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+import models
+import schemas
+import services.product_sync
+import services.search
+from main import app
+
+@pytest.mark.asyncio
+async def test_sync_upserts_products_categories_and_variants():
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        payload = {"products": [
+            {"sku": "SYN-001", "name": "Cinto Syntest", "price": 100.0, "stock": 0, "category": "Cintos",
+             "variants": [{"sku": "SYN-001-S", "stock": 2}, {"sku": "SYN-001-M", "stock": 3}]},
+            {"sku": "SYN-002", "name": "Faja Syntest", "price": 50.0, "stock": 4, "category": "Fajas"},
+        ]}
+        response = await ac.post("/integration/products/sync", json=payload)
+        assert response.json()["details"] == {"created": 2, "updated": 0, "errors": 0}
+
+        payload["products"][0]["price"] = 120.0
+        payload["products"][0]["variants"] = [{"sku": "SYN-001-M", "stock": 5}, {"sku": "SYN-001-L", "stock": 1}]
+        response = await ac.post("/integration/products/sync", json=payload)
+        assert response.json()["details"] == {"created": 0, "updated": 2, "errors": 0}
+
+        items = (await ac.get("/products", params={"search": "syntest", "sort": "name"})).json()["items"]
+        cinto = items[0]
+        assert cinto["effective_price"] == 120.0
+        assert cinto["stock"] == 6
+        assert sorted(v["sku"] for v in cinto["variants"]) == ["SYN-001-L", "SYN-001-M"]
+        assert [c["name"] for c in cinto["categories"]] == ["Cintos"]
+
+
+@pytest.mark.asyncio
+async def test_sync_isolates_failing_items_and_reports_them():
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        await ac.post("/integration/products/sync", json={"products": [
+            {"sku": "SYE-001", "external_id": "EXT-SYE-1", "name": "Sye uno", "price": 10.0, "stock": 1},
+        ]})
+        # SYE-003 reuses SYE-001's external_id: unique violation on flush
+        response = await ac.post("/integration/products/sync", json={"products": [
+            {"sku": "SYE-002", "name": "Sye dos", "price": 10.0, "stock": 1},
+            {"sku": "SYE-003", "external_id": "EXT-SYE-1", "name": "Sye tres", "price": 10.0, "stock": 1},
+            {"sku": "SYE-004", "name": "Sye cuatro", "price": 10.0, "stock": 1},
+        ]})
+        body = response.json()
+        assert body["details"] == {"created": 2, "updated": 0, "errors": 1}
+        assert [error["sku"] for error in body["errors"]] == ["SYE-003"]
+
+        ids = {p["sku"] for p in (await ac.get("/products", params={"search": "sye"})).json()["items"]}
+        assert ids == {"SYE-001", "SYE-002", "SYE-004"}
+
+
+def test_benchmark_bulk_sync_10k(tmp_path):
+    """
+    Benchmark: sync de 10k productos (con 2 variantes cada uno), alta y luego actualización.
+    """
+    engine = create_engine(f"sqlite:///{tmp_path / 'sync.db'}")
+    models.Base.metadata.create_all(bind=engine)
+    services.search.ensure_search_index(engine)
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    items = [
+        schemas.ProductCreate(
+            sku=f"S{i:05d}", name=f"Producto {i}", price=float(i % 300 + 1), stock=0, category=f"Cat {i % 20}",
+            variants=[{"sku": f"S{i:05d}-{size}", "size": size, "stock": 1} for size in ("S", "M")]
+        )
+        for i in range(10_000)
+    ]
+    db = sessionmaker(bind=engine)()
+    try:
+        for label, expected in (("insert", {"created": 10_000, "updated": 0, "errors": 0}),
+                                ("update", {"created": 0, "updated": 10_000, "errors": 0})):
+            if label == "update":
+                for item in items[::2]:
+                    item.price += 1
+            statements.clear()
+            started = time.perf_counter()
+            results, synced_ids, failures = services.product_sync.sync_products(db, items)
+            seconds = time.perf_counter() - started
+
+            assert results == expected
+            assert failures == []
+            assert len(synced_ids) == 10_000
+            print(f"\n10k products sync ({label}): {seconds * 1000:.0f} ms, {len(statements)} statements")
+            # Chunked IN queries + executemany batches, never per-item round trips
+            assert len(statements) < 400
+
+        assert db.query(models.ProductVariant).count() == 20_000
+        assert db.query(models.Product).filter(models.Product.stock == 2).count() == 10_000
+        assert db.query(models.Product).filter(models.Product.effective_price == 2.0).count() > 0
+    finally:
+        db.close()
+        engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_ndjson_stream_ingests_in_batches(monkeypatch):
+    monkeypatch.setattr(services.product_sync, "SYNC_CHUNK_SIZE", 2)
+    lines = [
+        json.dumps({"sku": f"NDJ-{i}", "name": f"Ndjtest {i}", "price": 10.0 + i, "stock": 1})
+        for i in range(5)
+    ]
+    lines.insert(3, '{"sku": "NDJ-BAD", "name": "sin precio"}')
+
+    async def body():
+        # Split mid-line to exercise the incremental parser
+        raw = ("\n".join(lines)).encode()
+        for start in range(0, len(raw), 37):
+            yield raw[start:start + 37]
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        response = await ac.post(
+            "/integration/products/sync/stream", content=body(), headers={"content-type": "application/x-ndjson"}
+        )
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        progress = [json.loads(line) for line in response.text.splitlines()]
+        assert len(progress) == 4  # 3 batches + summary
+        assert progress[-1]["details"] == {"created": 5, "updated": 0, "errors": 1}
+        assert progress[-1]["processed"] == 6
+        assert [e["line"] for p in progress[:-1] for e in p["errors"]] == [4]
+
+        total = (await ac.get("/products", params={"search": "ndjtest"})).json()["total"]
+        assert total == 5
+
+        response = await ac.post("/integration/products/sync/stream", json={"products": []})
+        assert response.status_code == 415
@@ -0,0 +1,117 @@
+import pytest
+from httpx import AsyncClient, ASGITransport
+import database
+import services.webhook_queue
+from main import app
+from test_query_counts import count_queries
+from conftest import STORE_KEY
+
+def writes(statements):
+    # "INSERT INTO t", "UPDATE t SET", "DELETE FROM t" -> "<VERB> t"
+    return [s.split()[0] + " " + s.split()[1 if s.startswith("UPDATE") else 2]
+            for s in statements if s.startswith(("INSERT", "UPDATE", "DELETE"))]
+
+@pytest.mark.asyncio
+async def test_webhook_skips_unchanged_payload_and_writes_only_diffs(monkeypatch):
+    monkeypatch.setenv("STORE_API_KEY", STORE_KEY)
+    headers = {"x-store-api-key": STORE_KEY}
+    payload = {
+        "id": "WHK-001", "sku": "WHK-001", "name": "Tirador", "price": 300.0, "category": "Tiradores",
+        "images": ["http://img/a.jpg", "http://img/b.jpg"],
+        "variants": [{"sku": "WHK-001-S", "stock": 1}, {"sku": "WHK-001-M", "stock": 2}]
+    }
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        assert (await ac.post("/api/webhooks/products", json=payload, headers=headers)).status_code == 200
+
+        with count_queries() as statements:
+            response = await ac.post("/api/webhooks/products", json=payload, headers=headers)
+        assert response.json()["message"] == "Product unchanged"
+        assert writes(statements) == []
+
+        payload["images"] = ["http://img/b.jpg", "http://img/a.jpg"]
+        payload["variants"][1]["stock"] = 5
+        with count_queries() as statements:
+            response = await ac.post("/api/webhooks/products", json=payload, headers=headers)
+        assert response.json()["message"] == "Product synced successfully"
+        written = writes(statements)
+        assert "DELETE product_images" not in written
+        assert "INSERT product_images" not in written
+        assert written.count("UPDATE product_variants") == 1
+
+        product = (await ac.get("/products/WHK-001")).json()
+        assert product["stock"] == 6
+        assert [i["url"] for i in sorted(product["product_images"], key=lambda i: i["display_order"])] == \
+            payload["images"]
+
+        # A local edit expires the hash: the same payload is applied again
+        await ac.post("/admin/products/WHK-001/images", json={"url": "http://img/admin.jpg"})
+        response = await ac.post("/api/webhooks/products", json=payload, headers=headers)
+        assert response.json()["message"] == "Product synced successfully"
+        product = (await ac.get("/products/WHK-001")).json()
+        assert len(product["product_images"]) == 2
+
+@pytest.mark.asyncio
+async def test_async_webhooks_are_coalesced_per_product(monkeypatch):
+    monkeypatch.setenv("STORE_API_KEY", STORE_KEY)
+    headers = {"x-store-api-key": STORE_KEY}
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        job_ids = []
+        for price in (100.0, 200.0, 300.0):
+            payload = {"id": "WHQ-001", "sku": "WHQ-001", "name": "Bozal", "price": price}
+            response = await ac.post("/api/webhooks/products", params={"mode": "async"}, json=payload, headers=headers)
+            assert response.status_code == 202
+            job_ids.append(response.json()["job_id"])
+        payload = {"id": "WHQ-002", "sku": "WHQ-002", "name": "Cabezada", "price": 50.0}
+        other = (await ac.post("/api/webhooks/products", params={"mode": "async"}, json=payload, headers=headers))
+        job_ids.append(other.json()["job_id"])
+
+        assert (await ac.get(f"/api/webhooks/jobs/{job_ids[0]}", headers=headers)).json()["status"] == "pending"
+
+        db = database.SessionLocal()
+        try:
+            assert services.webhook_queue.process_batch(db) == 4
+        finally:
+            db.close()
+
+        statuses = [(await ac.get(f"/api/webhooks/jobs/{job_id}", headers=headers)).json() for job_id in job_ids]
+        assert [s["status"] for s in statuses] == ["superseded", "superseded", "done", "done"]
+        assert statuses[2]["result"] == "updated"
+        assert (await ac.get("/products/WHQ-001")).json()["price"] == 300.0
+        assert (await ac.get("/products/WHQ-002")).json()["price"] == 50.0
+
+        response = await ac.post("/api/webhooks/products", params={"mode": "later"}, json=payload, headers=headers)
+        assert response.status_code == 400
+
+@pytest.mark.asyncio
+async def test_batch_webhook_returns_per_item_results(monkeypatch):
+    monkeypatch.setenv("STORE_API_KEY", STORE_KEY)
+    headers = {"x-store-api-key": STORE_KEY}
+    batch = [
+        {"id": f"WHB-{i}", "sku": f"WHB-{i}", "name": f"Whbtest {i}", "price": 10.0 * (i + 1),
+         "images": [f"http://img/whb-{i}.jpg"], "variants": [{"sku": f"WHB-{i}-U", "stock": i}]}
+        for i in range(4)
+    ]
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        response = await ac.post("/api/webhooks/products/batch", json=batch, headers=headers)
+        assert response.json()["details"] == {"updated": 4, "unchanged": 0, "error": 0}
+
+        batch[1]["price"] = 99.0
+        # Same new SKU twice: the unique constraint fails this item only
+        batch[2]["variants"] = [{"sku": "WHB-DUP", "stock": 1}, {"sku": "WHB-DUP", "stock": 2}]
+        # Takes WHB-0's variant: WHB-0 is no longer what its last payload described
+        batch[3]["variants"].append({"sku": "WHB-0-U", "stock": 5})
+        with count_queries() as statements:
+            response = await ac.post("/api/webhooks/products/batch", json=batch, headers=headers)
+        results = response.json()["results"]
+        assert [r["status"] for r in results] == ["unchanged", "updated", "error", "updated"]
+        # Set-based: query count does not grow with the batch size
+        assert len([s for s in statements if s.startswith("SELECT")]) < 13
+
+        assert (await ac.get("/products/WHB-1")).json()["price"] == 99.0
+        assert (await ac.get("/products/WHB-2")).json()["variants"][0]["sku"] == "WHB-2-U"
+        response = await ac.post("/api/webhooks/products", json=batch[0], headers=headers)
+        assert response.json()["message"] == "Product synced successfully"
+        assert (await ac.get("/api/webhooks/products/batch", headers=headers)).status_code == 405
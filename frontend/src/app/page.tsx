@@ -13,7 +13,8 @@ interface Product {
   sku: string;
   name: string;
   price: number;
-  stock: number;
+  stock?: number;
+  in_stock?: boolean;
   image_url?: string;
   description?: string;
   external_id?: string;
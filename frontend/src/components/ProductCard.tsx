@@ -11,12 +11,14 @@ interface Product {
     sku: string;
     name: string;
     price: number;
-    stock: number;
+    stock?: number;
+    in_stock?: boolean; // Card view (/products?view=card)
     image_url?: string;
     description?: string;
     labels?: Label[];
     price_override?: number | null;
     discount_percentage?: number;
+    effective_price?: number | null; // Computed by the API
 }
 
 interface ProductCardProps {
@@ -24,7 +26,7 @@ interface ProductCardProps {
 }
 
 const ProductCard: React.FC<ProductCardProps> = ({ product }) => {
-    const hasStock = product.stock > 0;
+    const hasStock = product.in_stock ?? (product.stock ?? 0) > 0;
 
     // --- Price Logic ---
     const originalPrice = product.price;
@@ -32,7 +34,9 @@ const ProductCard: React.FC<ProductCardProps> = ({ product }) => {
     const hasPercentage = (product.discount_percentage ?? 0) !== 0;
 
     let finalPrice = originalPrice;
-    if (hasOverride) {
+    if (product.effective_price !== null && product.effective_price !== undefined) {
+        finalPrice = product.effective_price;
+    } else if (hasOverride) {
         finalPrice = product.price_override!;
     } else if (hasPercentage) {
         finalPrice = originalPrice * (1 - (product.discount_percentage! / 100));
@@ -26,7 +26,8 @@ export async function fetchProducts(page = 1, limit = 9, categories?: string[],
     const skip = (page - 1) * limit;
     const queryParams = new URLSearchParams({
       skip: skip.toString(),
-      limit: limit.toString()
+      limit: limit.toString(),
+      view: 'card' // Compact items: only what ProductCard renders
     });
 
     if (categories && categories.length > 0) {
@@ -36,7 +37,7 @@ export async function fetchProducts(page = 1, limit = 9, categories?: string[],
     if (minPrice !== undefined) queryParams.append('min_price', minPrice.toString());
     if (maxPrice !== undefined) queryParams.append('max_price', maxPrice.toString());
 
-    const res = await fetch(`${API_URL}/products?${queryParams.toString()}`, { cache: 'no-store' });
+    const res = await fetch(`${API_URL}/products?${queryParams.toString()}`, { next: { revalidate: 30 } }); // API sends ETag + Cache-Control
     if (!res.ok) throw new Error("Failed to fetch products");
     return await res.json();
   } catch (error) {
@@ -47,7 +48,7 @@ export async function fetchProducts(page = 1, limit = 9, categories?: string[],
 
 export async function fetchCategories() {
   try {
-    const res = await fetch(`${API_URL}/products/categories`, { cache: 'no-store' }); // Disable cache for now
+    const res = await fetch(`${API_URL}/products/categories`, { next: { revalidate: 30 } });
     if (!res.ok) throw new Error("Failed to fetch categories");
     return await res.json();
   } catch (error) {
@@ -69,7 +70,7 @@ export async function fetchConfig() {
 
 export async function getProduct(id: string) {
   try {
-    const res = await fetch(`${API_URL}/products/${id}`, { cache: 'no-store' });
+    const res = await fetch(`${API_URL}/products/${id}`, { next: { revalidate: 30 } });
     if (!res.ok) throw new Error("Failed to fetch product");
     return await res.json();
   } catch (error) {
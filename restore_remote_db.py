@@ -4,10 +4,10 @@ import sys
 import os
 import requests
 import json
-import time
 
 # Configuration
 PRODUCTS_CSV = "products_export_2026-02-06.csv"
+BATCH_SIZE = 100 # Products per request to /api/webhooks/products/batch
 
 def parse_variant_option(option_value):
     """
@@ -133,26 +133,29 @@ def main():
     }
     products_map["TEST-PRICE-1"] = test_prod
     
-    # 3. UPLOAD (Using Webhook endpoint for full detail)
-    print(f"\n3. Cargando {len(products_map)} productos via Webhook...")
+    # 3. UPLOAD (Using batch Webhook endpoint for full detail)
+    print(f"\n3. Cargando {len(products_map)} productos via Webhook (lotes de {BATCH_SIZE})...")
     
-    webhook_url = f"{base_url}/webhooks/products"
+    webhook_url = f"{base_url}/api/webhooks/products/batch"
+    headers = {"x-store-api-key": os.getenv("STORE_API_KEY", "")}
     
-    count = 0
-    for handle, prod in products_map.items():
-        count += 1
-        print(f"[{count}/{len(products_map)}] Enviando {prod['name']}...", end=" ")
+    products = list(products_map.values())
+    for start in range(0, len(products), BATCH_SIZE):
+        batch = products[start:start + BATCH_SIZE]
+        print(f"[{start + len(batch)}/{len(products)}] Enviando lote...", end=" ")
         
         try:
-            res = requests.post(webhook_url, json=prod, timeout=10)
+            res = requests.post(webhook_url, json=batch, headers=headers, timeout=120)
             if res.status_code == 200:
-                print("✅ OK")
+                body = res.json()
+                print(f"✅ OK {body['details']}")
+                for result in body["results"]:
+                    if result["status"] == "error":
+                        print(f"   ❌ {result['id']}: {result['error']}")
             else:
-                print(f"❌ Error {res.status_code}")
+                print(f"❌ Error {res.status_code}: {res.text}")
         except Exception as e:
             print(f"❌ Excepción: {e}")
-            
-        time.sleep(0.1) # Rate limit
 
     print("\n✨ Proceso finalizado.")
 